@@ -0,0 +1,67 @@
+"""Shared helpers for the benchmark scripts.
+
+The scripts run against a throw-away SQLite file, so ``use_temp_database`` must
+be called before anything from ``src`` is imported.
+"""
+import os
+import statistics
+import sys
+import tempfile
+
+SRC_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+
+def use_temp_database(name: str = 'bench.db') -> str:
+    directory = tempfile.mkdtemp(prefix='fastapi-user-bench-')
+    path = os.path.join(directory, name)
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///%s' % path)
+    if SRC_PATH not in sys.path:
+        sys.path.insert(0, SRC_PATH)
+    return path
+
+
+def create_schema():
+    from db.base import Base
+    from db.base import shard_engines
+    import db.user  # noqa: F401  register the models
+
+    for engine in shard_engines:
+        Base.metadata.create_all(engine)
+
+
+def seed_users(count: int, password: str = 'Abc12345678', prefix: str = 'user') -> list[str]:
+    from app.user import hash_password
+    from db.base import session_local
+    from db.user import DBUser
+
+    names = ['%s_%s' % (prefix, i) for i in range(count)]
+    password_hash = hash_password(password)
+    with session_local() as session:
+        session.bulk_insert_mappings(DBUser, [{'name': name, 'password_hash': password_hash} for name in names])
+        session.commit()
+    return names
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies: list[float], elapsed: float) -> dict:
+    return {
+        'requests': len(latencies),
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'mean_ms': statistics.fmean(latencies) * 1000 if latencies else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+    }
+
+
+def print_row(label: str, summary: dict):
+    print('%-28s %8d req %10.1f req/s  p50 %7.2f ms  p95 %7.2f ms  p99 %7.2f ms' % (
+        label, summary['requests'], summary['rps'], summary['p50_ms'], summary['p95_ms'], summary['p99_ms'],
+    ))
@@ -0,0 +1,99 @@
+"""Verify and bulk create latency under overload, with and without admission control.
+
+Verifications arrive at `--rate` per second, more than the default KDF lets this host serve, while a
+bulk creation of `--bulk` users arrives every second. Arrivals do not wait for earlier responses,
+so without admission control the backlog and the latency grow for as long as the overload lasts.
+
+Usage: python benchmarks/bench_admission.py [--rate 40] [--duration 15] [--bulk 20]
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+from _common import create_schema
+from _common import print_row
+from _common import seed_users
+from _common import summarize
+from _common import use_temp_database
+
+
+def build_app(admission: bool):
+    from fastapi import FastAPI
+
+    from admission import AdmissionMiddleware
+    from routers.user import router
+
+    app = FastAPI()
+    app.include_router(router)
+    if admission:
+        app.add_middleware(AdmissionMiddleware)
+    return app
+
+
+async def drive(app, names: list[str], rate: float, duration: float, bulk: int) -> dict:
+    import httpx
+
+    latencies = {'verify': [], 'create': []}
+    rejected = {'verify': 0, 'create': 0}
+    counter = itertools.count()
+
+    async def call(kind: str, url: str, payload):
+        start = time.perf_counter()
+        response = await client.post(url, json=payload)
+        if response.status_code == 503:
+            rejected[kind] += 1
+            return
+        assert response.status_code in (200, 201), response.text
+        latencies[kind].append(time.perf_counter() - start)
+
+    async def arrivals(kind: str, interval: float, request):
+        tasks = []
+        deadline = time.perf_counter() + duration
+        while time.perf_counter() < deadline:
+            tasks.append(asyncio.create_task(request()))
+            await asyncio.sleep(interval)
+        await asyncio.gather(*tasks)
+
+    def verify():
+        name = names[next(counter) % len(names)]
+        return call('verify', '/users/verify_user/', {'username': name, 'password': 'Abc12345678'})
+
+    def create():
+        batch = next(counter)
+        users = [{'username': 'bulk_%d_%d' % (batch, i), 'password': 'Abc12345678'} for i in range(bulk)]
+        return call('create', '/users/create_users/', users)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(arrivals('verify', 1 / rate, verify), arrivals('create', 1, create))
+        elapsed = time.perf_counter() - start
+    return {kind: (summarize(values, elapsed), rejected[kind]) for kind, values in latencies.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rate', type=float, default=40)
+    parser.add_argument('--duration', type=float, default=15)
+    parser.add_argument('--bulk', type=int, default=20)
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+
+    use_temp_database()
+    create_schema()
+    names = seed_users(args.users)
+
+    async def run():
+        # One event loop for both runs, the async engine's pool is bound to it
+        for admission in (False, True):
+            results = await drive(build_app(admission), names, args.rate, args.duration, args.bulk)
+            for kind, (summary, rejected) in results.items():
+                print_row('%s, admission %s' % (kind, 'on' if admission else 'off'), summary)
+                print('%28s %8d rejected with 503' % ('', rejected))
+
+    asyncio.run(run())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""Compare the sync (threadpool) and async request paths at high concurrency.
+
+Usage: python benchmarks/bench_async_db.py [--concurrency 200] [--requests 4000]
+"""
+import argparse
+import asyncio
+import time
+
+from _common import create_schema
+from _common import print_row
+from _common import seed_users
+from _common import summarize
+from _common import use_temp_database
+
+
+def build_app(async_mode: bool):
+    from fastapi import APIRouter
+    from fastapi import FastAPI
+
+    from routers import user as user_router
+
+    router = APIRouter(prefix='/users')
+    if async_mode:
+        router.add_api_route('/verify_user/', user_router.async_verify_user, methods=['POST'])
+    else:
+        router.add_api_route('/verify_user/', user_router.verify_user, methods=['POST'])
+    app = FastAPI()
+    app.include_router(router)
+    return app
+
+
+async def drive(app, names: list[str], concurrency: int, total: int) -> dict:
+    import httpx
+
+    latencies = []
+    counter = iter(range(total))
+
+    async def worker(client):
+        for i in counter:
+            payload = {'username': names[i % len(names)], 'password': 'Abc12345678'}
+            start = time.perf_counter()
+            response = await client.post('/users/verify_user/', json=payload)
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.text
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return summarize(latencies, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--requests', type=int, default=4000)
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+
+    use_temp_database()
+    create_schema()
+    names = seed_users(args.users)
+
+    for label, async_mode in (('sync (threadpool)', False), ('async', True)):
+        summary = asyncio.run(drive(build_app(async_mode), names, args.concurrency, args.requests))
+        print_row('verify_user %s' % label, summary)
+
+
+if __name__ == '__main__':
+    main()
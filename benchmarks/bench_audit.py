@@ -0,0 +1,82 @@
+"""Cost of the audit log: verify_user requests through the app with each audit backend.
+
+Each setting runs in a fresh interpreter on its own database. `batch 1` writes every event in its
+own transaction, close to what an insert inside verify_user would cost the database. The KDF is
+set to a single PBKDF2 iteration so that the difference is not hidden by hashing.
+
+Usage: python benchmarks/bench_audit.py [--requests 5000] [--concurrency 20]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+from _common import SRC_PATH
+from _common import use_temp_database
+
+SETTINGS = {
+    'off': {'AUDIT_BACKEND': ''},
+    'database': {'AUDIT_BACKEND': 'database'},
+    'database, batch 1': {'AUDIT_BACKEND': 'database', 'AUDIT_BATCH_SIZE': '1'},
+    'file': {'AUDIT_BACKEND': 'file'},
+}
+
+CHILD = '''
+import asyncio, json, sys, time
+import httpx
+import main
+from app.audit import audit_log
+
+async def run(requests, concurrency):
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await client.post("/users/create_user/", json={"username": "bench_user", "password": "Abc12345678"})
+
+            async def worker(count):
+                for _ in range(count):
+                    response = await client.post(
+                        "/users/verify_user/", json={"username": "bench_user", "password": "Abc12345678"},
+                    )
+                    assert response.status_code == 200, response.text
+
+            start = time.perf_counter()
+            await asyncio.gather(*[worker(requests // concurrency) for _ in range(concurrency)])
+            elapsed = time.perf_counter() - start
+    return {"rps": requests // concurrency * concurrency / elapsed, **audit_log.stats()}
+
+print(json.dumps(asyncio.run(run(int(sys.argv[1]), int(sys.argv[2])))))
+'''
+
+
+def run(settings: dict, requests: int, concurrency: int, database: str) -> dict:
+    env = dict(
+        os.environ, DATABASE_URL='sqlite:///%s' % database, MIGRATION_LOCK_PATH=database + '.lock',
+        AUDIT_FILE_PATH=database + '.audit.ndjson', **settings,
+    )
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, str(requests), str(concurrency)],
+        cwd=SRC_PATH, env=env, check=True, capture_output=True,
+    ).stdout
+    return json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=20)
+    args = parser.parse_args()
+
+    os.environ['PASSWORD_HASH_ALGORITHM'] = 'pbkdf2_sha256'
+    os.environ['PASSWORD_PBKDF2_ITERATIONS'] = '1'
+    path = use_temp_database()
+    for i, (label, settings) in enumerate(SETTINGS.items()):
+        result = run(settings, args.requests, args.concurrency, '%s.%d' % (path, i))
+        print('%-20s %10.1f req/s  written %6d  dropped %6d' % (
+            label, result['rps'], result['written'], result['dropped'],
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Per-lookup latency of the memory-mapped password blocklist, against a Python set.
+
+Builds a blocklist of random passwords with the builder tool, then looks up listed and unlisted
+passwords. The set is only there to show what the same list costs in memory per worker.
+
+Usage: python benchmarks/bench_blocklist.py [--passwords 2000000] [--lookups 200000]
+"""
+import argparse
+import os
+import random
+import string
+import tempfile
+import time
+import tracemalloc
+
+from _common import percentile
+from _common import use_temp_database
+
+
+def random_passwords(count: int) -> list[str]:
+    alphabet = string.ascii_letters + string.digits
+    return [''.join(random.choices(alphabet, k=random.randint(8, 16))) for _ in range(count)]
+
+
+def time_lookups(blocklist, passwords: list[str]) -> list[float]:
+    latencies = []
+    for password in passwords:
+        start = time.perf_counter()
+        password in blocklist
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--passwords', type=int, default=2000000)
+    parser.add_argument('--lookups', type=int, default=200000)
+    args = parser.parse_args()
+
+    use_temp_database()
+    from app.blocklist import PasswordBlocklist
+    from tools.build_password_blocklist import build
+
+    passwords = random_passwords(args.passwords)
+    directory = tempfile.mkdtemp(prefix='fastapi-user-bench-')
+    source = os.path.join(directory, 'passwords.txt')
+    output = os.path.join(directory, 'blocklist.bin')
+    with open(source, 'w') as file:
+        file.write('\n'.join(passwords))
+    start = time.perf_counter()
+    count = build([source], output, run_size=args.passwords // 4 + 1)
+    print('built %d entries in %.1f s, file %.1f MB' % (count, time.perf_counter() - start, os.path.getsize(output) / 1e6))
+
+    tracemalloc.start()
+    password_set = set(passwords)
+    set_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    print('python set of the same list: %.1f MB per worker, without the strings' % (set_bytes / 1e6))
+
+    blocklist = PasswordBlocklist(output)
+    listed = random.sample(passwords, min(args.lookups, len(passwords)))
+    unlisted = random_passwords(args.lookups)
+    for label, structure in (('mmap blocklist', blocklist), ('python set', password_set)):
+        for kind, sample in (('listed', listed), ('unlisted', unlisted)):
+            latencies = time_lookups(structure, sample)
+            print('%-15s %-9s p50 %6.2f us  p99 %6.2f us  mean %6.2f us' % (
+                label, kind, percentile(latencies, 50) * 1e6, percentile(latencies, 99) * 1e6,
+                sum(latencies) / len(latencies) * 1e6,
+            ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Password verification throughput against KDF cost and hashing pool size.
+
+Usage: python benchmarks/bench_hashing.py [--seconds 2] [--workers 1 2 4] [--scrypt-n 4096 16384 32768]
+"""
+import argparse
+import asyncio
+import time
+
+from _common import use_temp_database
+
+
+async def drive(service, password_hash: str, concurrency: int, seconds: float) -> int:
+    done = 0
+    deadline = time.perf_counter() + seconds
+
+    async def worker():
+        nonlocal done
+        while time.perf_counter() < deadline:
+            assert await service.async_verify('Abc12345678', password_hash)
+            done += 1
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--seconds', type=float, default=2.0)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--scrypt-n', type=int, nargs='+', default=[2 ** 12, 2 ** 14, 2 ** 15])
+    parser.add_argument('--pbkdf2-iterations', type=int, nargs='+', default=[100000, 600000])
+    parser.add_argument('--executor', choices=['thread', 'process'], default='thread')
+    args = parser.parse_args()
+
+    use_temp_database()
+    from app.hashing import PasswordHasher
+    from app.hashing import PasswordHashingService
+
+    hashers = [('scrypt n=%s' % n, PasswordHasher(algorithm='scrypt', scrypt_n=n)) for n in args.scrypt_n]
+    hashers += [
+        ('pbkdf2 i=%s' % i, PasswordHasher(algorithm='pbkdf2_sha256', pbkdf2_iterations=i))
+        for i in args.pbkdf2_iterations
+    ]
+    for label, hasher in hashers:
+        password_hash = hasher.hash('Abc12345678')
+        start = time.perf_counter()
+        hasher.verify('Abc12345678', password_hash)
+        single_ms = (time.perf_counter() - start) * 1000
+        for workers in args.workers:
+            service = PasswordHashingService(hasher, workers=workers, kind=args.executor)
+            done = asyncio.run(drive(service, password_hash, workers * 4, args.seconds))
+            service.shutdown()
+            print('%-16s %6.1f ms/verify  %d %s workers  %8.1f verify/s' % (
+                label, single_ms, workers, args.executor, done / args.seconds,
+            ))
+
+
+if __name__ == '__main__':
+    main()
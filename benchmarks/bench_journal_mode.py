@@ -0,0 +1,85 @@
+"""Mixed create/verify traffic against SQLite in each journal mode.
+
+Threads share one engine like the sync handlers do. The KDF is set to a single PBKDF2
+iteration and the credential cache is off, so the numbers show database contention.
+
+Usage: python benchmarks/bench_journal_mode.py [--threads 16] [--operations 4000] [--create-ratio 0.2]
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import os
+import random
+import time
+
+from _common import print_row
+from _common import summarize
+from _common import use_temp_database
+
+MODES = [
+    ('DELETE', 'FULL'),
+    ('WAL', 'FULL'),
+    ('WAL', 'NORMAL'),
+]
+
+
+def run(journal_mode: str, synchronous: str, args) -> tuple[dict, int]:
+    path = use_temp_database('%s_%s.db' % (journal_mode, synchronous))
+    from sqlalchemy.exc import OperationalError
+    from sqlalchemy.orm import sessionmaker
+
+    from app.user import create_user
+    from app.user import verify_user
+    from db.base import Base
+    from db.base import build_engine
+
+    engine = build_engine('sqlite:///%s' % path, pragmas={'journal_mode': journal_mode, 'synchronous': synchronous})
+    Base.metadata.create_all(engine)
+    session_factory = sessionmaker(bind=engine, autoflush=False)
+    names = ['seed_%s' % i for i in range(100)]
+    with session_factory() as session:
+        for name in names:
+            create_user(name, 'Abc12345678', session)
+
+    errors = 0
+
+    def operation(i: int) -> float:
+        nonlocal errors
+        start = time.perf_counter()
+        try:
+            with session_factory() as session:
+                if random.random() < args.create_ratio:
+                    create_user('user_%s' % i, 'Abc12345678', session)
+                else:
+                    verify_user(random.choice(names), 'Abc12345678', session)
+        except OperationalError:
+            errors += 1
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        latencies = list(executor.map(operation, range(args.operations)))
+    summary = summarize(latencies, time.perf_counter() - start)
+    engine.dispose()
+    return summary, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--operations', type=int, default=4000)
+    parser.add_argument('--create-ratio', type=float, default=0.2)
+    args = parser.parse_args()
+
+    os.environ['PASSWORD_HASH_ALGORITHM'] = 'pbkdf2_sha256'
+    os.environ['PASSWORD_PBKDF2_ITERATIONS'] = '1'
+    os.environ['USER_CACHE_MAX_SIZE'] = '0'
+    os.environ['USERNAME_FILTER_ENABLED'] = '0'
+    for journal_mode, synchronous in MODES:
+        summary, errors = run(journal_mode, synchronous, args)
+        print_row('journal=%s sync=%s' % (journal_mode, synchronous), summary)
+        if errors:
+            print('  %d operations failed with "database is locked"' % errors)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,240 @@
+"""End-to-end load test of the user API under realistic traffic mixes.
+
+Drives the app of src/main.py in process through an ASGI transport by default, a local uvicorn
+with --uvicorn, or a running server with --url. Every scenario reports req/s and p50/p95/p99 and
+counts responses whose status code the operation does not expect as errors.
+
+Results can be saved with --output, and compared with --baseline: the script exits with status 1
+when a scenario lost more than --tolerance of its throughput, grew its p99 latency by as much,
+or returned errors. Baselines only compare runs of one machine, store them with --save-baseline.
+
+Usage: python benchmarks/bench_load.py [--scenario verify-heavy ...] [--requests 2000] [--concurrency 50]
+                                       [--output results.json] [--baseline baseline.json] [--save-baseline]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+
+from _common import SRC_PATH
+from _common import summarize
+from _common import use_temp_database
+
+PASSWORD = 'Abc12345678'
+WRONG_PASSWORD = 'Wrong1234567'
+# Share of each operation in the traffic of a scenario
+SCENARIOS = {
+    'create-heavy': {'create': 0.8, 'verify': 0.2},
+    'verify-heavy': {'create': 0.05, 'verify': 0.95},
+    'wrong-password-storm': {'verify_wrong_password': 0.9, 'verify': 0.1},
+    'unknown-user-flood': {'verify_unknown_user': 0.9, 'verify': 0.1},
+}
+# 429 once an account is locked out
+EXPECTED_STATUS = {
+    'create': {201},
+    'verify': {200},
+    'verify_wrong_password': {401, 429},
+    'verify_unknown_user': {404},
+}
+
+
+class Traffic:
+    """Builds the requests of the operations, with names unique to this run."""
+
+    def __init__(self, run_id: str, users: int, victims: int):
+        self.run_id = run_id
+        self.users = ['u%s_%d' % (run_id, i) for i in range(users)]
+        # Kept apart from `users`, whose verifications must not be locked out by the storm
+        self.victims = ['v%s_%d' % (run_id, i) for i in range(victims)]
+        self._created = 0
+        self._unknown = 0
+
+    def seed_requests(self) -> list[list[dict]]:
+        names = self.users + self.victims
+        return [
+            [{'username': name, 'password': PASSWORD} for name in names[start:start + 500]]
+            for start in range(0, len(names), 500)
+        ]
+
+    def request(self, operation: str) -> tuple[str, dict]:
+        if operation == 'create':
+            self._created += 1
+            return '/users/create_user/', {'username': 'c%s_%d' % (self.run_id, self._created), 'password': PASSWORD}
+        if operation == 'verify':
+            return '/users/verify_user/', {'username': random.choice(self.users), 'password': PASSWORD}
+        if operation == 'verify_wrong_password':
+            return '/users/verify_user/', {'username': random.choice(self.victims), 'password': WRONG_PASSWORD}
+        self._unknown += 1
+        return '/users/verify_user/', {'username': 'x%s_%d' % (self.run_id, self._unknown), 'password': PASSWORD}
+
+
+async def run_scenario(client, traffic: Traffic, mix: dict[str, float], requests: int, concurrency: int) -> dict:
+    operations = random.choices(list(mix), weights=list(mix.values()), k=requests)
+    latencies = []
+    statuses = {}
+    errors = 0
+    queue = iter(operations)
+
+    async def worker():
+        nonlocal errors
+        for operation in queue:
+            path, payload = traffic.request(operation)
+            start = time.perf_counter()
+            response = await client.post(path, json=payload)
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+            if response.status_code not in EXPECTED_STATUS[operation]:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    summary = summarize(latencies, time.perf_counter() - start)
+    summary['errors'] = errors
+    summary['statuses'] = {str(code): count for code, count in sorted(statuses.items())}
+    return summary
+
+
+async def drive(args, base_url: str, app=None) -> dict:
+    import httpx
+
+    if app is not None:
+        transport = httpx.ASGITransport(app=app)
+    else:
+        transport = httpx.AsyncHTTPTransport(limits=httpx.Limits(max_connections=args.concurrency))
+    traffic = Traffic(uuid.uuid4().hex[:8], args.users, args.victims)
+    results = {}
+    async with httpx.AsyncClient(transport=transport, base_url=base_url, timeout=60) as client:
+        for payload in traffic.seed_requests():
+            response = await client.post('/users/create_users/', json=payload)
+            response.raise_for_status()
+        for name in args.scenario:
+            results[name] = await run_scenario(client, traffic, SCENARIOS[name], args.requests, args.concurrency)
+    return results
+
+
+async def drive_in_process(args) -> dict:
+    import main
+
+    async with main.lifespan(main.app):
+        return await drive(args, 'http://bench', app=main.app)
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def drive_uvicorn(args) -> dict:
+    import httpx
+
+    port = _free_port()
+    base_url = 'http://127.0.0.1:%d' % port
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--port', str(port), '--log-level', 'warning'],
+        cwd=SRC_PATH, env=dict(os.environ),
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                httpx.get(base_url + '/').raise_for_status()
+                break
+            except httpx.HTTPError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise RuntimeError('uvicorn did not start')
+                time.sleep(0.1)
+        return asyncio.run(drive(args, base_url))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Describe the regressions of `results` against `baseline`, empty when there are none."""
+    regressions = []
+    for name, summary in results.items():
+        if summary['errors']:
+            regressions.append('%s: %d unexpected responses %s' % (name, summary['errors'], summary['statuses']))
+        reference = baseline.get(name)
+        if reference is None:
+            continue
+        if summary['rps'] < reference['rps'] * (1 - tolerance):
+            regressions.append('%s: %.1f req/s, baseline %.1f req/s' % (name, summary['rps'], reference['rps']))
+        if summary['p99_ms'] > reference['p99_ms'] * (1 + tolerance):
+            regressions.append('%s: p99 %.2f ms, baseline %.2f ms' % (name, summary['p99_ms'], reference['p99_ms']))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenario', nargs='+', choices=list(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument('--requests', type=int, default=2000, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--users', type=int, default=1000, help='accounts seeded for the verifications')
+    parser.add_argument('--victims', type=int, default=20, help='accounts hit by the wrong password storm')
+    parser.add_argument('--seed', type=int, default=0)
+    target = parser.add_mutually_exclusive_group()
+    target.add_argument('--uvicorn', action='store_true', help='serve the app with a local uvicorn')
+    target.add_argument('--url', help='drive a running server instead, with its own configuration')
+    parser.add_argument('--cheap-kdf', action=argparse.BooleanOptionalAction, default=True,
+                        help='hash with a single PBKDF2 iteration, so that the numbers are not all KDF')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    parser.add_argument('--save-baseline', action='store_true', help='write the results to --baseline instead')
+    parser.add_argument('--tolerance', type=float, default=0.15)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    if args.url is None:
+        if args.cheap_kdf:
+            os.environ['PASSWORD_HASH_ALGORITHM'] = 'pbkdf2_sha256'
+            os.environ['PASSWORD_PBKDF2_ITERATIONS'] = '1'
+        path = use_temp_database()
+        os.environ.setdefault('MIGRATION_LOCK_PATH', path + '.lock')
+    if args.url is not None:
+        results = asyncio.run(drive(args, args.url))
+    elif args.uvicorn:
+        results = drive_uvicorn(args)
+    else:
+        results = asyncio.run(drive_in_process(args))
+
+    for name, summary in results.items():
+        print('%-22s %6d req %9.1f req/s  p50 %7.2f ms  p95 %7.2f ms  p99 %7.2f ms  errors %d' % (
+            name, summary['requests'], summary['rps'], summary['p50_ms'], summary['p95_ms'], summary['p99_ms'],
+            summary['errors'],
+        ))
+    report = {
+        'target': args.url or ('uvicorn' if args.uvicorn else 'in-process'),
+        'python': platform.python_version(),
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'scenarios': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    if args.baseline and args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump(report, file, indent=2)
+        return
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)['scenarios']
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print('REGRESSION %s' % regression)
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
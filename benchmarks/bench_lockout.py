@@ -0,0 +1,47 @@
+"""Hit/miss/write cost of the lockout store backends.
+
+Usage: python benchmarks/bench_lockout.py [--entries 100000] [--operations 200000]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from _common import use_temp_database
+
+
+def measure(fn, names: list[str], operations: int) -> float:
+    start = time.perf_counter()
+    for i in range(operations):
+        fn(names[i % len(names)])
+    return (time.perf_counter() - start) / operations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--operations', type=int, default=200000)
+    args = parser.parse_args()
+
+    use_temp_database()
+    from app.lockout import MemoryLockoutStore
+    from app.lockout import SQLiteLockoutStore
+
+    directory = tempfile.mkdtemp(prefix='lockout-bench-')
+    stores = {
+        'memory': MemoryLockoutStore(max_entries=args.entries),
+        'sqlite': SQLiteLockoutStore(path=os.path.join(directory, 'lockout.db'), max_entries=args.entries),
+    }
+    known = ['known_%s' % i for i in range(args.entries)]
+    unknown = ['unknown_%s' % i for i in range(args.entries)]
+    for label, store in stores.items():
+        write = measure(store.record_failure, known, args.entries)
+        hit = measure(store.get, known, args.operations)
+        miss = measure(store.get, unknown, args.operations)
+        print('%-8s record_failure %7.2f us  get hit %7.2f us  get miss %7.2f us  size %d' % (
+            label, write, hit, miss, store.size(),
+        ))
+
+
+if __name__ == '__main__':
+    main()
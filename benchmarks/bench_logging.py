@@ -0,0 +1,79 @@
+"""Cost of the log calls of a flood of rejected creations: a synchronous file handler against the
+queued JSON pipeline with its rate limit.
+
+Every call is a create_user whose username is too short, so validation fails before any hashing
+or query, and logs a warning.
+
+Usage: python benchmarks/bench_logging.py [--requests 100000] [--threads 8]
+"""
+import argparse
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from _common import percentile
+from _common import use_temp_database
+
+
+def run(requests: int, threads: int) -> tuple[float, list[float]]:
+    from app.user import create_user
+
+    latencies = []
+
+    def worker(count: int):
+        local = []
+        for i in range(count):
+            start = time.perf_counter()
+            result = create_user(username='u%d' % (i % 10), password='Abc12345678', session=None)
+            local.append(time.perf_counter() - start)
+            assert not result.success
+        latencies.extend(local)
+
+    workers = [threading.Thread(target=worker, args=(requests // threads,)) for _ in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return time.perf_counter() - start, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=100000)
+    parser.add_argument('--threads', type=int, default=8)
+    args = parser.parse_args()
+
+    os.environ['AUDIT_BACKEND'] = ''
+    use_temp_database()
+
+    from logs import LogPipeline
+
+    directory = tempfile.mkdtemp(prefix='fastapi-user-bench-logs-')
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    for label in ('sync file handler', 'queue + rate limit'):
+        path = os.path.join(directory, label.replace(' ', '_') + '.log')
+        with open(path, 'w') as stream:
+            if label == 'sync file handler':
+                handler = logging.StreamHandler(stream)
+                handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s %(message)s'))
+                root.addHandler(handler)
+                elapsed, latencies = run(args.requests, args.threads)
+                root.removeHandler(handler)
+            else:
+                pipeline = LogPipeline(level='INFO', stream=stream)
+                pipeline.start()
+                elapsed, latencies = run(args.requests, args.threads)
+                pipeline.stop()
+        with open(path) as written:
+            lines = sum(1 for _ in written)
+        print('%-20s %9.0f req/s  p50 %6.1f us  p99 %7.1f us  %7d lines written' % (
+            label, len(latencies) / elapsed, percentile(latencies, 50) * 1e6, percentile(latencies, 99) * 1e6, lines,
+        ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Overhead of the metrics: verify_user requests through the app with METRICS_ENABLED off and on.
+
+Each setting runs in a fresh interpreter, since the instrumentation is applied at import time.
+The KDF is set to a single PBKDF2 iteration so that the overhead is not hidden by hashing.
+
+Usage: python benchmarks/bench_metrics.py [--requests 5000] [--rounds 3]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from _common import SRC_PATH
+from _common import use_temp_database
+
+CHILD = '''
+import asyncio, json, sys, time
+import httpx
+import main
+
+async def run(requests):
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            await client.post("/users/create_user/", json={"username": "bench_user", "password": "Abc12345678"})
+            start = time.perf_counter()
+            for _ in range(requests):
+                response = await client.post(
+                    "/users/verify_user/", json={"username": "bench_user", "password": "Abc12345678"},
+                )
+                assert response.status_code == 200, response.text
+            return time.perf_counter() - start
+
+print(json.dumps(asyncio.run(run(int(sys.argv[1])))))
+'''
+
+
+def run(enabled: bool, requests: int, database: str) -> float:
+    env = dict(
+        os.environ, METRICS_ENABLED='1' if enabled else '0', DATABASE_URL='sqlite:///%s' % database,
+        MIGRATION_LOCK_PATH=database + '.lock',
+    )
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, str(requests)], cwd=SRC_PATH, env=env, check=True, capture_output=True,
+    ).stdout
+    return requests / json.loads(output)
+
+
+def observe_cost(samples: int = 1000000) -> float:
+    import metrics
+
+    histogram = metrics.Histogram('bench_observe_seconds', 'Benchmark.').labels()
+    start = time.perf_counter()
+    for _ in range(samples):
+        histogram.observe(0.003)
+    return (time.perf_counter() - start) / samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    os.environ['PASSWORD_HASH_ALGORITHM'] = 'pbkdf2_sha256'
+    os.environ['PASSWORD_PBKDF2_ITERATIONS'] = '1'
+    path = use_temp_database()
+    rates = {False: [], True: []}
+    # Interleaved, so that drift of the machine hits both settings alike
+    for i in range(args.rounds):
+        for enabled in (False, True):
+            rates[enabled].append(run(enabled, args.requests, '%s.%d.%d' % (path, enabled, i)))
+    off, on = statistics.median(rates[False]), statistics.median(rates[True])
+    print('%-16s %10.1f req/s' % ('metrics off', off))
+    print('%-16s %10.1f req/s' % ('metrics on', on))
+    print('%-16s %10.1f %%' % ('overhead', (off - on) / off * 100))
+    print('%-16s %10.3f us' % ('observe()', observe_cost() * 1e6))
+
+
+if __name__ == '__main__':
+    main()
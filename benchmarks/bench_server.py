@@ -0,0 +1,95 @@
+"""Throughput of the prefork server of src/server.py from 1 to N workers.
+
+Each worker count starts `python server.py` on a fresh database. Several client processes then
+verify one user for a fixed time, so that the clients do not become the bottleneck before the
+server does. Gains stop at the number of cores the server and the clients share.
+
+Usage: python benchmarks/bench_server.py [--workers 1 2 4] [--clients 4] [--duration 10]
+"""
+import argparse
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from _common import SRC_PATH
+from _common import use_temp_database
+
+USER = {'username': 'bench_user', 'password': 'Abc12345678'}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def client(base_url: str, deadline: float) -> tuple[int, int]:
+    import httpx
+
+    done = errors = 0
+    with httpx.Client(base_url=base_url) as http:
+        while time.time() < deadline:
+            if http.post('/users/verify_user/', json=USER).status_code == 200:
+                done += 1
+            else:
+                errors += 1
+    return done, errors
+
+
+def run(workers: int, clients: int, duration: float, database: str) -> tuple[float, int]:
+    import httpx
+
+    port = _free_port()
+    base_url = 'http://127.0.0.1:%d' % port
+    env = dict(
+        os.environ, SERVER_WORKERS=str(workers), SERVER_HOST='127.0.0.1', SERVER_PORT=str(port),
+        DATABASE_URL='sqlite:///%s' % database, MIGRATION_LOCK_PATH=database + '.lock', TOKEN_KEYS='bench:secret',
+    )
+    server = subprocess.Popen(
+        [sys.executable, 'server.py'], cwd=SRC_PATH, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                httpx.get(base_url + '/').raise_for_status()
+                break
+            except httpx.HTTPError:
+                if time.monotonic() > deadline or server.poll() is not None:
+                    raise RuntimeError('server.py did not start')
+                time.sleep(0.1)
+        httpx.post(base_url + '/users/create_user/', json=USER)
+        # The other workers learn about the user on their next username filter refresh
+        time.sleep(float(os.environ['USERNAME_FILTER_REFRESH_INTERVAL']) + 0.5)
+        with multiprocessing.Pool(clients) as pool:
+            results = pool.starmap(client, [(base_url, time.time() + duration)] * clients)
+        return sum(done for done, _ in results) / duration, sum(errors for _, errors in results)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--duration', type=float, default=10)
+    args = parser.parse_args()
+
+    os.environ['PASSWORD_HASH_ALGORITHM'] = 'pbkdf2_sha256'
+    os.environ['PASSWORD_PBKDF2_ITERATIONS'] = '1'
+    os.environ['USERNAME_FILTER_REFRESH_INTERVAL'] = '1'
+    path = use_temp_database()
+    print('%d CPUs available' % len(os.sched_getaffinity(0)))
+    baseline = None
+    for workers in args.workers:
+        rps, errors = run(workers, args.clients, args.duration, '%s.%d' % (path, workers))
+        baseline = baseline or rps
+        print('%2d worker(s) %10.1f req/s  x%.2f  %d errors' % (workers, rps, rps / baseline, errors))
+
+
+if __name__ == '__main__':
+    main()
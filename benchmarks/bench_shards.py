@@ -0,0 +1,69 @@
+"""Write throughput of create_db_user with the users spread over 1, 4 and 8 SQLite shards.
+
+Writer threads create users one commit at a time, which is where a single SQLite file serializes
+them behind its write lock. Each shard count runs in a fresh interpreter on fresh files.
+
+Usage: python benchmarks/bench_shards.py [--shards 1 4 8] [--users 4000] [--writers 8]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from _common import SRC_PATH
+
+CHILD = '''
+import json, sys, threading, time
+from db.base import session_local
+from db.migration import migrate_db_shards
+from db.user import create_db_user
+
+users, writers = int(sys.argv[1]), int(sys.argv[2])
+migrate_db_shards()
+
+def write(worker):
+    with session_local() as session:
+        for i in range(worker, users, writers):
+            create_db_user("user_%d" % i, "hash", session=session)
+
+threads = [threading.Thread(target=write, args=(worker,)) for worker in range(writers)]
+start = time.perf_counter()
+for thread in threads:
+    thread.start()
+for thread in threads:
+    thread.join()
+print(json.dumps(time.perf_counter() - start))
+'''
+
+
+def run(shards: int, users: int, writers: int) -> float:
+    directory = tempfile.mkdtemp(prefix='fastapi-user-bench-')
+    database = os.path.join(directory, 'bench.db')
+    env = dict(
+        os.environ, DATABASE_SHARDS=str(shards), DATABASE_URL='sqlite:///%s' % database,
+        MIGRATION_LOCK_PATH=database + '.lock', USERNAME_FILTER_ENABLED='0', METRICS_ENABLED='0',
+    )
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, str(users), str(writers)], cwd=SRC_PATH, env=env, check=True, capture_output=True,
+    ).stdout
+    return users / json.loads(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--users', type=int, default=4000)
+    parser.add_argument('--writers', type=int, default=8)
+    args = parser.parse_args()
+
+    baseline = None
+    for shards in args.shards:
+        throughput = run(shards, args.users, args.writers)
+        baseline = baseline or throughput
+        print('%2d shard(s) %10.1f users/s  x%.2f' % (shards, throughput, throughput / baseline))
+
+
+if __name__ == '__main__':
+    main()
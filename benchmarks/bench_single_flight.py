@@ -0,0 +1,75 @@
+"""Bursts of concurrent async_verify_user calls for the same account, with and without single-flight.
+
+Every burst verifies one hot account `--burst` times at once, with the default KDF. The credential
+cache is disabled so that the database fetches show up as well.
+
+Usage: python benchmarks/bench_single_flight.py [--users 1000] [--bursts 20] [--burst 50]
+"""
+import argparse
+import asyncio
+import random
+import time
+
+from _common import create_schema
+from _common import print_row
+from _common import seed_users
+from _common import summarize
+from _common import use_temp_database
+
+
+async def run(names: list[str], bursts: int, burst: int) -> dict:
+    from app.user import async_verify_user
+    from db.base import async_session_local
+
+    latencies = []
+
+    async def verify(name: str):
+        async with async_session_local() as session:
+            start = time.perf_counter()
+            result = await async_verify_user(username=name, password='Abc12345678', session=session)
+            latencies.append(time.perf_counter() - start)
+            assert result.success, result.reason
+
+    start = time.perf_counter()
+    for _ in range(bursts):
+        name = random.choice(names)
+        await asyncio.gather(*(verify(name) for _ in range(burst)))
+    return summarize(latencies, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--bursts', type=int, default=20)
+    parser.add_argument('--burst', type=int, default=50)
+    args = parser.parse_args()
+
+    use_temp_database()
+    create_schema()
+    names = seed_users(args.users)
+
+    from unittest.mock import patch
+
+    from app import user as app_user
+    from db import user as db_user
+    from db.cache import LRUCache
+
+    flights = {'fetch': app_user.async_credential_flight, 'hash': app_user.async_password_flight}
+    with patch.object(db_user, 'credential_cache', LRUCache(max_size=0, ttl=0)):
+        for enabled in (False, True):
+            for flight in flights.values():
+                flight.enabled = enabled
+                flight.leaders = flight.followers = 0
+            summary = asyncio.run(run(names, args.bursts, args.burst))
+            print_row('single-flight %s' % ('on' if enabled else 'off'), summary)
+            if enabled:
+                for label, flight in flights.items():
+                    stats = flight.stats()
+                    calls = stats['leaders'] + stats['followers']
+                    print('  %-5s %d calls, %d coalesced (%.0f%%)' % (
+                        label, calls, stats['followers'], stats['followers'] / calls * 100 if calls else 0,
+                    ))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""Cold-start latency of a worker: spawning the alembic CLI against migrating in process.
+
+Each run starts a fresh interpreter which imports the app and brings the (already up to date)
+database schema to head, like a uvicorn worker does at startup.
+
+Usage: python benchmarks/bench_startup.py [--runs 5]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from _common import SRC_PATH
+from _common import use_temp_database
+
+WORKERS = {
+    'alembic subprocess': (
+        'import os, subprocess, sys; import main; '
+        'subprocess.run([sys.executable, "-m", "alembic", "-x", "url=" + os.environ["DATABASE_URL"], '
+        '"upgrade", "head"], cwd="db", check=True, capture_output=True)'
+    ),
+    'in process': 'import main; from db.migration import migrate_db_schema; migrate_db_schema()',
+}
+
+
+def cold_start(code: str, env: dict) -> float:
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], cwd=SRC_PATH, env=env, check=True, capture_output=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    path = use_temp_database()
+    env = dict(os.environ, MIGRATION_LOCK_PATH=path + '.lock')
+    subprocess.run(
+        [sys.executable, '-c', 'from db.migration import migrate_db_schema; migrate_db_schema()'],
+        cwd=SRC_PATH, env=env, check=True,
+    )
+    baseline = [cold_start('import main', env) for _ in range(args.runs)]
+    print('%-20s %7.1f ms' % ('import only', statistics.median(baseline) * 1000))
+    for label, code in WORKERS.items():
+        timings = [cold_start(code, env) for _ in range(args.runs)]
+        print('%-20s %7.1f ms  (median of %d cold starts)' % (label, statistics.median(timings) * 1000, args.runs))
+
+
+if __name__ == '__main__':
+    main()
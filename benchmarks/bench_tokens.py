@@ -0,0 +1,79 @@
+"""Checking a token with /users/whoami against verifying the password with /users/verify_user/.
+
+Both run through the app in process with the configured KDF, as concurrent clients would.
+
+Usage: python benchmarks/bench_tokens.py [--concurrency 20] [--requests 400] [--checks 20000]
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from _common import print_row
+from _common import summarize
+from _common import use_temp_database
+
+
+async def drive(app, concurrency: int, total: int, send) -> dict:
+    import httpx
+
+    latencies = []
+    counter = iter(range(total))
+
+    async def worker(client):
+        for _ in counter:
+            start = time.perf_counter()
+            response = await send(client)
+            latencies.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.text
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return summarize(latencies, elapsed)
+
+
+async def run(args):
+    import httpx
+
+    import main
+    from app.tokens import token_signer
+
+    credentials = {'username': 'bench_user', 'password': 'Abc12345678'}
+    async with main.lifespan(main.app):
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url='http://bench') as client:
+            await client.post('/users/create_user/', json=credentials)
+            token = (await client.post('/users/verify_user/', json=credentials)).json()['token']
+        headers = {'Authorization': 'Bearer %s' % token}
+        verify = await drive(
+            main.app, args.concurrency, args.requests,
+            lambda client: client.post('/users/verify_user/', json=credentials),
+        )
+        whoami = await drive(
+            main.app, args.concurrency, args.checks, lambda client: client.get('/users/whoami', headers=headers),
+        )
+    print_row('verify_user', verify)
+    print_row('whoami', whoami)
+    start = time.perf_counter()
+    for _ in range(args.checks):
+        token_signer.verify(token)
+    print('%-28s %10.1f checks/s' % ('token_signer.verify', args.checks / (time.perf_counter() - start)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--concurrency', type=int, default=20)
+    parser.add_argument('--requests', type=int, default=400, help='verify_user calls')
+    parser.add_argument('--checks', type=int, default=20000, help='whoami calls')
+    args = parser.parse_args()
+
+    os.environ.setdefault('TOKEN_KEYS', 'bench:secret')
+    path = use_temp_database()
+    os.environ.setdefault('MIGRATION_LOCK_PATH', path + '.lock')
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""verify_user latency of hot accounts with and without the credential cache.
+
+The KDF is set to a single PBKDF2 iteration so that the lookup cost is not hidden by hashing.
+
+Usage: python benchmarks/bench_user_cache.py [--users 100000] [--hot 50] [--requests 20000]
+"""
+import argparse
+import os
+import random
+import time
+
+from _common import create_schema
+from _common import percentile
+from _common import seed_users
+from _common import use_temp_database
+
+
+def run(names: list[str], requests: int) -> list[float]:
+    from app.user import verify_user
+    from db.base import session_local
+
+    latencies = []
+    with session_local() as session:
+        for _ in range(requests):
+            name = random.choice(names)
+            start = time.perf_counter()
+            result = verify_user(username=name, password='Abc12345678', session=session)
+            latencies.append(time.perf_counter() - start)
+            assert result.success, result.reason
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--hot', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+
+    os.environ['PASSWORD_HASH_ALGORITHM'] = 'pbkdf2_sha256'
+    os.environ['PASSWORD_PBKDF2_ITERATIONS'] = '1'
+    use_temp_database()
+    create_schema()
+    names = seed_users(args.users)[:args.hot]
+
+    from unittest.mock import patch
+
+    from db import user as db_user
+    from db.cache import LRUCache
+
+    with patch.object(db_user, 'credential_cache', LRUCache(max_size=0, ttl=0)):
+        without_cache = run(names, args.requests)
+    with_cache = run(names, args.requests)
+    for label, latencies in (('without cache', without_cache), ('with cache', with_cache)):
+        print('%-14s p50 %7.1f us  p99 %7.1f us' % (
+            label, percentile(latencies, 50) * 1e6, percentile(latencies, 99) * 1e6,
+        ))
+    print('cache stats: %s' % db_user.credential_cache.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""Page latency of the user listing as the table grows, keyset cursors against OFFSET.
+
+For each size a fresh database is filled with scattered names, then the first page, a page from
+the middle of the table and a prefix search are timed. OFFSET reaching the middle is shown for
+comparison, its cost grows with the offset.
+
+Usage: python benchmarks/bench_user_list.py [--sizes 10000 100000 1000000 10000000] [--limit 100]
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import time
+
+from _common import use_temp_database
+
+path = use_temp_database()
+
+from sqlalchemy import select  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from db.base import build_engine  # noqa: E402
+from db.migration import migrate_db_schema  # noqa: E402
+from db.user import DBUser  # noqa: E402
+from db.user import list_db_users  # noqa: E402
+
+
+def name(i: int) -> str:
+    # Multiplicative hashing scatters the names, so that inserts do not append to the index in order
+    return '%08x_%d' % (i * 2654435761 % 2 ** 32, i)
+
+
+def fill(database: str, size: int):
+    connection = sqlite3.connect(database)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=OFF')
+    batch = 100000
+    for start in range(0, size, batch):
+        connection.executemany(
+            'INSERT INTO users (name, password_hash) VALUES (?, ?)',
+            ((name(i), 'hash') for i in range(start, min(size, start + batch))),
+        )
+        connection.commit()
+    connection.close()
+
+
+def timed(function, runs: int) -> float:
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    print('%10s %12s %12s %12s %12s' % ('users', 'first page', 'middle page', 'prefix', 'OFFSET mid'))
+    for size in args.sizes:
+        database = '%s.%d' % (path, size)
+        engine = build_engine('sqlite:///%s' % database)
+        migrate_db_schema(engine, lock_path=None)
+        fill(database, size)
+        with sessionmaker(bind=engine)() as session:
+            middle = sorted(name(i) for i in range(0, size, max(1, size // 1000)))[500]
+            offset_query = select(DBUser.id, DBUser.name).order_by(DBUser.name).limit(args.limit).offset(size // 2)
+            results = [
+                timed(lambda: list_db_users(session, args.limit + 1), args.runs),
+                timed(lambda: list_db_users(session, args.limit + 1, after=middle), args.runs),
+                timed(lambda: list_db_users(session, args.limit + 1, prefix=middle[:3]), args.runs),
+                timed(lambda: session.execute(offset_query).all(), max(1, args.runs // 4)),
+            ]
+        engine.dispose()
+        os.remove(database)
+        print('%10d %9.3f ms %9.3f ms %9.3f ms %9.3f ms' % (size, *results))
+
+
+if __name__ == '__main__':
+    main()
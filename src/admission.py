@@ -0,0 +1,226 @@
+"""Admission control of the user routes.
+
+Every priority class admits up to its concurrency limit of requests and queues a bounded number of
+others, the rest is turned away at once with a 503 and Retry-After rather than left to pile up in
+the threadpool. The limit adapts to the latency of the class (AIMD): it grows by one per `limit`
+requests served within the latency target and is cut by `backoff` by a slower or failed one.
+Verifications and creations are separate classes with their own limit and queue, and creations
+are only admitted while no verification waits, so bulk creations cannot starve the logins.
+"""
+import asyncio
+from collections import deque
+import time
+from typing import Callable
+from typing import Optional
+
+from metrics import ADMISSION_LIMIT
+from metrics import ADMISSION_REQUESTS
+from models.user import ErrorCode
+from models.user import UserActionMessage
+from settings import ADMISSION_CREATE_LATENCY_TARGET
+from settings import ADMISSION_INITIAL_LIMIT
+from settings import ADMISSION_MAX_LIMIT
+from settings import ADMISSION_MIN_LIMIT
+from settings import ADMISSION_QUEUE_SIZE
+from settings import ADMISSION_QUEUE_TIMEOUT
+from settings import ADMISSION_RETRY_AFTER
+from settings import ADMISSION_VERIFY_LATENCY_TARGET
+
+
+PRIORITY_VERIFY = 'verify'
+PRIORITY_CREATE = 'create'
+# Routes under admission control, the others (token checks, the listing, metrics) are not limited
+ROUTE_PRIORITIES = {
+    '/users/verify_user/': PRIORITY_VERIFY,
+    '/users/create_user/': PRIORITY_CREATE,
+    '/users/create_users/': PRIORITY_CREATE,
+}
+OVERLOADED_MESSAGE = UserActionMessage(
+    success=False, reason='The server is overloaded, please retry later!', code=ErrorCode.SERVER_OVERLOADED,
+)
+
+
+class AIMDLimit:
+    def __init__(
+        self,
+        latency_target: float,
+        initial: int = ADMISSION_INITIAL_LIMIT,
+        min_limit: int = ADMISSION_MIN_LIMIT,
+        max_limit: int = ADMISSION_MAX_LIMIT,
+        backoff: float = 0.9,
+    ):
+        self.latency_target = latency_target
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self._decreased_at = float('-inf')
+
+    @property
+    def value(self) -> int:
+        return int(self.limit)
+
+    def update(self, started: float, latency: float, in_flight: int, failed: bool):
+        """Account for a request which started at `started` and took `latency` seconds."""
+        if failed or latency > self.latency_target:
+            # The requests in flight when the limit was cut are slow for the same reason, one cut is enough.
+            if started >= self._decreased_at:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self._decreased_at = started + latency
+        elif in_flight * 2 >= self.limit:
+            # Only a limit which is actually used grows
+            self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+
+
+class AdmissionQueue:
+    """Concurrency limit and bounded FIFO queue of one priority class.
+
+    A class with a `higher` one only admits requests while nobody waits in the higher class, its
+    requests would compete with those for the CPU and the database.
+    """
+
+    def __init__(
+        self,
+        priority: str,
+        limit: AIMDLimit,
+        queue_size: int = ADMISSION_QUEUE_SIZE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT,
+        clock: Callable[[], float] = time.perf_counter,
+        higher: Optional['AdmissionQueue'] = None,
+    ):
+        self.priority = priority
+        self.higher = higher
+        self.lower: Optional[AdmissionQueue] = None
+        if higher is not None:
+            higher.lower = self
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.clock = clock
+        self.in_flight = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._admitted = ADMISSION_REQUESTS.labels(priority, 'admitted')
+        self._rejected = ADMISSION_REQUESTS.labels(priority, 'rejected')
+        self._timed_out = ADMISSION_REQUESTS.labels(priority, 'timed_out')
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    async def acquire(self) -> bool:
+        """Wait for a slot, return False if the request is to be turned away."""
+        if not self._waiters and self._has_room():
+            self.in_flight += 1
+            self._admit()
+            return True
+        if len(self._waiters) >= self.queue_size:
+            self.rejected += 1
+            self._rejected.inc()
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # `release` takes the slot for the waiter before waking it
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            self._timed_out.inc()
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Woken as its client went away, the slot goes to the next one
+                self.in_flight -= 1
+                self._wake()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+                # The lower class may only have been held back by this waiter
+                self._wake()
+        self._admit()
+        return True
+
+    def _admit(self):
+        self.admitted += 1
+        self._admitted.inc()
+
+    def release(self, started: float, failed: bool = False):
+        """Give back the slot of a request admitted at `started`."""
+        self.limit.update(started, self.clock() - started, self.in_flight, failed)
+        self.in_flight -= 1
+        self._wake()
+
+    def _has_room(self) -> bool:
+        return self.in_flight < self.limit.value and (self.higher is None or not self.higher._waiters)
+
+    def _wake(self):
+        while self._waiters and self._has_room():
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+        if self.lower is not None:
+            self.lower._wake()
+
+    def stats(self) -> dict:
+        return {
+            'limit': self.limit.value,
+            'in_flight': self.in_flight,
+            'queued': len(self._waiters),
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+        }
+
+
+def create_admission_queues() -> dict[str, AdmissionQueue]:
+    verify = AdmissionQueue(PRIORITY_VERIFY, AIMDLimit(ADMISSION_VERIFY_LATENCY_TARGET))
+    create = AdmissionQueue(PRIORITY_CREATE, AIMDLimit(ADMISSION_CREATE_LATENCY_TARGET), higher=verify)
+    queues = {PRIORITY_VERIFY: verify, PRIORITY_CREATE: create}
+    for priority, queue in queues.items():
+        ADMISSION_LIMIT.labels(priority).set_function(lambda queue=queue: queue.limit.value)
+    return queues
+
+
+class AdmissionMiddleware:
+    """ASGI middleware admitting the requests of ROUTE_PRIORITIES through the queue of their class."""
+
+    def __init__(self, app, queues: Optional[dict[str, AdmissionQueue]] = None, retry_after: int = ADMISSION_RETRY_AFTER):
+        self.app = app
+        self.queues = queues if queues is not None else create_admission_queues()
+        self.retry_after = str(retry_after).encode('latin-1')
+
+    async def _reject(self, send):
+        body = OVERLOADED_MESSAGE.as_json()
+        await send({
+            'type': 'http.response.start',
+            'status': 503,
+            'headers': [
+                (b'content-type', b'application/json'),
+                (b'content-length', str(len(body)).encode('latin-1')),
+                (b'retry-after', self.retry_after),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': body})
+
+    async def __call__(self, scope, receive, send):
+        priority = ROUTE_PRIORITIES.get(scope['path']) if scope['type'] == 'http' else None
+        queue = self.queues.get(priority)
+        if queue is None:
+            await self.app(scope, receive, send)
+            return
+        if not await queue.acquire():
+            await self._reject(send)
+            return
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        started = queue.clock()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            queue.release(started, failed=status_code >= 500)
@@ -0,0 +1,191 @@
+from abc import ABC
+from abc import abstractmethod
+from collections import deque
+import logging
+import os
+import threading
+import time
+from typing import Callable
+from typing import NamedTuple
+from typing import Optional
+
+import orjson
+from sqlalchemy import Engine
+
+from db.audit import insert_audit_events
+from db.base import engine
+from metrics import AUDIT_BUFFER_EVENTS
+from metrics import AUDIT_EVENTS
+from settings import AUDIT_BACKEND
+from settings import AUDIT_BATCH_SIZE
+from settings import AUDIT_BUFFER_SIZE
+from settings import AUDIT_FILE_PATH
+from settings import AUDIT_FLUSH_INTERVAL
+
+
+logger = logging.getLogger(__name__)
+
+AUDIT_CREATE = 'create'
+AUDIT_VERIFY = 'verify'
+# Rejected requests can carry any name, only this much of it is kept
+USERNAME_MAX_LENGTH = 256
+
+
+class AuditEvent(NamedTuple):
+    created_at: float
+    action: str
+    username: str
+    success: bool
+    code: str
+
+
+class AuditSink(ABC):
+    @abstractmethod
+    def write(self, events: list[AuditEvent]):
+        """Persist a batch of events, raise to have it counted as failed."""
+
+    def close(self):
+        pass
+
+
+class DatabaseAuditSink(AuditSink):
+    """Inserts the events into the `audit_events` table."""
+
+    def __init__(self, db_engine: Engine = engine):
+        self.engine = db_engine
+
+    def write(self, events: list[AuditEvent]):
+        insert_audit_events([event._asdict() for event in events], self.engine)
+
+
+class FileAuditSink(AuditSink):
+    """Appends the events to a file as JSON lines, synced to disk after every batch."""
+
+    def __init__(self, path: str = AUDIT_FILE_PATH):
+        self.path = path
+        self._file = None
+
+    def write(self, events: list[AuditEvent]):
+        if self._file is None:
+            # Unbuffered, every batch is one append and those of several workers do not interleave
+            self._file = open(self.path, 'ab', buffering=0)
+        self._file.write(b''.join(orjson.dumps(event._asdict()) + b'\n' for event in events))
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class AuditLog:
+    """Bounded buffer of audit events, written to `sink` in batches by a background thread.
+
+    `record` never blocks the request: when `capacity` events are already waiting, the new one is
+    dropped and counted. A batch is written once `batch_size` events are waiting or every
+    `flush_interval` seconds, and whatever is left when the log stops.
+    """
+
+    def __init__(
+        self,
+        sink: Optional[AuditSink],
+        capacity: int = AUDIT_BUFFER_SIZE,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        flush_interval: float = AUDIT_FLUSH_INTERVAL,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.sink = sink
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self._events: deque[AuditEvent] = deque()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.dropped = 0
+        self.written = 0
+        self.failed = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.sink is not None
+
+    def record(self, action: str, username: str, success: bool, code: str):
+        if self.sink is None:
+            return
+        if len(self._events) >= self.capacity:
+            self.dropped += 1
+            AUDIT_EVENTS.labels('dropped').inc()
+            return
+        self._events.append(AuditEvent(self.clock(), action, username[:USERNAME_MAX_LENGTH], success, code))
+        if len(self._events) >= self.batch_size and not self._wake.is_set():
+            self._wake.set()
+
+    def flush(self) -> int:
+        """Write the waiting events, return how many were written."""
+        written = 0
+        with self._flush_lock:
+            while self._events:
+                batch = []
+                while self._events and len(batch) < self.batch_size:
+                    batch.append(self._events.popleft())
+                try:
+                    self.sink.write(batch)
+                except Exception as e:
+                    # Retrying could pile up without end, the events are counted as lost instead.
+                    self.failed += len(batch)
+                    AUDIT_EVENTS.labels('failed').inc(len(batch))
+                    logger.error('Failed to write %d audit events: %s', len(batch), e)
+                    continue
+                written += len(batch)
+            self.written += written
+        if written:
+            AUDIT_EVENTS.labels('written').inc(written)
+        return written
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def start(self):
+        if self.sink is None or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._thread = None
+        self.flush()
+        self.sink.close()
+
+    def stats(self) -> dict:
+        return {
+            'pending': len(self._events),
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+
+
+def create_audit_log(backend: str = AUDIT_BACKEND) -> AuditLog:
+    if not backend:
+        return AuditLog(None)
+    if backend == 'database':
+        return AuditLog(DatabaseAuditSink())
+    if backend == 'file':
+        return AuditLog(FileAuditSink())
+    raise ValueError('Unknown audit backend: %s' % backend)
+
+
+audit_log = create_audit_log()
+AUDIT_BUFFER_EVENTS.set_function(lambda: audit_log.stats()['pending'])
@@ -0,0 +1,123 @@
+"""Blocklist of common and breached passwords, looked up in a memory-mapped file.
+
+The file holds the sorted, unique prefixes of the SHA-1 digests of the passwords:
+
+    header   magic `PWBL`, version, prefix size, padding, entry count (u64)
+    index    65537 u64 offsets, the first entry whose prefix starts with each two-byte value
+    entries  `count` prefixes of `prefix size` bytes each
+
+A lookup reads the two offsets of its bucket from the index, then binary searches the bucket.
+The pages are shared by every worker through the page cache, and only those touched are loaded.
+"""
+from bisect import bisect_left
+import hashlib
+import mmap
+import os
+import struct
+from typing import Iterable
+from typing import Optional
+
+from settings import PASSWORD_BLOCKLIST_PATH
+
+
+MAGIC = b'PWBL'
+VERSION = 1
+HEADER = struct.Struct('<4sBB2xQ')
+BUCKETS = 1 << 16
+INDEX = struct.Struct('<%dQ' % (BUCKETS + 1))
+DEFAULT_PREFIX_SIZE = 8
+
+
+def password_key(password: str, prefix_size: int = DEFAULT_PREFIX_SIZE) -> bytes:
+    return hashlib.sha1(password.encode('utf-8')).digest()[:prefix_size]
+
+
+def write_blocklist(path: str, keys: Iterable[bytes], prefix_size: int = DEFAULT_PREFIX_SIZE) -> int:
+    """Write `keys`, sorted in ascending order, to a blocklist file and return the number of entries.
+
+    Duplicated keys are written once.
+    """
+    if not 2 <= prefix_size <= 20:
+        raise ValueError('The prefix size must be between 2 and 20 bytes.')
+    counts = [0] * BUCKETS
+    count = 0
+    previous = None
+    with open(path + '.tmp', 'wb') as file:
+        file.seek(HEADER.size + INDEX.size)
+        for key in keys:
+            if len(key) != prefix_size:
+                raise ValueError('The key %s is not %d bytes long.' % (key.hex(), prefix_size))
+            if previous is not None and key <= previous:
+                if key == previous:
+                    continue
+                raise ValueError('The keys are not sorted.')
+            file.write(key)
+            counts[key[0] << 8 | key[1]] += 1
+            count += 1
+            previous = key
+        offsets = [0] * (BUCKETS + 1)
+        for bucket, bucket_count in enumerate(counts):
+            offsets[bucket + 1] = offsets[bucket] + bucket_count
+        file.seek(0)
+        file.write(HEADER.pack(MAGIC, VERSION, prefix_size, count))
+        file.write(INDEX.pack(*offsets))
+    os.replace(path + '.tmp', path)
+    return count
+
+
+class _Entries:
+    """Read-only sequence view of the prefixes in the mapped file, for `bisect`."""
+
+    def __init__(self, data: mmap.mmap, offset: int, prefix_size: int, count: int):
+        self.data = data
+        self.offset = offset
+        self.prefix_size = prefix_size
+        self.count = count
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, i: int) -> bytes:
+        start = self.offset + i * self.prefix_size
+        return self.data[start:start + self.prefix_size]
+
+
+class PasswordBlocklist:
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            self._data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self._data) < HEADER.size + INDEX.size:
+            raise ValueError('The password blocklist %s is truncated.' % path)
+        magic, version, self.prefix_size, self.count = HEADER.unpack_from(self._data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('%s is not a password blocklist.' % path)
+        if len(self._data) != HEADER.size + INDEX.size + self.count * self.prefix_size:
+            raise ValueError('The password blocklist %s is truncated.' % path)
+        self._offsets = INDEX.unpack_from(self._data, HEADER.size)
+        self._entries = _Entries(self._data, HEADER.size + INDEX.size, self.prefix_size, self.count)
+        if hasattr(mmap, 'MADV_RANDOM'):
+            # Lookups jump around the file, reading ahead would only evict useful pages.
+            self._data.madvise(mmap.MADV_RANDOM)
+
+    def __contains__(self, password: str) -> bool:
+        key = password_key(password, self.prefix_size)
+        bucket = key[0] << 8 | key[1]
+        low, high = self._offsets[bucket], self._offsets[bucket + 1]
+        i = bisect_left(self._entries, key, low, high)
+        return i < high and self._entries[i] == key
+
+    def __len__(self) -> int:
+        return self.count
+
+    def close(self):
+        self._data.close()
+
+
+def load_password_blocklist(path: Optional[str] = PASSWORD_BLOCKLIST_PATH) -> Optional[PasswordBlocklist]:
+    if not path:
+        return None
+    return PasswordBlocklist(path)
+
+
+password_blocklist = load_password_blocklist()
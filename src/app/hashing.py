@@ -0,0 +1,171 @@
+import asyncio
+import base64
+from concurrent.futures import Executor
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import hmac
+import os
+import re
+import threading
+from typing import Callable
+
+from metrics import PASSWORD_HASH_DURATION
+from metrics import timed
+from profiling import profile_offloaded
+from settings import PASSWORD_HASH_ALGORITHM
+from settings import PASSWORD_HASH_EXECUTOR
+from settings import PASSWORD_HASH_WORKERS
+from settings import PASSWORD_PBKDF2_ITERATIONS
+from settings import PASSWORD_SCRYPT_N
+from settings import PASSWORD_SCRYPT_P
+from settings import PASSWORD_SCRYPT_R
+
+
+LEGACY_SHA256_PATTERN = re.compile(r'[0-9a-f]{64}')
+SALT_SIZE = 16
+KEY_SIZE = 32
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.b64encode(data).decode('ascii').rstrip('=')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.b64decode(data + '=' * (-len(data) % 4))
+
+
+class PasswordHasher:
+    """Hashes passwords into a self-describing `$algorithm$params$salt$hash` string.
+
+    Supported algorithms are `scrypt` and `pbkdf2_sha256`. Unsalted SHA-256 hex digests written
+    by older versions still verify, and report `needs_rehash` like hashes with outdated params.
+    """
+
+    def __init__(
+        self,
+        algorithm: str = PASSWORD_HASH_ALGORITHM,
+        scrypt_n: int = PASSWORD_SCRYPT_N,
+        scrypt_r: int = PASSWORD_SCRYPT_R,
+        scrypt_p: int = PASSWORD_SCRYPT_P,
+        pbkdf2_iterations: int = PASSWORD_PBKDF2_ITERATIONS,
+    ):
+        if algorithm == 'scrypt':
+            self.params = {'n': scrypt_n, 'r': scrypt_r, 'p': scrypt_p}
+        elif algorithm == 'pbkdf2_sha256':
+            self.params = {'i': pbkdf2_iterations}
+        else:
+            raise ValueError('Unknown password hash algorithm: %s' % algorithm)
+        self.algorithm = algorithm
+
+    @staticmethod
+    def _derive(algorithm: str, params: dict[str, int], password: str, salt: bytes) -> bytes:
+        password_bytes = password.encode('utf-8')
+        if algorithm == 'scrypt':
+            n, r, p = params['n'], params['r'], params['p']
+            maxmem = 128 * n * r * p + 1024 * 1024
+            return hashlib.scrypt(password_bytes, salt=salt, n=n, r=r, p=p, maxmem=maxmem, dklen=KEY_SIZE)
+        if algorithm == 'pbkdf2_sha256':
+            return hashlib.pbkdf2_hmac('sha256', password_bytes, salt, params['i'], dklen=KEY_SIZE)
+        raise ValueError('Unknown password hash algorithm: %s' % algorithm)
+
+    @staticmethod
+    def _decode(encoded: str) -> tuple[str, dict[str, int], bytes, bytes]:
+        _, algorithm, params, salt, digest = encoded.split('$')
+        params = {key: int(value) for key, value in (item.split('=') for item in params.split(','))}
+        return algorithm, params, _b64decode(salt), _b64decode(digest)
+
+    def hash(self, password: str) -> str:
+        salt = os.urandom(SALT_SIZE)
+        digest = self._derive(self.algorithm, self.params, password, salt)
+        params = ','.join('%s=%s' % item for item in self.params.items())
+        return '$%s$%s$%s$%s' % (self.algorithm, params, _b64encode(salt), _b64encode(digest))
+
+    def verify(self, password: str, encoded: str) -> bool:
+        if LEGACY_SHA256_PATTERN.fullmatch(encoded):
+            digest = hashlib.sha256(password.encode('utf-8')).hexdigest()
+            return hmac.compare_digest(digest, encoded)
+        try:
+            algorithm, params, salt, expected = self._decode(encoded)
+            digest = self._derive(algorithm, params, password, salt)
+        except (ValueError, KeyError):
+            return False
+        return hmac.compare_digest(digest, expected)
+
+    def needs_rehash(self, encoded: str) -> bool:
+        if LEGACY_SHA256_PATTERN.fullmatch(encoded):
+            return True
+        try:
+            algorithm, params, _, _ = self._decode(encoded)
+        except (ValueError, KeyError):
+            return True
+        return algorithm != self.algorithm or params != self.params
+
+
+class PasswordHashingService:
+    """Runs a `PasswordHasher` in a bounded pool, off the request thread and the event loop."""
+
+    def __init__(self, hasher: PasswordHasher, workers: int = PASSWORD_HASH_WORKERS, kind: str = PASSWORD_HASH_EXECUTOR):
+        if kind not in ('thread', 'process'):
+            raise ValueError('Unknown password hash executor: %s' % kind)
+        self.hasher = hasher
+        self.workers = workers
+        self.kind = kind
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> Executor:
+        # Created on first use, and again in a forked worker, which cannot use its parent's pool.
+        if self._executor is None or self._pid != os.getpid():
+            with self._lock:
+                if self._executor is None or self._pid != os.getpid():
+                    if self.kind == 'process':
+                        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                    else:
+                        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+                    self._pid = os.getpid()
+        return self._executor
+
+    def _task(self, fn: Callable) -> Callable:
+        # Pool threads are part of the profile of the request, processes cannot be
+        return profile_offloaded(fn) if self.kind == 'thread' else fn
+
+    def _run(self, fn: Callable, *args):
+        return self._get_executor().submit(self._task(fn), *args).result()
+
+    async def _async_run(self, fn: Callable, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._get_executor(), self._task(fn), *args)
+
+    @timed(PASSWORD_HASH_DURATION.labels('hash'))
+    def hash(self, password: str) -> str:
+        return self._run(self.hasher.hash, password)
+
+    @timed(PASSWORD_HASH_DURATION.labels('verify'))
+    def verify(self, password: str, encoded: str) -> bool:
+        return self._run(self.hasher.verify, password, encoded)
+
+    @timed(PASSWORD_HASH_DURATION.labels('hash_many'))
+    def hash_many(self, passwords: list[str]) -> list[str]:
+        return list(self._get_executor().map(self._task(self.hasher.hash), passwords))
+
+    @timed(PASSWORD_HASH_DURATION.labels('hash'))
+    async def async_hash(self, password: str) -> str:
+        return await self._async_run(self.hasher.hash, password)
+
+    @timed(PASSWORD_HASH_DURATION.labels('verify'))
+    async def async_verify(self, password: str, encoded: str) -> bool:
+        return await self._async_run(self.hasher.verify, password, encoded)
+
+    @timed(PASSWORD_HASH_DURATION.labels('hash_many'))
+    async def async_hash_many(self, passwords: list[str]) -> list[str]:
+        return await asyncio.gather(*(self.async_hash(password) for password in passwords))
+
+    def shutdown(self):
+        if self._executor is not None and self._pid == os.getpid():
+            self._executor.shutdown()
+        self._executor = None
+
+
+password_hasher = PasswordHasher()
+hashing_service = PasswordHashingService(password_hasher)
@@ -0,0 +1,191 @@
+from abc import ABC
+from abc import abstractmethod
+from collections import OrderedDict
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable
+from typing import Optional
+
+from settings import LOCKOUT_BACKEND
+from settings import LOCKOUT_MAX_ENTRIES
+from settings import LOCKOUT_SQLITE_PATH
+from settings import LOCKOUT_TTL
+from settings import USER_PENALTY_NUMBER
+from settings import USER_PENALTY_PERIOD
+
+
+class LockoutStore(ABC):
+    """Counts wrong passwords per username and remembers when a user got banned.
+
+    Entries expire `ttl` seconds after the last failure (never before the ban is over)
+    and the store holds at most `max_entries` users, evicting the oldest ones first.
+    """
+
+    def __init__(
+        self,
+        penalty_number: int = USER_PENALTY_NUMBER,
+        penalty_period: int = USER_PENALTY_PERIOD,
+        ttl: int = LOCKOUT_TTL,
+        max_entries: int = LOCKOUT_MAX_ENTRIES,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.penalty_number = penalty_number
+        self.penalty_period = penalty_period
+        self.ttl = max(ttl, penalty_period)
+        self.max_entries = max_entries
+        self.clock = clock
+
+    @abstractmethod
+    def get(self, name: str) -> tuple[int, Optional[float]]:
+        """Return the failure count and the ban timestamp of a user, `(0, None)` if unknown."""
+
+    @abstractmethod
+    def record_failure(self, name: str) -> int:
+        """Count a wrong password and return the new count; reaching `penalty_number` bans the user."""
+
+    @abstractmethod
+    def reset(self, name: str):
+        """Forget the failures and the ban of a user."""
+
+    @abstractmethod
+    def size(self) -> int:
+        """Return the number of users with an entry."""
+
+
+class MemoryLockoutStore(LockoutStore):
+    """Per-process store, entries are kept in last-failure order."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._entries: OrderedDict[str, list] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _evict(self, now: float):
+        while self._entries:
+            _, entry = next(iter(self._entries.items()))
+            if entry[2] > now and len(self._entries) <= self.max_entries:
+                break
+            self._entries.popitem(last=False)
+
+    def get(self, name: str) -> tuple[int, Optional[float]]:
+        entry = self._entries.get(name)
+        if entry is None:
+            return 0, None
+        count, banned_at, expires_at = entry
+        if expires_at <= self.clock():
+            return 0, None
+        return count, banned_at
+
+    def record_failure(self, name: str) -> int:
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None or entry[2] <= now:
+                entry = [0, None, 0.0]
+                self._entries[name] = entry
+            entry[0] += 1
+            if entry[0] >= self.penalty_number:
+                entry[1] = now
+            entry[2] = now + self.ttl
+            self._entries.move_to_end(name)
+            self._evict(now)
+            return entry[0]
+
+    def reset(self, name: str):
+        with self._lock:
+            self._entries.pop(name, None)
+
+    def size(self) -> int:
+        return len(self._entries)
+
+
+class SQLiteLockoutStore(LockoutStore):
+    """Store in a local SQLite file, shared by every worker process on the host."""
+
+    PRUNE_EVERY = 256
+
+    def __init__(self, path: str = LOCKOUT_SQLITE_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._local = threading.local()
+        self._writes = 0
+        self._connection().executescript(
+            'CREATE TABLE IF NOT EXISTS lockouts ('
+            '  name TEXT PRIMARY KEY,'
+            '  count INTEGER NOT NULL,'
+            '  banned_at REAL,'
+            '  expires_at REAL NOT NULL'
+            ') WITHOUT ROWID;'
+            'CREATE INDEX IF NOT EXISTS ix_lockouts_expires_at ON lockouts (expires_at);'
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections must not be shared between threads, and not across a fork either.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, isolation_level=None, timeout=5.0)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def get(self, name: str) -> tuple[int, Optional[float]]:
+        row = self._connection().execute(
+            'SELECT count, banned_at FROM lockouts WHERE name = ? AND expires_at > ?',
+            (name, self.clock()),
+        ).fetchone()
+        if row is None:
+            return 0, None
+        return row[0], row[1]
+
+    def record_failure(self, name: str) -> int:
+        now = self.clock()
+        params = {'name': name, 'now': now, 'expires_at': now + self.ttl, 'penalty': self.penalty_number}
+        connection = self._connection()
+        # The expressions in DO UPDATE all see the previous row, an expired row starts over from 1.
+        (count,) = connection.execute(
+            'INSERT INTO lockouts (name, count, banned_at, expires_at) '
+            'VALUES (:name, 1, CASE WHEN 1 >= :penalty THEN :now END, :expires_at) '
+            'ON CONFLICT (name) DO UPDATE SET '
+            '  count = CASE WHEN expires_at > :now THEN count + 1 ELSE 1 END, '
+            '  banned_at = CASE WHEN (CASE WHEN expires_at > :now THEN count + 1 ELSE 1 END) >= :penalty '
+            '    THEN :now END, '
+            '  expires_at = :expires_at '
+            'RETURNING count',
+            params,
+        ).fetchone()
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            self.prune()
+        return count
+
+    def prune(self):
+        connection = self._connection()
+        connection.execute('DELETE FROM lockouts WHERE expires_at <= ?', (self.clock(),))
+        (size,) = connection.execute('SELECT count(*) FROM lockouts').fetchone()
+        if size > self.max_entries:
+            connection.execute(
+                'DELETE FROM lockouts WHERE name IN '
+                '(SELECT name FROM lockouts ORDER BY expires_at LIMIT ?)',
+                (size - self.max_entries,),
+            )
+
+    def reset(self, name: str):
+        self._connection().execute('DELETE FROM lockouts WHERE name = ?', (name,))
+
+    def size(self) -> int:
+        (size,) = self._connection().execute(
+            'SELECT count(*) FROM lockouts WHERE expires_at > ?', (self.clock(),)
+        ).fetchone()
+        return size
+
+
+def create_lockout_store(backend: str = LOCKOUT_BACKEND) -> LockoutStore:
+    if backend == 'memory':
+        return MemoryLockoutStore()
+    if backend == 'sqlite':
+        return SQLiteLockoutStore()
+    raise ValueError('Unknown lockout backend: %s' % backend)
@@ -0,0 +1,117 @@
+import asyncio
+import threading
+from typing import Awaitable
+from typing import Callable
+from typing import Hashable
+from typing import TypeVar
+
+from metrics import SINGLE_FLIGHT_CALLS
+from settings import SINGLE_FLIGHT_ENABLED
+
+
+T = TypeVar('T')
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs one call per key at a time, concurrent callers of the same key wait for its result.
+
+    The key is forgotten as soon as the result is ready, so nothing is cached: a call starting
+    after that runs again.
+    """
+
+    def __init__(self, operation: str, enabled: bool = SINGLE_FLIGHT_ENABLED):
+        self.enabled = enabled
+        self._calls: dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self._leaders = SINGLE_FLIGHT_CALLS.labels(operation, 'leader')
+        self._followers = SINGLE_FLIGHT_CALLS.labels(operation, 'follower')
+        self.leaders = 0
+        self.followers = 0
+
+    def do(self, key: Hashable, fn: Callable[[], T]) -> T:
+        if not self.enabled:
+            return fn()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.leaders += 1
+            else:
+                self.followers += 1
+        if not leader:
+            self._followers.inc()
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+        self._leaders.inc()
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result
+
+    def stats(self) -> dict:
+        return {'in_flight': len(self._calls), 'leaders': self.leaders, 'followers': self.followers}
+
+
+class AsyncSingleFlight:
+    """`SingleFlight` for coroutines of one event loop."""
+
+    def __init__(self, operation: str, enabled: bool = SINGLE_FLIGHT_ENABLED):
+        self.enabled = enabled
+        self._calls: dict[Hashable, asyncio.Future] = {}
+        self._leaders = SINGLE_FLIGHT_CALLS.labels(operation, 'leader')
+        self._followers = SINGLE_FLIGHT_CALLS.labels(operation, 'follower')
+        self.leaders = 0
+        self.followers = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        if not self.enabled:
+            return await fn()
+        future = self._calls.get(key)
+        while future is not None:
+            self.followers += 1
+            self._followers.inc()
+            try:
+                # Shielded, a follower cancelled by its client must not cancel the leader
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if asyncio.current_task().cancelling() or not future.cancelled():
+                    raise
+            # The leader was cancelled, the next caller takes over
+            future = self._calls.get(key)
+        self.leaders += 1
+        self._leaders.inc()
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # Marks the exception as retrieved, there may be no follower to do it
+            future.exception()
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            del self._calls[key]
+        return result
+
+    def stats(self) -> dict:
+        return {'in_flight': len(self._calls), 'leaders': self.leaders, 'followers': self.followers}
@@ -0,0 +1,103 @@
+"""Stateless tokens proving a successful verification.
+
+A token is `key_id.payload.signature`: the payload is the base64url encoded JSON array
+`[user_id, username, expires_at]` and the signature its HMAC-SHA256 under the key `key_id`.
+Checking one takes a single HMAC, without the database or the KDF.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import logging
+import secrets
+import time
+from typing import Callable
+from typing import NamedTuple
+from typing import Optional
+
+import orjson
+
+from settings import TOKEN_KEYS
+from settings import TOKEN_TTL
+
+
+logger = logging.getLogger(__name__)
+
+
+class TokenClaims(NamedTuple):
+    user_id: int
+    username: str
+    expires_at: int
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def parse_token_keys(value: str) -> list[tuple[str, bytes]]:
+    keys = []
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        key_id, separator, secret = item.strip().partition(':')
+        if not separator or not key_id or '.' in key_id or not secret:
+            raise ValueError('Token keys must be given as key_id:secret, got %r.' % item)
+        keys.append((key_id, secret.encode('utf-8')))
+    return keys
+
+
+class TokenSigner:
+    def __init__(self, keys: list[tuple[str, bytes]], ttl: int = TOKEN_TTL, clock: Callable[[], float] = time.time):
+        if not keys:
+            raise ValueError('At least one token key is required.')
+        self.signing_key_id = keys[0][0]
+        self.keys = dict(keys)
+        self.ttl = ttl
+        self.clock = clock
+
+    def _sign(self, key: bytes, message: bytes) -> str:
+        return _b64encode(hmac.new(key, message, hashlib.sha256).digest())
+
+    def issue(self, user_id: int, username: str) -> str:
+        payload = _b64encode(orjson.dumps([user_id, username, int(self.clock()) + self.ttl]))
+        message = '%s.%s' % (self.signing_key_id, payload)
+        return '%s.%s' % (message, self._sign(self.keys[self.signing_key_id], message.encode('ascii')))
+
+    def verify(self, token: str) -> Optional[TokenClaims]:
+        """Return the claims of a valid, unexpired token, None otherwise."""
+        message, _, signature = token.rpartition('.')
+        key_id, _, payload = message.partition('.')
+        key = self.keys.get(key_id)
+        if key is None or not payload:
+            return None
+        try:
+            expected = self._sign(key, message.encode('ascii'))
+        except UnicodeEncodeError:
+            return None
+        if not hmac.compare_digest(expected.encode('ascii'), signature.encode('utf-8')):
+            return None
+        try:
+            user_id, username, expires_at = orjson.loads(_b64decode(payload))
+        except (binascii.Error, orjson.JSONDecodeError, TypeError, ValueError):
+            return None
+        if expires_at <= self.clock():
+            return None
+        return TokenClaims(user_id, username, expires_at)
+
+
+def create_token_signer(value: str = TOKEN_KEYS) -> TokenSigner:
+    keys = parse_token_keys(value)
+    if not keys:
+        logger.warning(
+            'TOKEN_KEYS is not set, signing tokens with a random key: they are only valid within this '
+            'process and until it restarts.'
+        )
+        keys = [('ephemeral', secrets.token_bytes(32))]
+    return TokenSigner(keys)
+
+
+token_signer = create_token_signer()
@@ -1,13 +1,54 @@
-from datetime import datetime
-import hashlib
+import base64
+import binascii
+import inspect
 import logging
+from typing import AsyncIterator
+from typing import Iterator
+from typing import Optional
+from typing import Union
 
+import orjson
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
+from app.audit import AUDIT_CREATE
+from app.audit import AUDIT_VERIFY
+from app.audit import audit_log
+from app.blocklist import password_blocklist
+from app.hashing import hashing_service
+from app.hashing import password_hasher
+from app.lockout import create_lockout_store
+from app.singleflight import AsyncSingleFlight
+from app.singleflight import SingleFlight
+from app.tokens import token_signer
+from db.user import async_create_db_user
+from db.user import async_create_db_users
+from db.user import async_get_db_user_credential
+from db.user import async_list_db_users
+from db.user import async_update_db_user_password_hash
 from db.user import create_db_user
-from db.user import get_db_user
+from db.user import create_db_users
+from db.user import get_db_user_credential
+from db.user import list_db_users
+from db.user import update_db_user_password_hash
+from db.username_filter import username_filter
+from metrics import LOCKOUT_CHECK_DURATION
+from metrics import LOCKOUT_ENTRIES
+from metrics import timed
+from metrics import VALIDATION_DURATION
+from models.user import ErrorCode
+from models.user import missing_password_class
+from models.user import PASSWORD_CLASS_REASONS
+from models.user import PASSWORD_TOO_LONG
+from models.user import PASSWORD_TOO_SHORT
 from models.user import UserActionMessage
+from models.user import UserCreateItem
+from models.user import USERNAME_TOO_LONG
+from models.user import USERNAME_TOO_SHORT
+from settings import LOCKOUT_BACKEND
+from settings import USER_LIST_CHUNK_SIZE
 from settings import USERNAME_MIN_LENGTH
 from settings import USERNAME_MAX_LENGTH
 from settings import USER_PENALTY_NUMBER
@@ -17,79 +58,83 @@ from settings import PASSWORD_MIN_LENGTH
 
 
 logger = logging.getLogger(__name__)
-user_verify_cache: dict[str, list] = {}
+lockout_store = create_lockout_store()
+# A SQLite store is shared by the workers, which must not add up its size.
+LOCKOUT_ENTRIES.multiprocess_mode = 'max' if LOCKOUT_BACKEND == 'sqlite' else 'sum'
+LOCKOUT_ENTRIES.set_function(lockout_store.size)
+# Concurrent verifications of a name share its fetch, and with the same password its hash.
+credential_flight = SingleFlight('get_db_user_credential')
+password_flight = SingleFlight('verify_password')
+async_credential_flight = AsyncSingleFlight('get_db_user_credential')
+async_password_flight = AsyncSingleFlight('verify_password')
 
 
 class UserNameValidator:
     def __init__(self, name: str):
         self.name = name
+        self.error_code = ErrorCode.OK
 
     def _check_length(self) -> tuple[bool, str]:
         if len(self.name) < USERNAME_MIN_LENGTH:
-            msg = 'The length of the user name is too short, should be at least %s characters.' % USERNAME_MIN_LENGTH
-            return False, msg
+            self.error_code = ErrorCode.USERNAME_LENGTH
+            return False, USERNAME_TOO_SHORT
         if len(self.name) > USERNAME_MAX_LENGTH:
-            msg = 'The length of the user name is too long, should be at most %s characters.' % USERNAME_MAX_LENGTH
-            return False, msg
+            self.error_code = ErrorCode.USERNAME_LENGTH
+            return False, USERNAME_TOO_LONG
         return True, ''
 
+    # Could have more validations
+    _checks = (_check_length,)
+
+    @timed(VALIDATION_DURATION.labels('username'))
     def validate(self) -> tuple[bool, str]:
-        # Could have more validations
-        logger.debug('Start to validate the username: %s' % self.name)
-        actions = [
-            self._check_length,
-        ]
-        for action in actions:
-            success, msg = action()
+        logger.debug('Start to validate the username: %s', self.name)
+        for check in self._checks:
+            success, msg = check(self)
             if not success:
-                logger.warning(msg)
+                logger.warning('Rejected the username %s: %s', self.name, msg)
                 return success, msg
         return True, ''
 
 
 class PasswordValidator:
+    """The rules `UserCreate` checks on its own plus the blocklist, for the callers with plain strings."""
+
     def __init__(self, password: str):
         self.password = password
+        self.error_code = ErrorCode.OK
 
-    def _check_length(self) -> tuple[bool,str]:
+    def _check_length(self) -> tuple[bool, str]:
         if len(self.password) < PASSWORD_MIN_LENGTH:
-            msg = 'The length of the password is too short, should be at least %s characters.' % PASSWORD_MIN_LENGTH
-            return False, msg
+            self.error_code = ErrorCode.PASSWORD_LENGTH
+            return False, PASSWORD_TOO_SHORT
         if len(self.password) > PASSWORD_MAX_LENGTH:
-            msg = 'The length of the password is too long, should be at most %s characters.' % PASSWORD_MAX_LENGTH
-            return False, msg
+            self.error_code = ErrorCode.PASSWORD_LENGTH
+            return False, PASSWORD_TOO_LONG
         return True, ''
 
-    def _check_lowercsae(self) -> tuple[bool, str]:
-        for c in self.password:
-            if c.islower():
-                return True, ''
-        return False, 'The lowercase is missing, should be at least one.'
+    def _check_classes(self) -> tuple[bool, str]:
+        code = missing_password_class(self.password)
+        if code is None:
+            return True, ''
+        self.error_code = code
+        return False, PASSWORD_CLASS_REASONS[code]
 
-    def _check_uppercase(self) -> tuple[bool, str]:
-        for c in self.password:
-            if c.isupper():
-                return True, ''
-        return False, 'The uppercase is missing, should be at least one.'
+    def _check_blocklist(self) -> tuple[bool, str]:
+        if password_blocklist is not None and self.password in password_blocklist:
+            self.error_code = ErrorCode.PASSWORD_BLOCKLISTED
+            return False, 'The password is too common, please choose another one.'
+        return True, ''
 
-    def _check_digit(self) -> tuple[bool, str]:
-        for c in self.password:
-            if c.isdigit():
-                return True, ''
-        return False, 'The number is missing, should be at least one.'
+    _checks = (_check_length, _check_classes, _check_blocklist)
 
+    @timed(VALIDATION_DURATION.labels('password'))
     def validate(self):
         logger.debug('Start to validate the password.')
-        actions = [
-            self._check_length,
-            self._check_lowercsae,
-            self._check_uppercase,
-            self._check_digit,
-        ]
-        for action in actions:
-            success, msg = action()
+        for check in self._checks:
+            success, msg = check(self)
             if not success:
-                logger.warning(msg)
+                logger.warning('Rejected a password: %s', msg)
                 return success, msg
         return True, ''
 
@@ -97,39 +142,56 @@ class PasswordValidator:
 class UserVerificationService:
     def __init__(self, name: str, password: str, session: Session):
         self.name = name
-        self.password_hash = hash_password(password)
+        self.password = password
         self.session = session
+        self.db_user = None
+        self.error_code = ErrorCode.OK
 
     def _check_user_exist(self) -> tuple[bool, str]:
-        db_user = get_db_user(name=self.name, session=self.session)
-        if db_user is None:
+        if username_filter.might_contain(self.name):
+            self.db_user = credential_flight.do(
+                self.name, lambda: get_db_user_credential(name=self.name, session=self.session),
+            )
+        if self.db_user is None:
+            self.error_code = ErrorCode.USER_NOT_FOUND
             return False, 'The username: %s does not exist!' % self.name
         return True, ''
 
+    @timed(LOCKOUT_CHECK_DURATION.labels())
     def _check_user_over_try(self) -> tuple[bool, str]:
-        if self.name not in user_verify_cache:
-            return True, ''
-        count, banned_time = user_verify_cache[self.name]
+        count, banned_time = lockout_store.get(self.name)
         if count < USER_PENALTY_NUMBER:
             return True, ''
-        if (datetime.now() - user_verify_cache[self.name][1]).seconds < USER_PENALTY_PERIOD:
+        if lockout_store.clock() - banned_time < USER_PENALTY_PERIOD:
+            self.error_code = ErrorCode.USER_LOCKED
             return False, 'Please try later.'
-        user_verify_cache.pop(self.name)
+        lockout_store.reset(self.name)
         return True, ''
 
     def _check_user_password(self) -> tuple[bool, str]:
-        db_user = get_db_user(name=self.name, password_hash=self.password_hash, session=self.session)
-        if db_user is not None:
-            return True, ''
-        msg = 'The password is not correct!'
-        if self.name not in user_verify_cache:
-            user_verify_cache[self.name] = [1, None]
-            return False, msg
-        if user_verify_cache[self.name][0] < USER_PENALTY_NUMBER - 1:
-            user_verify_cache[self.name][0] += 1
-            return False, msg
-        user_verify_cache[self.name][0] += 1
-        user_verify_cache[self.name][1] = datetime.now()
+        # The row fetched by _check_user_exist is reused, the password is only hashed once we got here.
+        password_hash = self.db_user.password_hash
+        key = (self.name, self.password, password_hash)
+        if not password_flight.do(key, lambda: hashing_service.verify(self.password, password_hash)):
+            return self._record_wrong_password()
+        if password_hasher.needs_rehash(self.db_user.password_hash):
+            self._upgrade_password_hash(hashing_service.hash(self.password))
+        return True, ''
+
+    def _upgrade_password_hash(self, password_hash: str):
+        try:
+            update_db_user_password_hash(name=self.name, password_hash=password_hash, session=self.session)
+        except SQLAlchemyError as e:
+            # The login itself succeeded, the upgrade is tried again next time. The text of the error
+            # holds the new hash, only its type is logged.
+            logger.error('Failed to upgrade the password hash of %s: %s', self.name, type(e).__name__)
+
+    def _record_wrong_password(self) -> tuple[bool, str]:
+        if lockout_store.record_failure(self.name) < USER_PENALTY_NUMBER:
+            self.error_code = ErrorCode.PASSWORD_INCORRECT
+            return False, 'The password is not correct!'
+        self.error_code = ErrorCode.USER_LOCKED_OUT
+        logger.warning('Locked out the user %s for %s seconds.', self.name, USER_PENALTY_PERIOD)
         return (
             False,
             f'You have entered wrong password for over {USER_PENALTY_NUMBER} time. '
@@ -138,9 +200,10 @@ class UserVerificationService:
 
     def verify(self):
         logger.debug('Start to check the password.')
+        # The lockout is kept outside the database, a locked user is turned away before any query.
         actions = [
-            self._check_user_exist,
             self._check_user_over_try,
+            self._check_user_exist,
             self._check_user_password,
         ]
         for action in actions:
@@ -150,33 +213,266 @@ class UserVerificationService:
         return True, ''
 
 
+class AsyncUserVerificationService(UserVerificationService):
+    def __init__(self, name: str, password: str, session: AsyncSession):
+        super().__init__(name=name, password=password, session=session)
+
+    async def _check_user_exist(self) -> tuple[bool, str]:
+        if username_filter.might_contain(self.name):
+            self.db_user = await async_credential_flight.do(
+                self.name, lambda: async_get_db_user_credential(name=self.name, session=self.session),
+            )
+        if self.db_user is None:
+            self.error_code = ErrorCode.USER_NOT_FOUND
+            return False, 'The username: %s does not exist!' % self.name
+        return True, ''
+
+    async def _check_user_password(self) -> tuple[bool, str]:
+        password_hash = self.db_user.password_hash
+        key = (self.name, self.password, password_hash)
+        if not await async_password_flight.do(key, lambda: hashing_service.async_verify(self.password, password_hash)):
+            return self._record_wrong_password()
+        if password_hasher.needs_rehash(self.db_user.password_hash):
+            await self._upgrade_password_hash(await hashing_service.async_hash(self.password))
+        return True, ''
+
+    async def _upgrade_password_hash(self, password_hash: str):
+        try:
+            await async_update_db_user_password_hash(name=self.name, password_hash=password_hash, session=self.session)
+        except SQLAlchemyError as e:
+            logger.error('Failed to upgrade the password hash of %s: %s', self.name, type(e).__name__)
+
+    async def verify(self):
+        logger.debug('Start to check the password.')
+        actions = [
+            self._check_user_over_try,
+            self._check_user_exist,
+            self._check_user_password,
+        ]
+        for action in actions:
+            result = action()
+            if inspect.isawaitable(result):
+                result = await result
+            success, msg = result
+            if not success:
+                return success, msg
+        return True, ''
+
+
 def hash_password(password: str) -> str:
-    password_bytes = password.encode('utf-8')
-    hash_object = hashlib.sha256(password_bytes)
-    return hash_object.hexdigest()
+    """Hash on the calling thread, e.g. inside the process pool of the importer."""
+    return password_hasher.hash(password)
+
+
+def validate_user(username: str, password: str) -> UserActionMessage:
+    for validator in (UserNameValidator(name=username), PasswordValidator(password=password)):
+        success, msg = validator.validate()
+        if not success:
+            return UserActionMessage(success=success, reason=msg, code=validator.error_code)
+    return UserActionMessage(success=True, reason='')
 
 
-def create_user(username: str, password: str, session: Session) -> UserActionMessage:
-    username_validator = UserNameValidator(name=username)
-    password_validator = PasswordValidator(password=password)
-    success, msg = username_validator.validate()
+def _validate_new_user(username: str, password: str, validated: bool) -> UserActionMessage:
+    """`validated` users come from a `UserCreate`, which left only the blocklist to check."""
+    if not validated:
+        return validate_user(username=username, password=password)
+    validator = PasswordValidator(password=password)
+    success, msg = validator._check_blocklist()
     if not success:
-        return UserActionMessage(success=success, reason=msg)
-    success, msg = password_validator.validate()
+        logger.warning('Rejected a password: %s', msg)
+    return UserActionMessage(success=success, reason=msg, code=validator.error_code)
+
+
+def _audit(action: str, username: str, result: UserActionMessage) -> UserActionMessage:
+    audit_log.record(action, username, result.success, result.code.value)
+    return result
+
+
+def create_user(username: str, password: str, session: Session, validated: bool = False) -> UserActionMessage:
+    result = _validate_new_user(username, password, validated)
+    if result.success:
+        try:
+            password_hash = hashing_service.hash(password)
+            create_db_user(name=username, password_hash=password_hash, session=session)
+        except IntegrityError as e:
+            # Expected of clients retrying, rate limited like the other rejections. The text of the error
+            # holds the parameters of the statement, the password hash among them: only its type is logged.
+            logger.warning('Failed to create the user %s, the username is taken: %s', username, type(e).__name__)
+            result = _duplicated_user_message(username)
+    return _audit(AUDIT_CREATE, username, result)
+
+
+def _prepare_users(users: list[UserCreateItem]) -> tuple[list, dict[str, tuple[int, str]]]:
+    """Validate a batch, return the per-item results so far and the `name -> (index, password)` to insert."""
+    results = [None] * len(users)
+    pending = {}
+    for index, user in enumerate(users):
+        result = validate_user(username=user.username, password=user.password)
+        if not result.success:
+            results[index] = result
+        elif user.username in pending:
+            results[index] = _duplicated_user_message(user.username)
+        else:
+            pending[user.username] = (index, user.password)
+    return results, pending
+
+
+def _complete_users(
+    users: list[UserCreateItem], results: list, pending: dict[str, tuple[int, str]], created: set[str],
+) -> list[UserActionMessage]:
+    for name, (index, _) in pending.items():
+        if name in created:
+            results[index] = UserActionMessage(success=True, reason='')
+        else:
+            results[index] = _duplicated_user_message(name)
+    for user, result in zip(users, results):
+        _audit(AUDIT_CREATE, user.username, result)
+    return results
+
+
+def _duplicated_user_message(username: str) -> UserActionMessage:
+    msg = 'The username: [%s] has been created already, please change another one.' % username
+    return UserActionMessage(success=False, reason=msg, code=ErrorCode.USERNAME_DUPLICATED)
+
+
+def create_users(users: list[UserCreateItem], session: Session) -> list[UserActionMessage]:
+    results, pending = _prepare_users(users)
+    created = set()
+    if pending:
+        password_hashes = hashing_service.hash_many([password for _, password in pending.values()])
+        created = create_db_users(list(zip(pending, password_hashes)), session=session)
+    return _complete_users(users, results, pending, created)
+
+
+def _verification_message(user_verify_svc: UserVerificationService, success: bool, msg: str) -> UserActionMessage:
     if not success:
-        return UserActionMessage(success=success, reason=msg)
-    try:
-        password_hash = hash_password(password=password)
-        create_db_user(name=username, password_hash=password_hash, session=session)
-    except IntegrityError as e:
-        logger.error(str(e))
-        msg = 'The username: [%s] has been created already, please change another one.' % username
-        return UserActionMessage(success=False, reason=msg)
-    return UserActionMessage(success=True, reason='')
+        result = UserActionMessage(success=success, reason=msg, code=user_verify_svc.error_code)
+    else:
+        token = token_signer.issue(user_id=user_verify_svc.db_user.id, username=user_verify_svc.name)
+        result = UserActionMessage(success=success, reason=msg, token=token)
+    return _audit(AUDIT_VERIFY, user_verify_svc.name, result)
 
 
 def verify_user(username: str, password: str, session: Session) -> UserActionMessage:
     user_verify_svc = UserVerificationService(name=username, password=password, session=session)
     success, msg = user_verify_svc.verify()
 
-    return UserActionMessage(success=success, reason=msg)
+    return _verification_message(user_verify_svc, success, msg)
+
+
+async def async_create_user(
+    username: str, password: str, session: AsyncSession, validated: bool = False,
+) -> UserActionMessage:
+    result = _validate_new_user(username, password, validated)
+    if result.success:
+        try:
+            password_hash = await hashing_service.async_hash(password)
+            await async_create_db_user(name=username, password_hash=password_hash, session=session)
+        except IntegrityError as e:
+            logger.warning('Failed to create the user %s, the username is taken: %s', username, type(e).__name__)
+            result = _duplicated_user_message(username)
+    return _audit(AUDIT_CREATE, username, result)
+
+
+async def async_create_users(users: list[UserCreateItem], session: AsyncSession) -> list[UserActionMessage]:
+    results, pending = _prepare_users(users)
+    created = set()
+    if pending:
+        password_hashes = await hashing_service.async_hash_many([password for _, password in pending.values()])
+        created = await async_create_db_users(list(zip(pending, password_hashes)), session=session)
+    return _complete_users(users, results, pending, created)
+
+
+async def async_verify_user(username: str, password: str, session: AsyncSession) -> UserActionMessage:
+    user_verify_svc = AsyncUserVerificationService(name=username, password=password, session=session)
+    success, msg = await user_verify_svc.verify()
+
+    return _verification_message(user_verify_svc, success, msg)
+
+
+def _row_key(order_by: str, row: tuple[int, str]) -> Union[int, str]:
+    return row[1] if order_by == 'name' else row[0]
+
+
+def encode_cursor(order_by: str, row: tuple[int, str]) -> str:
+    """Opaque cursor of the page after `row`."""
+    return base64.urlsafe_b64encode(orjson.dumps([order_by, _row_key(order_by, row)])).rstrip(b'=').decode('ascii')
+
+
+def decode_cursor(cursor: Optional[str], order_by: str) -> Union[int, str, None]:
+    """Return the key a cursor continues after, raise ValueError if it is not one of `order_by`."""
+    if not cursor:
+        return None
+    try:
+        cursor_order, key = orjson.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (binascii.Error, orjson.JSONDecodeError, TypeError, ValueError):
+        raise ValueError('The cursor is invalid.')
+    if cursor_order != order_by or not isinstance(key, str if order_by == 'name' else int):
+        raise ValueError('The cursor does not belong to a listing ordered by %s.' % order_by)
+    return key
+
+
+def _user_dicts(rows: list[tuple[int, str]]) -> list[dict]:
+    return [{'id': user_id, 'username': name} for user_id, name in rows]
+
+
+def list_users(session: Session, limit: int, after=None, prefix: Optional[str] = None, order_by: str = 'name') -> dict:
+    """One page of users and the cursor of the next one, None on the last page."""
+    # One row past the page tells whether there is a next one
+    rows = list_db_users(session, limit + 1, after=after, prefix=prefix, order_by=order_by)
+    next_cursor = encode_cursor(order_by, rows[limit - 1]) if len(rows) > limit else None
+    return {'users': _user_dicts(rows[:limit]), 'next_cursor': next_cursor}
+
+
+def _ndjson_chunk(rows: list[tuple[int, str]]) -> bytes:
+    return b''.join(orjson.dumps(user) + b'\n' for user in _user_dicts(rows))
+
+
+def stream_users(
+    session: Session, limit: int, after=None, prefix: Optional[str] = None, order_by: str = 'name',
+    chunk_size: int = USER_LIST_CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """Yield a page of `list_users` as NDJSON, read `chunk_size` users at a time.
+
+    One line per user, then a last `{"next_cursor": ...}` line.
+    """
+    remaining, next_cursor = limit, None
+    while remaining:
+        size = min(chunk_size, remaining)
+        rows = list_db_users(session, size + 1, after=after, prefix=prefix, order_by=order_by)
+        page = rows[:size]
+        if page:
+            yield _ndjson_chunk(page)
+        if len(rows) <= size:
+            break
+        remaining -= size
+        after = _row_key(order_by, page[-1])
+        next_cursor = encode_cursor(order_by, page[-1]) if not remaining else None
+    yield orjson.dumps({'next_cursor': next_cursor}) + b'\n'
+
+
+async def async_list_users(
+    session: AsyncSession, limit: int, after=None, prefix: Optional[str] = None, order_by: str = 'name',
+) -> dict:
+    rows = await async_list_db_users(session, limit + 1, after=after, prefix=prefix, order_by=order_by)
+    next_cursor = encode_cursor(order_by, rows[limit - 1]) if len(rows) > limit else None
+    return {'users': _user_dicts(rows[:limit]), 'next_cursor': next_cursor}
+
+
+async def async_stream_users(
+    session: AsyncSession, limit: int, after=None, prefix: Optional[str] = None, order_by: str = 'name',
+    chunk_size: int = USER_LIST_CHUNK_SIZE,
+) -> AsyncIterator[bytes]:
+    remaining, next_cursor = limit, None
+    while remaining:
+        size = min(chunk_size, remaining)
+        rows = await async_list_db_users(session, size + 1, after=after, prefix=prefix, order_by=order_by)
+        page = rows[:size]
+        if page:
+            yield _ndjson_chunk(page)
+        if len(rows) <= size:
+            break
+        remaining -= size
+        after = _row_key(order_by, page[-1])
+        next_cursor = encode_cursor(order_by, page[-1]) if not remaining else None
+    yield orjson.dumps({'next_cursor': next_cursor}) + b'\n'
@@ -1,6 +1,5 @@
 from logging.config import fileConfig
 import importlib
-import os
 import pathlib
 import sys
 
@@ -15,17 +14,20 @@ config = context.config
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
-if config.config_file_name is not None:
+# Skipped when the app runs the migrations in process, see db/migration.py.
+if config.config_file_name is not None and config.attributes.get('configure_logger', True):
     fileConfig(config.config_file_name)
 
 # add your model's MetaData object here
 # for 'autogenerate' support
 # from myapp import mymodel
 # target_metadata = mymodel.Base.metadata
-sys.path.append(os.path.normpath('../'))
+SRC_PATH = pathlib.Path(__file__).resolve().parents[2]
+if str(SRC_PATH) not in sys.path:
+    sys.path.append(str(SRC_PATH))
 from db.base import Base
 
-model_dir = pathlib.Path('../').joinpath('db')
+model_dir = SRC_PATH.joinpath('db')
 for entry in model_dir.iterdir():
     if entry.is_dir() or entry.suffix != '.py' or entry.stem == 'base':
         continue
@@ -69,8 +71,25 @@ def run_migrations_online() -> None:
     and associate a connection with the context.
 
     """
+    connection = config.attributes.get('connection')
+    if connection is not None:
+        # Connection of the app engine, passed by db/migration.py
+        context.configure(
+            connection=connection, target_metadata=target_metadata
+        )
+
+        with context.begin_transaction():
+            context.run_migrations()
+        return
+
+    # `alembic -x url=...` overrides sqlalchemy.url of alembic.ini
+    section = config.get_section(config.config_ini_section, {})
+    section.update({
+        'sqlalchemy.url': url
+        for key, url in context.get_x_argument(as_dictionary=True).items() if key == 'url'
+    })
     connectable = engine_from_config(
-        config.get_section(config.config_ini_section, {}),
+        section,
         prefix="sqlalchemy.",
         poolclass=pool.NullPool,
     )
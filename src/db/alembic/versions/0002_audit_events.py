@@ -0,0 +1,38 @@
+"""0002_audit_events
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 10:12:40.512113
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0002'
+down_revision: Union[str, None] = '0001'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('audit_events',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('created_at', sa.Float(), nullable=False),
+    sa.Column('action', sa.String(), nullable=False),
+    sa.Column('username', sa.String(), nullable=False),
+    sa.Column('success', sa.Boolean(), nullable=False),
+    sa.Column('code', sa.String(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_audit_events_created_at'), 'audit_events', ['created_at'], unique=False)
+    op.create_index(op.f('ix_audit_events_username'), 'audit_events', ['username'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_audit_events_username'), table_name='audit_events')
+    op.drop_index(op.f('ix_audit_events_created_at'), table_name='audit_events')
+    op.drop_table('audit_events')
@@ -0,0 +1,23 @@
+from sqlalchemy import Engine
+from sqlalchemy import insert
+from sqlalchemy.orm import mapped_column
+from sqlalchemy.orm import Mapped
+
+from db.base import Base
+
+
+class DBAuditEvent(Base):
+    __tablename__ = 'audit_events'
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    created_at: Mapped[float] = mapped_column(index=True)
+    action: Mapped[str]
+    username: Mapped[str] = mapped_column(index=True)
+    success: Mapped[bool]
+    code: Mapped[str]
+
+
+def insert_audit_events(rows: list[dict], db_engine: Engine):
+    """Write a batch of events in one transaction."""
+    with db_engine.begin() as connection:
+        connection.execute(insert(DBAuditEvent), rows)
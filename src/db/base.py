@@ -1,14 +1,209 @@
+import functools
+import threading
+import time
+from typing import Optional
+
 from sqlalchemy import create_engine
+from sqlalchemy import Engine
+from sqlalchemy import event
+from sqlalchemy import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.pool import QueuePool
 
-DATABASE_URL = "sqlite:///seano.db"
+from db.shards import AsyncShardedSession
+from db.shards import shard_urls
+from db.shards import ShardedSession
+from metrics import DB_POOL_CHECKOUTS
+from metrics import DB_POOL_CONNECTIONS
+from metrics import DB_POOL_WAIT_SECONDS
+from metrics import DB_POOL_WAIT_SECONDS_MAX
+from settings import DATABASE_ASYNC_URL
+from settings import DATABASE_MAX_OVERFLOW
+from settings import DATABASE_POOL_RECYCLE
+from settings import DATABASE_POOL_SIZE
+from settings import DATABASE_POOL_TIMEOUT
+from settings import DATABASE_SHARDS
+from settings import DATABASE_SQLITE_BUSY_TIMEOUT
+from settings import DATABASE_SQLITE_CACHE_SIZE
+from settings import DATABASE_SQLITE_JOURNAL_MODE
+from settings import DATABASE_SQLITE_MMAP_SIZE
+from settings import DATABASE_SQLITE_SYNCHRONOUS
+from settings import DATABASE_URL
 
 
 class NotFoundError(Exception):
     pass
 
 
+class PoolStats:
+    """Connection checkouts of a pool and the time spent waiting for them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record(self, waited: float, timed_out: bool = False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.checkouts += 1
+            self.wait_seconds_total += waited
+            self.wait_seconds_max = max(self.wait_seconds_max, waited)
+
+
+class _TimedPoolMixin:
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record(time.perf_counter() - started, timed_out=True)
+            raise
+        self.stats.record(time.perf_counter() - started)
+        return connection
+
+    def snapshot(self) -> dict:
+        return {
+            'size': self.size(),
+            'checked_out': self.checkedout(),
+            'checked_in': self.checkedin(),
+            'overflow': max(0, self.overflow()),
+            'checkouts': self.stats.checkouts,
+            'timeouts': self.stats.timeouts,
+            'wait_seconds_total': self.stats.wait_seconds_total,
+            'wait_seconds_max': self.stats.wait_seconds_max,
+        }
+
+
+class TimedQueuePool(_TimedPoolMixin, QueuePool):
+    pass
+
+
+class TimedAsyncAdaptedQueuePool(_TimedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def _sqlite_pragmas(
+    journal_mode: str = DATABASE_SQLITE_JOURNAL_MODE,
+    synchronous: str = DATABASE_SQLITE_SYNCHRONOUS,
+    busy_timeout: int = DATABASE_SQLITE_BUSY_TIMEOUT,
+    mmap_size: int = DATABASE_SQLITE_MMAP_SIZE,
+    cache_size: int = DATABASE_SQLITE_CACHE_SIZE,
+) -> list[str]:
+    return [
+        'PRAGMA journal_mode=%s' % journal_mode,
+        'PRAGMA synchronous=%s' % synchronous,
+        'PRAGMA busy_timeout=%d' % busy_timeout,
+        'PRAGMA mmap_size=%d' % mmap_size,
+        'PRAGMA cache_size=%d' % cache_size,
+    ]
+
+
+def _engine_options(url: str, pool_class: type, pragmas: Optional[dict]) -> tuple[dict, list[str]]:
+    """Return the `create_engine` options for a URL and the pragmas to run on every new connection."""
+    parsed = make_url(url)
+    if parsed.get_backend_name() == 'sqlite' and parsed.database in (None, '', ':memory:'):
+        # In-memory SQLite lives and dies with its single connection, keep the dialect defaults.
+        return {}, []
+    options = {
+        'poolclass': pool_class,
+        'pool_size': DATABASE_POOL_SIZE,
+        'max_overflow': DATABASE_MAX_OVERFLOW,
+        'pool_timeout': DATABASE_POOL_TIMEOUT,
+        'pool_recycle': DATABASE_POOL_RECYCLE,
+    }
+    if parsed.get_backend_name() != 'sqlite':
+        options['pool_pre_ping'] = True
+        return options, []
+    return options, _sqlite_pragmas(**(pragmas or {}))
+
+
+def _listen_for_pragmas(sync_engine: Engine, pragmas: list[str]):
+    if not pragmas:
+        return
+
+    @event.listens_for(sync_engine, 'connect')
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in pragmas:
+            cursor.execute(pragma)
+        cursor.close()
+
+
+def build_engine(url: str = DATABASE_URL, pragmas: Optional[dict] = None) -> Engine:
+    """Create an engine from the DATABASE_* settings, `pragmas` overrides the SQLite ones by name.
+
+    The bound parameters, password hashes among them, are left out of the messages of the database errors.
+    """
+    options, sqlite_pragmas = _engine_options(url, TimedQueuePool, pragmas)
+    db_engine = create_engine(url, hide_parameters=True, **options)
+    _listen_for_pragmas(db_engine, sqlite_pragmas)
+    return db_engine
+
+
+def build_async_engine(url: str = DATABASE_ASYNC_URL, pragmas: Optional[dict] = None) -> AsyncEngine:
+    # aiosqlite defaults to NullPool, which opens a connection and a worker thread per session.
+    options, sqlite_pragmas = _engine_options(url, TimedAsyncAdaptedQueuePool, pragmas)
+    db_engine = create_async_engine(url, hide_parameters=True, **options)
+    _listen_for_pragmas(db_engine.sync_engine, sqlite_pragmas)
+    return db_engine
+
+
+def _engines() -> list[tuple[str, Engine]]:
+    """`(label, engine)` of every engine, the labels carry the shard number when sharded."""
+    engines = []
+    for kind, kind_engines in (('sync', shard_engines), ('async', [e.sync_engine for e in async_shard_engines])):
+        for shard, db_engine in enumerate(kind_engines):
+            engines.append((kind if DATABASE_SHARDS == 1 else '%s-%d' % (kind, shard), db_engine))
+    return engines
+
+
+def _export_pool_metrics(name: str, db_engine: Engine):
+    # Read `engine.pool` when scraped, disposing the engine, e.g. in a forked worker, replaces the pool.
+    def field(key: str):
+        return lambda: db_engine.pool.snapshot()[key]
+
+    for state in ('checked_out', 'checked_in', 'overflow'):
+        DB_POOL_CONNECTIONS.labels(name, state).set_function(field(state))
+    DB_POOL_CHECKOUTS.labels(name, 'ok').set_function(field('checkouts'))
+    DB_POOL_CHECKOUTS.labels(name, 'timeout').set_function(field('timeouts'))
+    DB_POOL_WAIT_SECONDS.labels(name).set_function(field('wait_seconds_total'))
+    DB_POOL_WAIT_SECONDS_MAX.labels(name).set_function(field('wait_seconds_max'))
+
+
 Base = declarative_base()
-engine = create_engine(DATABASE_URL)
-session_local = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# One engine per shard, `engine` and `async_engine` are the first shard, the whole database when unsharded.
+shard_engines = [build_engine(url) for url in shard_urls(DATABASE_URL, DATABASE_SHARDS)]
+async_shard_engines = [build_async_engine(url) for url in shard_urls(DATABASE_ASYNC_URL, DATABASE_SHARDS)]
+engine = shard_engines[0]
+async_engine = async_shard_engines[0]
+if DATABASE_SHARDS == 1:
+    session_local = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    async_session_local = async_sessionmaker(autoflush=False, expire_on_commit=False, bind=async_engine)
+else:
+    # Sessions open one session per shard they touch, see `db.utils.sharded_session` and `db.user._route`.
+    session_local = functools.partial(ShardedSession, [
+        sessionmaker(autocommit=False, autoflush=False, bind=db_engine) for db_engine in shard_engines
+    ])
+    async_session_local = functools.partial(AsyncShardedSession, [
+        async_sessionmaker(autoflush=False, expire_on_commit=False, bind=db_engine)
+        for db_engine in async_shard_engines
+    ])
+
+for _name, _engine in _engines():
+    if isinstance(_engine.pool, _TimedPoolMixin):
+        _export_pool_metrics(_name, _engine)
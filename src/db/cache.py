@@ -0,0 +1,91 @@
+from collections import OrderedDict
+import threading
+import time
+from typing import Any
+from typing import Callable
+from typing import Hashable
+from typing import NamedTuple
+from typing import Optional
+
+from metrics import CREDENTIAL_CACHE_ENTRIES
+from metrics import CREDENTIAL_CACHE_EVENTS
+from settings import USER_CACHE_MAX_SIZE
+from settings import USER_CACHE_TTL
+
+
+class UserCredential(NamedTuple):
+    id: int
+    name: str
+    password_hash: str
+
+
+class LRUCache:
+    """Bounded mapping evicting the least recently used entry, entries also expire after `ttl` seconds."""
+
+    def __init__(self, max_size: int, ttl: float, clock: Callable[[], float] = time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= self.clock():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+# name -> UserCredential of the users verifying themselves
+credential_cache = LRUCache(max_size=USER_CACHE_MAX_SIZE, ttl=USER_CACHE_TTL)
+CREDENTIAL_CACHE_ENTRIES.set_function(credential_cache.__len__)
+# hit / (hit + miss) is the hit rate. Expirations tell USER_CACHE_TTL is short, evictions USER_CACHE_MAX_SIZE.
+for _event, _key in (('hit', 'hits'), ('miss', 'misses'), ('eviction', 'evictions'), ('expiration', 'expirations')):
+    CREDENTIAL_CACHE_EVENTS.labels(_event).set_function(lambda key=_key: credential_cache.stats()[key])
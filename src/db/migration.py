@@ -0,0 +1,87 @@
+from contextlib import contextmanager
+import fcntl
+import functools
+import logging
+import pathlib
+import time
+from typing import Optional
+
+from alembic import command
+from alembic.config import Config
+from alembic.script import ScriptDirectory
+from sqlalchemy import Engine
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from db.base import engine
+from db.base import shard_engines
+from settings import MIGRATION_LOCK_PATH
+
+
+logger = logging.getLogger(__name__)
+
+ALEMBIC_PATH = pathlib.Path(__file__).resolve().parent
+
+
+def alembic_config() -> Config:
+    config = Config(str(ALEMBIC_PATH.joinpath('alembic.ini')))
+    config.set_main_option('script_location', str(ALEMBIC_PATH.joinpath('alembic')))
+    # The app has its own logging, env.py must not reconfigure it.
+    config.attributes['configure_logger'] = False
+    return config
+
+
+@functools.lru_cache(maxsize=None)
+def head_revision() -> str:
+    return ScriptDirectory.from_config(alembic_config()).get_current_head()
+
+
+def current_revision(db_engine: Engine) -> Optional[str]:
+    try:
+        with db_engine.connect() as connection:
+            return connection.execute(text('SELECT version_num FROM alembic_version')).scalar()
+    except DBAPIError:
+        # No alembic_version table yet
+        return None
+
+
+@contextmanager
+def _file_lock(path: Optional[str]):
+    if path is None:
+        yield
+        return
+    with open(path, 'a') as lock_file:
+        started = time.perf_counter()
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        waited = time.perf_counter() - started
+        if waited > 0.1:
+            logger.info('Waited %.1f s for another process to migrate the database.', waited)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def migrate_db_schema(db_engine: Engine = engine, lock_path: Optional[str] = MIGRATION_LOCK_PATH) -> bool:
+    """Upgrade the database to the head revision in process, return whether anything ran.
+
+    An up-to-date database costs one query. Otherwise the first process to take the file lock
+    migrates while the other ones wait for it, then find the database up to date.
+    """
+    head = head_revision()
+    if current_revision(db_engine) == head:
+        return False
+    with _file_lock(lock_path):
+        if current_revision(db_engine) == head:
+            return False
+        logger.info('Upgrading the database schema to %s.', head)
+        config = alembic_config()
+        with db_engine.begin() as connection:
+            config.attributes['connection'] = connection
+            command.upgrade(config, 'head')
+    return True
+
+
+def migrate_db_shards(lock_path: Optional[str] = MIGRATION_LOCK_PATH) -> bool:
+    """Upgrade every shard of the database, the only one when it is not sharded."""
+    return any([migrate_db_schema(db_engine, lock_path) for db_engine in shard_engines])
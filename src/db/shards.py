@@ -0,0 +1,113 @@
+"""Hash partitioning of the users over several databases.
+
+A user lives in shard `shard_for(name, shards)`, a jump consistent hash of the name: growing from
+N to N + 1 shards only moves the users bound to the new shard. The ids of shard i are allocated
+from `[i << SHARD_ID_BITS, (i + 1) << SHARD_ID_BITS)`, so they stay unique across shards.
+"""
+import hashlib
+import pathlib
+from typing import Callable
+from typing import Generic
+from typing import TypeVar
+
+from sqlalchemy import make_url
+
+
+SHARD_ID_BITS = 40
+SessionType = TypeVar('SessionType')
+
+
+def shard_for(name: str, shards: int) -> int:
+    """Jump consistent hash (Lamping and Veach) of the blake2b digest of `name`."""
+    key = int.from_bytes(hashlib.blake2b(name.encode('utf-8'), digest_size=8).digest(), 'big')
+    bucket, candidate = -1, 0
+    while candidate < shards:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def shard_id_range(shard: int) -> tuple[int, int]:
+    return shard << SHARD_ID_BITS, (shard + 1) << SHARD_ID_BITS
+
+
+def shard_urls(url: str, shards: int) -> list[str]:
+    """URLs of the shard databases of a SQLite file URL, `seano.db` gives `seano.0.db`, `seano.1.db`...
+
+    A single shard is the unsharded database itself.
+    """
+    if shards == 1:
+        return [url]
+    parsed = make_url(url)
+    if parsed.get_backend_name() != 'sqlite' or parsed.database in (None, '', ':memory:'):
+        raise ValueError('Sharding needs a SQLite file database, got %s.' % url)
+    path = pathlib.PurePath(parsed.database)
+    return [
+        parsed.set(database=str(path.with_name('%s.%d%s' % (path.stem, shard, path.suffix)))).render_as_string(False)
+        for shard in range(shards)
+    ]
+
+
+class ShardedSession(Generic[SessionType]):
+    """One session per shard, each created on first use."""
+
+    def __init__(self, factories: list[Callable[[], SessionType]]):
+        self.factories = factories
+        self._sessions: dict[int, SessionType] = {}
+
+    @property
+    def shards(self) -> int:
+        return len(self.factories)
+
+    def for_shard(self, shard: int) -> SessionType:
+        session = self._sessions.get(shard)
+        if session is None:
+            session = self._sessions[shard] = self.factories[shard]()
+        return session
+
+    def for_name(self, name: str) -> SessionType:
+        return self.for_shard(shard_for(name, self.shards))
+
+    def all(self) -> list[tuple[int, SessionType]]:
+        return [(shard, self.for_shard(shard)) for shard in range(self.shards)]
+
+    def commit(self):
+        for session in self._sessions.values():
+            session.commit()
+
+    def rollback(self):
+        for session in self._sessions.values():
+            session.rollback()
+
+    def close(self):
+        for session in self._sessions.values():
+            session.close()
+        self._sessions.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class AsyncShardedSession(ShardedSession[SessionType]):
+    async def commit(self):
+        for session in self._sessions.values():
+            await session.commit()
+
+    async def rollback(self):
+        for session in self._sessions.values():
+            await session.rollback()
+
+    async def close(self):
+        for session in self._sessions.values():
+            await session.close()
+        self._sessions.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
@@ -1,10 +1,29 @@
+import heapq
+import itertools
+from typing import Iterable
+from typing import Optional
 from typing import Union
 
+from sqlalchemy import func
+from sqlalchemy import insert
+from sqlalchemy import select
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import mapped_column
 from sqlalchemy.orm import Mapped
 from sqlalchemy.orm import Session
 
 from db.base import Base
+from db.cache import credential_cache
+from db.cache import UserCredential
+from db.shards import shard_for
+from db.shards import shard_id_range
+from db.username_filter import username_filter
+from db.utils import sharded_session
+from metrics import DB_QUERY_DURATION
+from metrics import timed
+from settings import BULK_CREATE_CHUNK_SIZE
 
 
 class DBUser(Base):
@@ -15,17 +34,320 @@ class DBUser(Base):
     password_hash: Mapped[str]
 
 
+# Highest id read from each shard by the username filter, the filter itself only keeps one
+_shard_last_ids: dict[int, int] = {}
+
+
+def _route(name: str, session):
+    """Return the shard of `name` and its session, the shard is None when the database is not sharded."""
+    sharded = sharded_session(session)
+    if sharded is None:
+        return None, session
+    shard = shard_for(name, sharded.shards)
+    return shard, sharded.for_shard(shard)
+
+
+def _by_shard(users: list[tuple[str, str]], shards: int) -> dict[int, list[tuple[str, str]]]:
+    grouped = {}
+    for user in users:
+        grouped.setdefault(shard_for(user[0], shards), []).append(user)
+    return grouped
+
+
+def shard_id_values(shard: Optional[int]) -> dict:
+    """Column values of new rows, the ids of a shard are allocated from its own range."""
+    if shard is None:
+        return {}
+    start, _ = shard_id_range(shard)
+    return {'id': select(func.coalesce(func.max(DBUser.id), start) + 1).scalar_subquery()}
+
+
+@timed(DB_QUERY_DURATION.labels('create_db_user'))
 def create_db_user(name: str, password_hash: str, session: Session) -> DBUser:
-    db_user = DBUser(name=name, password_hash=password_hash)
+    shard, session = _route(name, session)
+    db_user = DBUser(name=name, password_hash=password_hash, **shard_id_values(shard))
     session.add(db_user)
     session.commit()
     session.refresh(db_user)
+    credential_cache.invalidate(name)
+    username_filter.add(name)
     return db_user
 
 
+@timed(DB_QUERY_DURATION.labels('create_db_users'))
+def create_db_users(users: list[tuple[str, str]], session: Session, chunk_size: int = BULK_CREATE_CHUNK_SIZE) -> set[str]:
+    """Insert `(name, password_hash)` pairs with one executemany per chunk, return the names created.
+
+    Names which exist already are skipped instead of failing the whole chunk.
+    """
+    sharded = sharded_session(session)
+    if sharded is None:
+        created = _insert_db_users(users, session, chunk_size, None)
+    else:
+        created = set()
+        for shard, shard_users in _by_shard(users, sharded.shards).items():
+            created.update(_insert_db_users(shard_users, sharded.for_shard(shard), chunk_size, shard))
+    for name in created:
+        credential_cache.invalidate(name)
+    username_filter.add(*created)
+    return created
+
+
+def _insert_db_users(users: list[tuple[str, str]], session: Session, chunk_size: int, shard: Optional[int]) -> set[str]:
+    created = set()
+    statement = insert(DBUser).values(**shard_id_values(shard))
+    for start in range(0, len(users), chunk_size):
+        chunk = users[start:start + chunk_size]
+        existing = set()
+        names = [name for name, _ in chunk if username_filter.might_contain(name)]
+        if names:
+            existing.update(session.scalars(select(DBUser.name).where(DBUser.name.in_(names))))
+        rows = [{'name': name, 'password_hash': password_hash} for name, password_hash in chunk if name not in existing]
+        if not rows:
+            continue
+        try:
+            session.execute(statement, rows)
+            session.commit()
+            created.update(row['name'] for row in rows)
+        except IntegrityError:
+            # Another request took some of the names in the meantime, fall back to one row at a time.
+            session.rollback()
+            for row in rows:
+                try:
+                    with session.begin_nested():
+                        session.execute(statement, row)
+                    created.add(row['name'])
+                except IntegrityError:
+                    pass
+            session.commit()
+    return created
+
+
+@timed(DB_QUERY_DURATION.labels('get_db_user'))
 def get_db_user(name: str, session: Session, password_hash: str = None) -> Union[DBUser, None]:
+    _, session = _route(name, session)
     query = session.query(DBUser).filter(DBUser.name == name)
     if password_hash is not None:
         query = query.filter(DBUser.password_hash == password_hash)
     db_user = query.first()
     return db_user
+
+
+def _credential_query(name: str):
+    return select(DBUser.id, DBUser.name, DBUser.password_hash).where(DBUser.name == name).limit(1)
+
+
+@timed(DB_QUERY_DURATION.labels('get_db_user_credential'))
+def get_db_user_credential(name: str, session: Session) -> Optional[UserCredential]:
+    """Look up the id and password hash of a user, served from `credential_cache` when possible."""
+    credential = credential_cache.get(name)
+    if credential is not None:
+        return credential
+    _, session = _route(name, session)
+    row = session.execute(_credential_query(name)).first()
+    if row is None:
+        return None
+    credential = UserCredential(*row)
+    credential_cache.set(name, credential)
+    return credential
+
+
+def _tracked_rows(shard: int, rows: Iterable[tuple[int, str]]):
+    for user_id, name in rows:
+        _shard_last_ids[shard] = max(_shard_last_ids.get(shard, 0), user_id)
+        yield user_id, name
+
+
+@timed(DB_QUERY_DURATION.labels('rebuild_username_filter'))
+def rebuild_username_filter(session: Session):
+    # Read before the rows, users committed meanwhile leave the filter stale rather than missing
+    marker = username_filter.marker.read()
+    sharded = sharded_session(session)
+    if sharded is None:
+        count = session.scalar(select(func.count()).select_from(DBUser))
+        rows = session.execute(select(DBUser.id, DBUser.name).execution_options(yield_per=10000))
+        username_filter.rebuild(count=count, rows=rows, marker=marker)
+        return
+    shard_sessions = sharded.all()
+    count = sum(shard_session.scalar(select(func.count()).select_from(DBUser)) for _, shard_session in shard_sessions)
+    rows = itertools.chain.from_iterable(
+        _tracked_rows(shard, shard_session.execute(select(DBUser.id, DBUser.name).execution_options(yield_per=10000)))
+        for shard, shard_session in shard_sessions
+    )
+    username_filter.rebuild(count=count, rows=rows, marker=marker)
+
+
+@timed(DB_QUERY_DURATION.labels('refresh_username_filter'))
+def refresh_username_filter(session: Session):
+    """Pick up the users created by other workers, rebuild the filter once it is over capacity."""
+    if username_filter.needs_rebuild:
+        rebuild_username_filter(session)
+        return
+    marker = username_filter.marker.read()
+    sharded = sharded_session(session)
+    if sharded is None:
+        rows = session.execute(select(DBUser.id, DBUser.name).where(DBUser.id > username_filter.last_id))
+        username_filter.extend(rows, marker=marker)
+        return
+    rows = itertools.chain.from_iterable(
+        _tracked_rows(shard, shard_session.execute(
+            select(DBUser.id, DBUser.name).where(DBUser.id > _shard_last_ids.get(shard, shard_id_range(shard)[0]))
+        ))
+        for shard, shard_session in sharded.all()
+    )
+    username_filter.extend(rows, marker=marker)
+
+
+def _prefix_end(prefix: str) -> Optional[str]:
+    """Smallest string above every string starting with `prefix`, None if there is none."""
+    while prefix and prefix[-1] == chr(0x10FFFF):
+        prefix = prefix[:-1]
+    if not prefix:
+        return None
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def _list_query(limit: int, after: Union[int, str, None], prefix: Optional[str], order_by: str):
+    """Keyset query of `(id, name)` rows, `name >= prefix AND name < end` stays a range scan of ix_users_name."""
+    column = DBUser.name if order_by == 'name' else DBUser.id
+    query = select(DBUser.id, DBUser.name)
+    if after is not None:
+        query = query.where(column > after)
+    if prefix:
+        query = query.where(DBUser.name >= prefix)
+        end = _prefix_end(prefix)
+        if end is not None:
+            query = query.where(DBUser.name < end)
+    return query.order_by(column).limit(limit)
+
+
+def _merge_shards(pages: list[list], limit: int, order_by: str) -> list[tuple[int, str]]:
+    index = 1 if order_by == 'name' else 0
+    return list(itertools.islice(heapq.merge(*pages, key=lambda row: row[index]), limit))
+
+
+@timed(DB_QUERY_DURATION.labels('list_db_users'))
+def list_db_users(
+    session: Session, limit: int, after: Union[int, str, None] = None, prefix: Optional[str] = None,
+    order_by: str = 'name',
+) -> list[tuple[int, str]]:
+    """Return up to `limit` `(id, name)` rows following `after` in `order_by` order, `name` or `id`."""
+    query = _list_query(limit, after, prefix, order_by)
+    sharded = sharded_session(session)
+    if sharded is None:
+        return [tuple(row) for row in session.execute(query)]
+    pages = [[tuple(row) for row in shard_session.execute(query)] for _, shard_session in sharded.all()]
+    return _merge_shards(pages, limit, order_by)
+
+
+@timed(DB_QUERY_DURATION.labels('update_db_user_password_hash'))
+def update_db_user_password_hash(name: str, password_hash: str, session: Session):
+    _, session = _route(name, session)
+    session.execute(update(DBUser).where(DBUser.name == name).values(password_hash=password_hash))
+    session.commit()
+    credential_cache.invalidate(name)
+
+
+@timed(DB_QUERY_DURATION.labels('async_create_db_user'))
+async def async_create_db_user(name: str, password_hash: str, session: AsyncSession) -> DBUser:
+    shard, session = _route(name, session)
+    db_user = DBUser(name=name, password_hash=password_hash, **shard_id_values(shard))
+    session.add(db_user)
+    await session.commit()
+    await session.refresh(db_user)
+    credential_cache.invalidate(name)
+    username_filter.add(name)
+    return db_user
+
+
+@timed(DB_QUERY_DURATION.labels('async_create_db_users'))
+async def async_create_db_users(
+    users: list[tuple[str, str]], session: AsyncSession, chunk_size: int = BULK_CREATE_CHUNK_SIZE,
+) -> set[str]:
+    sharded = sharded_session(session)
+    if sharded is None:
+        created = await _async_insert_db_users(users, session, chunk_size, None)
+    else:
+        created = set()
+        for shard, shard_users in _by_shard(users, sharded.shards).items():
+            created.update(await _async_insert_db_users(shard_users, sharded.for_shard(shard), chunk_size, shard))
+    for name in created:
+        credential_cache.invalidate(name)
+    username_filter.add(*created)
+    return created
+
+
+async def _async_insert_db_users(
+    users: list[tuple[str, str]], session: AsyncSession, chunk_size: int, shard: Optional[int],
+) -> set[str]:
+    created = set()
+    statement = insert(DBUser).values(**shard_id_values(shard))
+    for start in range(0, len(users), chunk_size):
+        chunk = users[start:start + chunk_size]
+        existing = set()
+        names = [name for name, _ in chunk if username_filter.might_contain(name)]
+        if names:
+            existing.update(await session.scalars(select(DBUser.name).where(DBUser.name.in_(names))))
+        rows = [{'name': name, 'password_hash': password_hash} for name, password_hash in chunk if name not in existing]
+        if not rows:
+            continue
+        try:
+            await session.execute(statement, rows)
+            await session.commit()
+            created.update(row['name'] for row in rows)
+        except IntegrityError:
+            await session.rollback()
+            for row in rows:
+                try:
+                    async with session.begin_nested():
+                        await session.execute(statement, row)
+                    created.add(row['name'])
+                except IntegrityError:
+                    pass
+            await session.commit()
+    return created
+
+
+@timed(DB_QUERY_DURATION.labels('async_get_db_user'))
+async def async_get_db_user(name: str, session: AsyncSession, password_hash: str = None) -> Union[DBUser, None]:
+    _, session = _route(name, session)
+    query = select(DBUser).filter(DBUser.name == name)
+    if password_hash is not None:
+        query = query.filter(DBUser.password_hash == password_hash)
+    result = await session.execute(query.limit(1))
+    return result.scalars().first()
+
+
+@timed(DB_QUERY_DURATION.labels('async_get_db_user_credential'))
+async def async_get_db_user_credential(name: str, session: AsyncSession) -> Optional[UserCredential]:
+    credential = credential_cache.get(name)
+    if credential is not None:
+        return credential
+    _, session = _route(name, session)
+    row = (await session.execute(_credential_query(name))).first()
+    if row is None:
+        return None
+    credential = UserCredential(*row)
+    credential_cache.set(name, credential)
+    return credential
+
+
+@timed(DB_QUERY_DURATION.labels('async_list_db_users'))
+async def async_list_db_users(
+    session: AsyncSession, limit: int, after: Union[int, str, None] = None, prefix: Optional[str] = None,
+    order_by: str = 'name',
+) -> list[tuple[int, str]]:
+    query = _list_query(limit, after, prefix, order_by)
+    sharded = sharded_session(session)
+    if sharded is None:
+        return [tuple(row) for row in await session.execute(query)]
+    pages = [[tuple(row) for row in await shard_session.execute(query)] for _, shard_session in sharded.all()]
+    return _merge_shards(pages, limit, order_by)
+
+
+@timed(DB_QUERY_DURATION.labels('async_update_db_user_password_hash'))
+async def async_update_db_user_password_hash(name: str, password_hash: str, session: AsyncSession):
+    _, session = _route(name, session)
+    await session.execute(update(DBUser).where(DBUser.name == name).values(password_hash=password_hash))
+    await session.commit()
+    credential_cache.invalidate(name)
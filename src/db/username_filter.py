@@ -0,0 +1,269 @@
+"""Bloom filter of the user names, verifications of names it has never seen skip the database.
+
+Every worker keeps its own filter and picks up the users of the other processes every
+USERNAME_FILTER_REFRESH_INTERVAL seconds. A miss is only trusted while the filter is current,
+i.e. while no other process wrote users since its last refresh, which `UsersMarker` tells.
+Each create of another worker makes the filter stale until its next refresh, so under steady
+signups on several workers most misses go to the database anyway; the stale ones are counted in
+`username_filter_checks_total{result="stale"}`. The filter pays off with one worker, or when
+lookups of unknown names, e.g. credential stuffing, outnumber the signups. A shorter refresh
+interval narrows the stale windows at the cost of one query per interval.
+"""
+import fcntl
+import hashlib
+import logging
+import math
+import mmap
+import os
+import threading
+from typing import Iterable
+from typing import Optional
+
+from metrics import USERNAME_FILTER_BYTES
+from metrics import USERNAME_FILTER_CHECKS
+from metrics import USERNAME_FILTER_ENTRIES
+from metrics import USERNAME_FILTER_ESTIMATED_FP_RATE
+from settings import USERNAME_FILTER_ENABLED
+from settings import USERNAME_FILTER_FP_RATE
+from settings import USERNAME_FILTER_MIN_CAPACITY
+from settings import USERS_MARKER_PATH
+
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    """Bit array sized for `capacity` keys at a false positive rate of `fp_rate`."""
+
+    def __init__(self, capacity: int, fp_rate: float):
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.size = max(8, math.ceil(-capacity * math.log(fp_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key: str):
+        # Double hashing, the k positions are derived from the two halves of one digest.
+        digest = hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, key: str):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self.bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self.bits)
+
+    def estimated_fp_rate(self) -> float:
+        return (1 - math.exp(-self.hash_count * self.count / self.size)) ** self.hash_count
+
+
+class UsersMarker:
+    """Eight bytes of a memory-mapped file, set to a new random value by every process which wrote users.
+
+    The workers and the tools of a host map the same file. A filter synced while the marker held
+    its current value has seen every user committed so far. Without a path the marker never
+    holds a value, and no filter is ever known to be current.
+    """
+
+    SIZE = 8
+
+    def __init__(self, path: Optional[str] = USERS_MARKER_PATH):
+        self.path = path or None
+        self._fd: Optional[int] = None
+        self._map: Optional[mmap.mmap] = None
+        # fcntl locks are held by the process, the threads of one take turns on this one first
+        self._lock = threading.Lock()
+
+    def _mapped(self) -> Optional[mmap.mmap]:
+        if self._map is None and self.path is not None:
+            with self._lock:
+                if self._map is None:
+                    fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                    fcntl.lockf(fd, fcntl.LOCK_EX)
+                    try:
+                        if os.fstat(fd).st_size < self.SIZE:
+                            os.ftruncate(fd, self.SIZE)
+                    finally:
+                        fcntl.lockf(fd, fcntl.LOCK_UN)
+                    self._fd = fd
+                    self._map = mmap.mmap(fd, self.SIZE)
+        return self._map
+
+    def read(self) -> Optional[bytes]:
+        marker = self._mapped()
+        return marker[:self.SIZE] if marker is not None else None
+
+    def bump(self) -> tuple[Optional[bytes], Optional[bytes]]:
+        """Set a new value once users were committed, return the previous value and the new one."""
+        marker = self._mapped()
+        if marker is None:
+            return None, None
+        value = os.urandom(self.SIZE)
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX)
+            try:
+                previous = marker[:self.SIZE]
+                marker[:self.SIZE] = value
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN)
+        return previous, value
+
+
+class UsernameFilter:
+    """Bloom filter of the existing user names, a miss means the user definitely does not exist.
+
+    Until it is built, and when disabled, every name may exist. Names created by this process
+    are added right away, the ones created by other processes by the next periodic `extend`.
+    Meanwhile `marker` tells they exist, and every name may exist until the filter synced again.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = USERNAME_FILTER_ENABLED,
+        fp_rate: float = USERNAME_FILTER_FP_RATE,
+        min_capacity: int = USERNAME_FILTER_MIN_CAPACITY,
+        marker: Optional[UsersMarker] = None,
+    ):
+        self.enabled = enabled
+        self.fp_rate = fp_rate
+        self.min_capacity = min_capacity
+        self.marker = marker if marker is not None else UsersMarker()
+        self._filter: Optional[BloomFilter] = None
+        self._last_id = 0
+        self._backlog: Optional[list[str]] = None
+        # Value of the marker when the rows in the filter were read
+        self._synced: Optional[bytes] = None
+        self._lock = threading.Lock()
+        self.checks = 0
+        self.misses = 0
+        self.stale_misses = 0
+
+    @property
+    def ready(self) -> bool:
+        return self._filter is not None
+
+    @property
+    def current(self) -> bool:
+        """Whether no other process wrote users since the filter was synced."""
+        return self._synced is not None and self._synced == self.marker.read()
+
+    def might_contain(self, name: str) -> bool:
+        bloom = self._filter
+        if bloom is None:
+            return True
+        self.checks += 1
+        if name in bloom:
+            return True
+        if not self.current:
+            # Possibly created by another process since the last sync
+            self.stale_misses += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, *names: str):
+        """Add the names of users just committed by this process, and tell the others through the marker."""
+        if not names:
+            return
+        with self._lock:
+            if self._backlog is not None:
+                self._backlog.extend(names)
+            if self._filter is not None:
+                for name in names:
+                    self._filter.add(name)
+            previous, value = self.marker.bump()
+            # Still current if nobody else wrote since the last sync
+            if previous is not None and previous == self._synced:
+                self._synced = value
+
+    @property
+    def last_id(self) -> int:
+        return self._last_id
+
+    @property
+    def needs_rebuild(self) -> bool:
+        bloom = self._filter
+        return bloom is not None and bloom.count > bloom.capacity
+
+    def rebuild(self, count: int, rows: Iterable[tuple[int, str]], marker: Optional[bytes]):
+        """Build a new filter from `count` `(id, name)` rows and swap it in.
+
+        `marker` is the value `self.marker` held before the rows were queried.
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self._backlog = []
+        try:
+            bloom = BloomFilter(capacity=max(self.min_capacity, count * 2), fp_rate=self.fp_rate)
+            last_id = 0
+            for user_id, name in rows:
+                bloom.add(name)
+                last_id = max(last_id, user_id)
+            with self._lock:
+                # Names created while the rows were read
+                for name in self._backlog:
+                    bloom.add(name)
+                self._filter = bloom
+                self._last_id = max(self._last_id, last_id)
+                self._synced = marker
+        finally:
+            self._backlog = None
+        logger.info('Built the username filter: %s', self.stats())
+
+    def extend(self, rows: Iterable[tuple[int, str]], marker: Optional[bytes]):
+        """Add `(id, name)` rows created since the last build, e.g. by other workers.
+
+        `marker` is the value `self.marker` held before the rows were queried.
+        """
+        with self._lock:
+            if self._filter is None:
+                return
+            for user_id, name in rows:
+                self._filter.add(name)
+                self._last_id = max(self._last_id, user_id)
+            self._synced = marker
+
+    def stats(self) -> dict:
+        bloom = self._filter
+        stats = {
+            'ready': bloom is not None,
+            'current': self.current,
+            'checks': self.checks,
+            'misses': self.misses,
+            'stale_misses': self.stale_misses,
+            'miss_rate': self.misses / self.checks if self.checks else 0.0,
+        }
+        if bloom is not None:
+            stats.update({
+                'names': bloom.count,
+                'capacity': bloom.capacity,
+                'hash_count': bloom.hash_count,
+                'memory_bytes': bloom.memory_bytes,
+                'estimated_fp_rate': bloom.estimated_fp_rate(),
+            })
+        return stats
+
+
+username_filter = UsernameFilter()
+USERNAME_FILTER_ENTRIES.set_function(lambda: username_filter.stats().get('names', 0))
+USERNAME_FILTER_ESTIMATED_FP_RATE.set_function(lambda: username_filter.stats().get('estimated_fp_rate', 0))
+USERNAME_FILTER_BYTES.set_function(lambda: username_filter.stats().get('memory_bytes', 0))
+USERNAME_FILTER_CHECKS.labels('skipped').set_function(lambda: username_filter.misses)
+USERNAME_FILTER_CHECKS.labels('stale').set_function(lambda: username_filter.stale_misses)
+USERNAME_FILTER_CHECKS.labels('found').set_function(
+    lambda: username_filter.checks - username_filter.misses - username_filter.stale_misses
+)
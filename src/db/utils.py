@@ -1,20 +1,96 @@
 from fastapi import HTTPException
 import logging
+from typing import Callable
+from typing import Optional
 
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from db.base import async_session_local
 from db.base import session_local
+from db.shards import ShardedSession
 
 
 logger = logging.getLogger(__name__)
 
 
+class LazySession:
+    """Stands in for a `Session` which is only created when a query needs it.
+
+    Requests rejected by the validators or the lockout never build a session, let alone check
+    out a connection.
+    """
+
+    def __init__(self, factory: Callable[[], Session] = session_local):
+        self._factory = factory
+        self._session: Optional[Session] = None
+
+    @property
+    def started(self) -> bool:
+        return self._session is not None
+
+    def get(self) -> Session:
+        if self._session is None:
+            self._session = self._factory()
+        return self._session
+
+    def __getattr__(self, name: str):
+        # Only called for the attributes missing from this class, i.e. those of the session
+        return getattr(self.get(), name)
+
+    def rollback(self):
+        if self._session is not None:
+            self._session.rollback()
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+
+class AsyncLazySession(LazySession):
+    def __init__(self, factory: Callable[[], AsyncSession] = async_session_local):
+        super().__init__(factory=factory)
+
+    async def rollback(self):
+        if self._session is not None:
+            await self._session.rollback()
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+def sharded_session(session) -> Optional[ShardedSession]:
+    """The `ShardedSession` behind `session`, None when the database is not sharded."""
+    if isinstance(session, LazySession):
+        session = session.get()
+    return session if isinstance(session, ShardedSession) else None
+
+
 def get_db():
-    database = session_local()
+    database = LazySession(session_local)
     try:
         yield database
     except HTTPException as e:
         raise e
     except Exception as e:
-        logger.exception(str(e))
+        # Roll back and let the error through, so that the client gets a 500 rather than a silent success.
+        logger.exception('Rolling back the session: %s', type(e).__name__)
         database.rollback()
+        raise
     finally:
         database.close()
+
+
+async def get_async_db():
+    database = AsyncLazySession(async_session_local)
+    try:
+        yield database
+    except HTTPException as e:
+        raise e
+    except Exception as e:
+        logger.exception('Rolling back the session: %s', type(e).__name__)
+        await database.rollback()
+        raise
+    finally:
+        await database.close()
@@ -0,0 +1,175 @@
+"""Logging of the app: records are queued by the caller and written as JSON lines by a background thread.
+
+On the request path a log call only checks the level and the rate limit, then puts the record in
+a bounded queue. Its message is formatted from its arguments by the writer thread. Log calls must
+pass their values as arguments (`logger.warning('... %s', name)`), not format them first: a
+formatted message costs the caller even when the level is off, and makes every record a different
+template to the rate limit. The arguments must not be changed after the call.
+"""
+import datetime
+import logging
+from logging.handlers import QueueHandler
+from logging.handlers import QueueListener
+import queue
+import random
+import sys
+import time
+from typing import Callable
+from typing import Optional
+from typing import TextIO
+
+import orjson
+
+from metrics import LOG_RECORDS_DROPPED
+from settings import LOG_LEVEL
+from settings import LOG_QUEUE_SIZE
+from settings import LOG_RATE_LIMIT_BURST
+from settings import LOG_RATE_LIMIT_INTERVAL
+from settings import LOG_SAMPLE_RATE
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        content = {
+            'time': datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(
+                timespec='milliseconds',
+            ),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+        }
+        suppressed = getattr(record, 'suppressed', 0)
+        if suppressed:
+            content['suppressed'] = suppressed
+        if record.exc_info:
+            content['exc_info'] = self.formatException(record.exc_info)
+        return orjson.dumps(content).decode()
+
+
+class RateLimitFilter(logging.Filter):
+    """Lets `burst` records of each message template through per `interval` seconds, then a
+    `sample_rate` share of them. The next record let through carries how many were suppressed
+    meanwhile in its `suppressed` attribute. Records above `max_level` always pass.
+    """
+
+    def __init__(
+        self,
+        burst: int = LOG_RATE_LIMIT_BURST,
+        interval: float = LOG_RATE_LIMIT_INTERVAL,
+        sample_rate: float = LOG_SAMPLE_RATE,
+        max_level: int = logging.WARNING,
+        max_templates: int = 1000,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.sample_rate = sample_rate
+        self.max_level = max_level
+        self.max_templates = max_templates
+        self.clock = clock
+        # (logger, template) -> [window start, records in the window, suppressed since the last one let through]
+        self._windows: dict[tuple[str, str], list] = {}
+        self.suppressed = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > self.max_level:
+            return True
+        key = (record.name, str(record.msg))
+        now = self.clock()
+        # No lock, see LazyQueueHandler: concurrent records may make the counts a little off.
+        window = self._windows.get(key)
+        if window is None and len(self._windows) >= self.max_templates:
+            # Messages formatted before the call are templates of their own, they must not pile up.
+            self._windows.clear()
+        if window is None or now - window[0] >= self.interval:
+            window = self._windows[key] = [now, 0, window[2] if window is not None else 0]
+        window[1] += 1
+        if window[1] > self.burst and random.random() >= self.sample_rate:
+            window[2] += 1
+            self.suppressed += 1
+            LOG_RECORDS_DROPPED.labels('rate_limited').inc()
+            return False
+        suppressed, window[2] = window[2], 0
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class LazyQueueHandler(QueueHandler):
+    """Queues the records as they are, without blocking: they are dropped while `max_size` wait.
+
+    Neither the handler nor its `queue.SimpleQueue` take a lock: a thread preempted while holding
+    one would make the others wait for the next switch of the GIL.
+    """
+
+    def __init__(self, records: queue.SimpleQueue, max_size: int = LOG_QUEUE_SIZE):
+        super().__init__(records)
+        self.max_size = max_size
+
+    def handle(self, record: logging.LogRecord) -> bool:
+        if not self.filter(record):
+            return False
+        self.emit(record)
+        return True
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock handler formats the message here, on the caller's thread. The queue stays in
+        # this process, the record needs no pickling.
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.queue.qsize() >= self.max_size:
+            LOG_RECORDS_DROPPED.labels('queue_full').inc()
+            return
+        self.queue.put_nowait(record)
+
+
+class LogPipeline:
+    """Routes the records of the root logger through the queue to `stream` while started."""
+
+    def __init__(
+        self,
+        level: str = LOG_LEVEL,
+        queue_size: int = LOG_QUEUE_SIZE,
+        stream: Optional[TextIO] = None,
+        rate_limit: Optional[logging.Filter] = None,
+    ):
+        self.level = level
+        self.queue_size = queue_size
+        self.stream = stream
+        self.rate_limit = rate_limit if rate_limit is not None else RateLimitFilter()
+        self._handler: Optional[LazyQueueHandler] = None
+        self._listener: Optional[QueueListener] = None
+        self._root_level = logging.WARNING
+
+    def start(self):
+        """Start the writer thread, in the process which serves: it does not survive a fork."""
+        if self._listener is not None:
+            return
+        output = logging.StreamHandler(self.stream if self.stream is not None else sys.stderr)
+        output.setFormatter(JsonFormatter())
+        records = queue.SimpleQueue()
+        self._handler = LazyQueueHandler(records, self.queue_size)
+        self._handler.addFilter(self.rate_limit)
+        self._listener = QueueListener(records, output, respect_handler_level=True)
+        self._listener.start()
+        root = logging.getLogger()
+        self._root_level = root.level
+        root.addHandler(self._handler)
+        root.setLevel(self.level)
+
+    def stop(self):
+        """Write the records still queued and stop the writer thread."""
+        if self._listener is None:
+            return
+        root = logging.getLogger()
+        root.removeHandler(self._handler)
+        root.setLevel(self._root_level)
+        self._listener.stop()
+        self._handler = None
+        self._listener = None
+
+
+log_pipeline = LogPipeline()
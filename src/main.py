@@ -1,33 +1,107 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
+from fastapi.exceptions import RequestValidationError
+from fastapi.concurrency import run_in_threadpool
 import logging
-import pathlib
-import os
-import subprocess
+import time
 
+from admission import AdmissionMiddleware
+from app.audit import audit_log
+from db.base import session_local
+from db.migration import migrate_db_shards
+from db.user import rebuild_username_filter
+from db.user import refresh_username_filter
+from db.username_filter import username_filter
+from logs import log_pipeline
+from metrics import MetricsMiddleware
+from metrics import SnapshotWriter
+from profiling import ProfilingMiddleware
+from routers.metrics import router as metrics_router
+from routers.profiling import router as profiling_router
 from routers.user import router as users_router
+from routers.user import validation_exception_handler
+from settings import ADMISSION_ENABLED
+from settings import LOGGING_ENABLED
+from settings import METRICS_ENABLED
+from settings import MIGRATE_ON_STARTUP
+from settings import PROFILING_ENABLED
+from settings import USERNAME_FILTER_REBUILD_INTERVAL
+from settings import USERNAME_FILTER_REFRESH_INTERVAL
 
 
-ROOT_PATH = pathlib.Path(os.getcwd())
-ALEMBIC_PATH = ROOT_PATH.joinpath('db')
+def _sync_username_filter(rebuild: bool):
+    with session_local() as session:
+        if rebuild:
+            rebuild_username_filter(session)
+        else:
+            refresh_username_filter(session)
 
 
-def migrate_db_schema():
-    """Alpha database migration."""
-    try:
-        subprocess.run(
-            args=['python3', '-m', 'alembic', 'upgrade', 'head'],
-            cwd=ALEMBIC_PATH,
-        )
-    except subprocess.CalledProcessError as e:
-        logging.warning('Please drop all tables when the first time of this error occurs.')
-        raise e
+async def maintain_username_filter():
+    """Keep the username filter in sync with the users created by other workers."""
+    rebuilt_at = time.monotonic()
+    while True:
+        await asyncio.sleep(USERNAME_FILTER_REFRESH_INTERVAL)
+        rebuild = time.monotonic() - rebuilt_at >= USERNAME_FILTER_REBUILD_INTERVAL
+        try:
+            await run_in_threadpool(_sync_username_filter, rebuild)
+        except Exception as e:
+            logging.exception('Failed to refresh the username filter: %s', e)
+            continue
+        if rebuild:
+            rebuilt_at = time.monotonic()
 
 
-migrate_db_schema()
-app = FastAPI()
+def warm_up():
+    """Start-up work shared by the workers: migrate the database and build the username filter."""
+    if MIGRATE_ON_STARTUP:
+        migrate_db_shards()
+    if username_filter.enabled:
+        _sync_username_filter(True)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if LOGGING_ENABLED:
+        log_pipeline.start()
+    tasks = []
+    snapshot_writer = SnapshotWriter()
+    if METRICS_ENABLED:
+        snapshot_writer.start()
+    # The prefork server in server.py warmed up once before forking this worker, which only needs
+    # the users created since then.
+    if not getattr(app.state, 'preloaded', False):
+        await run_in_threadpool(warm_up)
+    elif username_filter.enabled:
+        await run_in_threadpool(_sync_username_filter, False)
+    if username_filter.enabled:
+        tasks.append(asyncio.create_task(maintain_username_filter()))
+    audit_log.start()
+    yield
+    for task in tasks:
+        task.cancel()
+    # Writes the events still in the buffer
+    await run_in_threadpool(audit_log.stop)
+    snapshot_writer.stop()
+    log_pipeline.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+# Usernames and passwords breaking the rules of `UserCreate` get the 400 of the other rejections
+app.add_exception_handler(RequestValidationError, validation_exception_handler)
 
 # Add routers
 app.include_router(users_router)
+# Added first to run inside the other middlewares, which also see the requests it turns away
+if ADMISSION_ENABLED:
+    app.add_middleware(AdmissionMiddleware)
+if METRICS_ENABLED:
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(metrics_router)
+if PROFILING_ENABLED:
+    app.add_middleware(ProfilingMiddleware)
+    app.include_router(profiling_router)
 
 
 @app.get("/")
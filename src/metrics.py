@@ -0,0 +1,451 @@
+"""Prometheus metrics of the service.
+
+Values are written to per-thread cells without locking and only summed when scraped. When
+METRICS_DIR is set, every worker also dumps its values there so that a scrape of any worker
+reports the whole host.
+"""
+from abc import ABC
+from abc import abstractmethod
+from bisect import bisect_left
+import functools
+import glob
+import inspect
+import logging
+import os
+import threading
+import time
+from typing import Callable
+from typing import Optional
+
+import orjson
+
+from settings import METRICS_DIR
+from settings import METRICS_ENABLED
+from settings import METRICS_FLUSH_INTERVAL
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class _Cells:
+    """Value arrays owned by one thread each, summed when collected."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._local = threading.local()
+        self._all: list[list[float]] = []
+
+    def local(self) -> list[float]:
+        try:
+            return self._local.cells
+        except AttributeError:
+            cells = [0.0] * self.size
+            self._local.cells = cells
+            self._all.append(cells)
+            return cells
+
+    def total(self) -> list[float]:
+        totals = [0.0] * self.size
+        for cells in list(self._all):
+            for i, value in enumerate(cells):
+                totals[i] += value
+        return totals
+
+    def reset(self):
+        for cells in list(self._all):
+            cells[:] = [0.0] * self.size
+
+
+class _CounterChild:
+    def __init__(self):
+        self._cells = _Cells(1)
+        self._function: Optional[Callable[[], float]] = None
+
+    def inc(self, amount: float = 1.0):
+        self._cells.local()[0] += amount
+
+    def set_function(self, function: Callable[[], float]):
+        """Read the value from `function` when scraped, e.g. a total some other object keeps."""
+        self._function = function
+
+    def collect(self) -> list[float]:
+        if self._function is not None:
+            return [float(self._function())]
+        return self._cells.total()
+
+
+class _GaugeChild(_CounterChild):
+    def dec(self, amount: float = 1.0):
+        self._cells.local()[0] -= amount
+
+
+class _HistogramChild:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        # One cell per bucket and +Inf, then the sum and the count
+        self._cells = _Cells(len(buckets) + 3)
+
+    def observe(self, value: float):
+        cells = self._cells.local()
+        cells[bisect_left(self.buckets, value)] += 1
+        cells[-2] += value
+        cells[-1] += 1
+
+    def time(self) -> '_Timer':
+        return _Timer(self)
+
+    def collect(self) -> list[float]:
+        return self._cells.total()
+
+
+class _Timer:
+    def __init__(self, histogram: _HistogramChild):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started)
+
+
+class Metric(ABC):
+    type = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = (), multiprocess_mode: str = 'sum'):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        # How the values of several workers add up: `sum`, or `max` for values they share
+        self.multiprocess_mode = multiprocess_mode
+        self._children: dict[tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    @abstractmethod
+    def _new_child(self):
+        """Return the value holder of one set of label values."""
+
+    def labels(self, *values: str):
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def collect(self) -> dict[tuple[str, ...], list[float]]:
+        return {key: child.collect() for key, child in list(self._children.items())}
+
+    def reset(self):
+        for child in list(self._children.values()):
+            child._cells.reset()
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self.labels().set_function(function)
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self.labels().dec(amount)
+
+    def set_function(self, function: Callable[[], float]):
+        self.labels().set_function(function)
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, *args, buckets: tuple[float, ...] = DEFAULT_BUCKETS, **kwargs):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(*args, **kwargs)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def time(self) -> _Timer:
+        return self.labels().time()
+
+
+REGISTRY: list[Metric] = []
+
+
+def _reset_registry():
+    # A forked worker starts from zero. Values of its parent, e.g. timers of the warm-up of server.py,
+    # would otherwise be reported by every worker once their snapshots are merged.
+    for metric in REGISTRY:
+        metric.reset()
+
+
+os.register_at_fork(after_in_child=_reset_registry)
+
+
+def timed(histogram: _HistogramChild):
+    """Decorate a function or coroutine function to observe its duration, a no-op when metrics are off."""
+    def decorator(function):
+        if not METRICS_ENABLED:
+            return function
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await function(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - started)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - started)
+        return wrapper
+    return decorator
+
+
+def _snapshot() -> dict:
+    return {metric.name: metric.collect() for metric in REGISTRY}
+
+
+def write_snapshot(directory: str = METRICS_DIR):
+    path = os.path.join(directory, 'metrics-%d.json' % os.getpid())
+    snapshot = {name: [[list(key), values] for key, values in samples.items()] for name, samples in _snapshot().items()}
+    with open(path + '.tmp', 'wb') as file:
+        file.write(orjson.dumps(snapshot))
+    os.replace(path + '.tmp', path)
+
+
+def _read_snapshot(path: str) -> Optional[dict]:
+    try:
+        with open(path, 'rb') as file:
+            snapshot = orjson.loads(file.read())
+    except (OSError, orjson.JSONDecodeError):
+        return None
+    return {name: {tuple(key): values for key, values in samples} for name, samples in snapshot.items()}
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _merge(target: dict, snapshot: dict, alive: bool):
+    for metric in REGISTRY:
+        if metric.name not in snapshot:
+            continue
+        if metric.type == 'gauge' and not alive:
+            continue
+        merged = target.setdefault(metric.name, {})
+        for key, values in snapshot[metric.name].items():
+            current = merged.get(key)
+            if current is None:
+                merged[key] = list(values)
+            elif metric.multiprocess_mode == 'max':
+                merged[key] = [max(a, b) for a, b in zip(current, values)]
+            else:
+                merged[key] = [a + b for a, b in zip(current, values)]
+
+
+def _collect_all() -> dict:
+    snapshot = _snapshot()
+    if not METRICS_DIR:
+        return snapshot
+    merged = {}
+    _merge(merged, snapshot, alive=True)
+    own_path = os.path.join(METRICS_DIR, 'metrics-%d.json' % os.getpid())
+    for path in glob.glob(os.path.join(METRICS_DIR, 'metrics-*.json')):
+        if path == own_path:
+            continue
+        other = _read_snapshot(path)
+        if other is None:
+            continue
+        pid = int(os.path.basename(path)[len('metrics-'):-len('.json')])
+        _merge(merged, other, alive=_pid_alive(pid))
+    return merged
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...], extra: str = '') -> str:
+    pairs = ['%s="%s"' % (name, value.replace('\\', '\\\\').replace('"', '\\"')) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    collected = _collect_all()
+    lines = []
+    for metric in REGISTRY:
+        lines.append('# HELP %s %s' % (metric.name, metric.documentation))
+        lines.append('# TYPE %s %s' % (metric.name, metric.type))
+        for key, values in sorted(collected.get(metric.name, {}).items()):
+            if metric.type != 'histogram':
+                lines.append('%s%s %r' % (metric.name, _format_labels(metric.labelnames, key), values[0]))
+                continue
+            cumulative = 0.0
+            for bound, count in zip(metric.buckets + (float('inf'),), values):
+                cumulative += count
+                le = 'le="%s"' % ('+Inf' if bound == float('inf') else repr(bound))
+                lines.append('%s_bucket%s %r' % (metric.name, _format_labels(metric.labelnames, key, le), cumulative))
+            labels = _format_labels(metric.labelnames, key)
+            lines.append('%s_sum%s %r' % (metric.name, labels, values[-2]))
+            lines.append('%s_count%s %r' % (metric.name, labels, values[-1]))
+    return '\n'.join(lines) + '\n'
+
+
+class SnapshotWriter:
+    """Background thread dumping the values of this worker into METRICS_DIR."""
+
+    def __init__(self, interval: float = METRICS_FLUSH_INTERVAL):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                write_snapshot()
+            except OSError as e:
+                logger.warning('Failed to write the metrics snapshot: %s', e)
+
+    def start(self):
+        if not METRICS_DIR or self._thread is not None:
+            return
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name='metrics-writer', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        write_snapshot()
+
+
+HTTP_REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Latency of the HTTP requests.', ('method', 'route', 'status'),
+)
+HTTP_REQUESTS_IN_FLIGHT = Gauge('http_requests_in_flight', 'HTTP requests being handled.')
+PASSWORD_HASH_DURATION = Histogram(
+    'password_hash_duration_seconds', 'Password hashing, including the wait for a pool worker.', ('operation',),
+)
+DB_QUERY_DURATION = Histogram('db_query_duration_seconds', 'Calls of the database functions.', ('function',))
+VALIDATION_DURATION = Histogram(
+    'validation_duration_seconds', 'Username and password validation.', ('validator',),
+    buckets=(0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001),
+)
+
+LOCKOUT_CHECK_DURATION = Histogram(
+    'lockout_check_duration_seconds', 'Lookups of the failed login attempts of a user.',
+    buckets=(0.000005, 0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.005),
+)
+LOCKOUT_ENTRIES = Gauge('lockout_entries', 'Users with failed login attempts in the lockout store.', multiprocess_mode='sum')
+CREDENTIAL_CACHE_ENTRIES = Gauge('credential_cache_entries', 'Entries in the user credential cache.')
+CREDENTIAL_CACHE_EVENTS = Counter(
+    'credential_cache_events_total', 'Lookups of the user credential cache by result, and entries it dropped.',
+    ('event',),
+)
+USERNAME_FILTER_ENTRIES = Gauge('username_filter_entries', 'Usernames added to the username filter.')
+USERNAME_FILTER_ESTIMATED_FP_RATE = Gauge(
+    'username_filter_estimated_fp_rate', 'False positive rate of the username filter, estimated from its fill.',
+    multiprocess_mode='max',
+)
+USERNAME_FILTER_BYTES = Gauge('username_filter_bytes', 'Memory of the bit array of the username filter.')
+USERNAME_FILTER_CHECKS = Counter(
+    'username_filter_checks_total',
+    'Lookups of the username filter: `skipped` the database, `stale` misses which could not, `found` names.',
+    ('result',),
+)
+SINGLE_FLIGHT_CALLS = Counter(
+    'single_flight_calls_total', 'Coalesced calls, the followers got the result of the leader in flight.',
+    ('operation', 'role'),
+)
+ADMISSION_REQUESTS = Counter(
+    'admission_requests_total', 'Requests to the user routes by admission outcome.', ('priority', 'outcome'),
+)
+ADMISSION_LIMIT = Gauge('admission_limit', 'Adaptive concurrency limit of a priority class.', ('priority',))
+LOG_RECORDS_DROPPED = Counter(
+    'log_records_dropped_total', 'Log records not written, suppressed by the rate limit or the queue was full.',
+    ('reason',),
+)
+AUDIT_EVENTS = Counter('audit_events_total', 'Audit events by what became of them.', ('outcome',))
+AUDIT_BUFFER_EVENTS = Gauge('audit_buffer_events', 'Audit events waiting to be written.')
+DB_POOL_CONNECTIONS = Gauge(
+    'db_pool_connections', 'Connections of the database pools.', ('engine', 'state'), multiprocess_mode='sum',
+)
+DB_POOL_CHECKOUTS = Counter(
+    'db_pool_checkouts_total', 'Connection checkouts of the database pools, and those which timed out.',
+    ('engine', 'outcome'),
+)
+DB_POOL_WAIT_SECONDS = Counter(
+    'db_pool_wait_seconds_total', 'Time spent waiting for a connection of the database pools.', ('engine',),
+)
+DB_POOL_WAIT_SECONDS_MAX = Gauge(
+    'db_pool_wait_seconds_max', 'Longest wait for a connection of the database pools.', ('engine',),
+    multiprocess_mode='max',
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording the latency of every HTTP request per route and status code."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        in_flight = HTTP_REQUESTS_IN_FLIGHT.labels()
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            route = scope.get('route')
+            HTTP_REQUEST_DURATION.labels(
+                scope['method'], route.path if route is not None else 'unmatched', status_code,
+            ).observe(time.perf_counter() - started)
@@ -1,26 +1,169 @@
+from enum import Enum
+from typing import Annotated
+from typing import Optional
+
+import orjson
+from pydantic import AfterValidator
 from pydantic import BaseModel
+from pydantic import Field
+from pydantic import StringConstraints
+from pydantic_core import PydanticCustomError
+
+from settings import PASSWORD_MAX_LENGTH
+from settings import PASSWORD_MIN_LENGTH
+from settings import USERNAME_MAX_LENGTH
+from settings import USERNAME_MIN_LENGTH
 
 
 class User(BaseModel):
     username: str
 
 
-class UserCreate(BaseModel):
+class UserVerify(BaseModel):
     username: str
     password: str
 
 
-class UserVerify(BaseModel):
+class UserIdentity(BaseModel):
+    id: int
+    username: str
+    expires_at: int
+
+
+class UserSummary(BaseModel):
+    id: int
+    username: str
+
+
+class UserPage(BaseModel):
+    users: list[UserSummary]
+    next_cursor: Optional[str]
+
+
+class ErrorCode(str, Enum):
+    OK = 'ok'
+    USERNAME_LENGTH = 'username_length'
+    PASSWORD_LENGTH = 'password_length'
+    PASSWORD_LOWERCASE_MISSING = 'password_lowercase_missing'
+    PASSWORD_UPPERCASE_MISSING = 'password_uppercase_missing'
+    PASSWORD_DIGIT_MISSING = 'password_digit_missing'
+    PASSWORD_BLOCKLISTED = 'password_blocklisted'
+    USERNAME_DUPLICATED = 'username_duplicated'
+    USER_NOT_FOUND = 'user_not_found'
+    PASSWORD_INCORRECT = 'password_incorrect'
+    USER_LOCKED = 'user_locked'
+    USER_LOCKED_OUT = 'user_locked_out'
+    TOKEN_INVALID = 'token_invalid'
+    SERVER_OVERLOADED = 'server_overloaded'
+
+
+USERNAME_TOO_SHORT = 'The length of the user name is too short, should be at least %s characters.' % USERNAME_MIN_LENGTH
+USERNAME_TOO_LONG = 'The length of the user name is too long, should be at most %s characters.' % USERNAME_MAX_LENGTH
+PASSWORD_TOO_SHORT = 'The length of the password is too short, should be at least %s characters.' % PASSWORD_MIN_LENGTH
+PASSWORD_TOO_LONG = 'The length of the password is too long, should be at most %s characters.' % PASSWORD_MAX_LENGTH
+PASSWORD_CLASS_REASONS = {
+    ErrorCode.PASSWORD_LOWERCASE_MISSING: 'The lowercase is missing, should be at least one.',
+    ErrorCode.PASSWORD_UPPERCASE_MISSING: 'The uppercase is missing, should be at least one.',
+    ErrorCode.PASSWORD_DIGIT_MISSING: 'The number is missing, should be at least one.',
+}
+# Errors of the constraints below, by field and pydantic error type
+CONSTRAINT_REASONS = {
+    ('username', 'string_too_short'): (ErrorCode.USERNAME_LENGTH, USERNAME_TOO_SHORT),
+    ('username', 'string_too_long'): (ErrorCode.USERNAME_LENGTH, USERNAME_TOO_LONG),
+    ('password', 'string_too_short'): (ErrorCode.PASSWORD_LENGTH, PASSWORD_TOO_SHORT),
+    ('password', 'string_too_long'): (ErrorCode.PASSWORD_LENGTH, PASSWORD_TOO_LONG),
+}
+
+
+def missing_password_class(password: str) -> Optional[ErrorCode]:
+    """The first of lowercase, uppercase and digit `password` has none of, in one walk."""
+    lower = upper = digit = False
+    for c in password:
+        if c.islower():
+            lower = True
+        elif c.isupper():
+            upper = True
+        elif c.isdigit():
+            digit = True
+        else:
+            continue
+        if lower and upper and digit:
+            return None
+    if not lower:
+        return ErrorCode.PASSWORD_LOWERCASE_MISSING
+    if not upper:
+        return ErrorCode.PASSWORD_UPPERCASE_MISSING
+    return ErrorCode.PASSWORD_DIGIT_MISSING
+
+
+def _check_password_classes(password: str) -> str:
+    code = missing_password_class(password)
+    if code is not None:
+        # The error type is the code and its message the reason, see `constraint_violation`
+        raise PydanticCustomError(code.value, PASSWORD_CLASS_REASONS[code])
+    return password
+
+
+# The lengths are checked by pydantic-core before any Python runs
+Username = Annotated[str, StringConstraints(min_length=USERNAME_MIN_LENGTH, max_length=USERNAME_MAX_LENGTH)]
+Password = Annotated[
+    str,
+    StringConstraints(min_length=PASSWORD_MIN_LENGTH, max_length=PASSWORD_MAX_LENGTH),
+    AfterValidator(_check_password_classes),
+]
+
+
+class UserCreate(BaseModel):
+    """A new user, which meets the username and password rules of the settings but the blocklist."""
+    username: Username
+    password: Password
+
+
+class UserCreateItem(BaseModel):
+    """A user of a bulk creation, checked by `validate_user` so that an invalid one does not fail the others."""
     username: str
     password: str
 
 
+def constraint_violation(error: dict) -> Optional[tuple[ErrorCode, str]]:
+    """The code and reason of a validation error of the `UserCreate` rules, None for other errors."""
+    field = error['loc'][-1] if error['loc'] else None
+    if field == 'password' and error['type'] in PASSWORD_CLASS_REASONS:
+        return ErrorCode(error['type']), error['msg']
+    return CONSTRAINT_REASONS.get((field, error['type']))
+
+
+# The reasons of these codes embed the username, the others come from a fixed set of messages.
+USER_SPECIFIC_CODES = frozenset({ErrorCode.USERNAME_DUPLICATED, ErrorCode.USER_NOT_FOUND})
+_encoded_messages: dict[tuple[bool, str], bytes] = {}
+
+
 class UserActionMessage(BaseModel):
     success: bool
     reason: str
+    # Signed token of a successful verification, omitted from the body otherwise
+    token: Optional[str] = None
+    # Not part of the response body, the routers map it to the status code
+    code: ErrorCode = Field(ErrorCode.OK, exclude=True)
 
     def as_dict(self) -> dict:
-        return {
+        content = {
             'success': self.success,
             'reason': self.reason,
         }
+        if self.token is not None:
+            content['token'] = self.token
+        return content
+
+    def as_json(self) -> bytes:
+        """The response body, the same bytes `JSONResponse` renders from `as_dict()`.
+
+        Fixed messages are encoded once and served from a cache.
+        """
+        if self.token is not None or self.code in USER_SPECIFIC_CODES:
+            return orjson.dumps(self.as_dict())
+        key = (self.success, self.reason)
+        encoded = _encoded_messages.get(key)
+        if encoded is None:
+            encoded = _encoded_messages[key] = orjson.dumps(self.as_dict())
+        return encoded
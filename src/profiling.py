@@ -0,0 +1,206 @@
+"""On-demand profiling of single requests.
+
+`ProfilingMiddleware` marks the requests to profile, either those sent with PROFILING_HEADER or
+a sampled share of all of them. Handlers decorated with `profiled` then run under cProfile in the
+thread executing them, and the profile is saved to a bounded ring of files in PROFILING_DIR.
+With PROFILING_ENABLED off the decorator returns the handler itself and nothing is installed.
+
+Work a profiled request hands to other threads, e.g. password hashing in the pool of
+`app.hashing`, is profiled there through `profile_offloaded` and merged into its profile. The
+hashing of PASSWORD_HASH_EXECUTOR=process runs in other processes and is left out, the
+profile only shows the wait for it.
+"""
+import cProfile
+from contextvars import ContextVar
+import functools
+import hmac
+import inspect
+import logging
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from typing import Callable
+from typing import Optional
+from typing import Union
+
+from fastapi.concurrency import run_in_threadpool
+
+from settings import PROFILING_DIR
+from settings import PROFILING_ENABLED
+from settings import PROFILING_HEADER
+from settings import PROFILING_MAX_FILES
+from settings import PROFILING_SAMPLE_RATE
+from settings import PROFILING_TOKEN
+
+
+logger = logging.getLogger(__name__)
+
+# Profiles expose internal paths and timings, and each one costs the request it is taken of
+if PROFILING_ENABLED and not PROFILING_TOKEN:
+    raise ValueError('PROFILING_TOKEN must be set when PROFILING_ENABLED is on.')
+
+PROFILE_NAME_PATTERN = re.compile(r'\d+-\d+-[\w.-]+\.prof')
+
+# Label of the profile to take for the current request, None when it is not profiled
+profile_label: ContextVar[Optional[str]] = ContextVar('profile_label', default=None)
+# Profiles of the work the profiled request ran in other threads, None when it is not profiled
+_offloaded: ContextVar[Optional[list[cProfile.Profile]]] = ContextVar('profile_offloaded', default=None)
+
+
+class ProfileStore:
+    """Directory of profiles which keeps the last `max_files` of them."""
+
+    def __init__(self, directory: str = PROFILING_DIR, max_files: int = PROFILING_MAX_FILES):
+        self.directory = directory
+        self.max_files = max_files
+        self._lock = threading.Lock()
+
+    def save(self, profile: Union[cProfile.Profile, pstats.Stats], label: str) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        slug = re.sub(r'[^\w.-]+', '_', label).strip('_')[:80] or 'request'
+        name = '%d-%d-%s.prof' % (time.time_ns(), os.getpid(), slug)
+        path = os.path.join(self.directory, name)
+        profile.dump_stats(path + '.tmp')
+        os.replace(path + '.tmp', path)
+        with self._lock:
+            for stale in self.names()[self.max_files:]:
+                try:
+                    os.remove(os.path.join(self.directory, stale))
+                except FileNotFoundError:
+                    pass
+        return name
+
+    def names(self) -> list[str]:
+        """Names of the stored profiles, newest first."""
+        try:
+            names = [name for name in os.listdir(self.directory) if PROFILE_NAME_PATTERN.fullmatch(name)]
+        except FileNotFoundError:
+            return []
+        return sorted(names, key=lambda name: int(name.split('-', 1)[0]), reverse=True)
+
+    def path(self, name: str) -> Optional[str]:
+        if not PROFILE_NAME_PATTERN.fullmatch(name):
+            return None
+        path = os.path.join(self.directory, name)
+        return path if os.path.isfile(path) else None
+
+
+profile_store = ProfileStore()
+# cProfile hooks a thread with one profiler at a time, a nested request in the same thread is not profiled.
+_active = threading.local()
+
+
+def _start_profile() -> Optional[cProfile.Profile]:
+    if profile_label.get() is None or getattr(_active, 'profiling', False):
+        return None
+    _active.profiling = True
+    profile = cProfile.Profile()
+    profile.offloaded = []
+    profile.offloaded_token = _offloaded.set(profile.offloaded)
+    profile.enable()
+    return profile
+
+
+def _stop_profile(profile: cProfile.Profile):
+    profile.disable()
+    _offloaded.reset(profile.offloaded_token)
+    _active.profiling = False
+
+
+def _save_profile(profile: cProfile.Profile):
+    stats = profile
+    if profile.offloaded:
+        stats = pstats.Stats(profile)
+        for other in profile.offloaded:
+            stats.add(other)
+    try:
+        profile_store.save(stats, profile_label.get())
+    except OSError as e:
+        logger.warning('Failed to save the profile: %s', e)
+
+
+def profile_offloaded(function: Callable) -> Callable:
+    """Wrap `function`, about to run in another thread, to profile it into the current request's profile.
+
+    Returns `function` itself when the request is not profiled.
+    """
+    profiles = _offloaded.get()
+    if profiles is None:
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            profile.disable()
+            profiles.append(profile)
+    return wrapper
+
+
+def profiled(function):
+    """Profile the handler when the middleware selected the request.
+
+    The profile of an async handler covers its own coroutine as well as whatever else the event
+    loop ran until it returned, run with DATABASE_ASYNC_MODE=0 to profile requests in isolation.
+    """
+    if not PROFILING_ENABLED:
+        return function
+    if inspect.iscoroutinefunction(function):
+        @functools.wraps(function)
+        async def async_wrapper(*args, **kwargs):
+            profile = _start_profile()
+            if profile is None:
+                return await function(*args, **kwargs)
+            try:
+                return await function(*args, **kwargs)
+            finally:
+                _stop_profile(profile)
+                await run_in_threadpool(_save_profile, profile)
+        return async_wrapper
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        profile = _start_profile()
+        if profile is None:
+            return function(*args, **kwargs)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            _stop_profile(profile)
+            _save_profile(profile)
+    return wrapper
+
+
+class ProfilingMiddleware:
+    """ASGI middleware selecting the requests to profile."""
+
+    def __init__(self, app, header: str = PROFILING_HEADER, token: str = PROFILING_TOKEN,
+                 sample_rate: float = PROFILING_SAMPLE_RATE):
+        if not token:
+            raise ValueError('The profiling middleware needs a token.')
+        self.app = app
+        self.header = header.lower().encode('latin-1')
+        self.token = token.encode('latin-1')
+        self.sample_rate = sample_rate
+
+    def _selected(self, scope) -> bool:
+        for name, value in scope['headers']:
+            if name == self.header:
+                return hmac.compare_digest(value, self.token)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not self._selected(scope):
+            await self.app(scope, receive, send)
+            return
+        token = profile_label.set('%s %s' % (scope['method'], scope['path']))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            profile_label.reset(token)
@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+import metrics
+
+
+router = APIRouter()
+
+
+@router.get('/metrics', response_class=PlainTextResponse, include_in_schema=False)
+def read_metrics():
+    """Metrics of the service in the Prometheus text format."""
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,60 @@
+import hmac
+import io
+import os
+import pstats
+from typing import Optional
+
+from fastapi import APIRouter
+from fastapi import Header
+from fastapi import HTTPException
+from fastapi import Query
+from fastapi.params import Depends
+from fastapi.responses import FileResponse
+from fastapi.responses import PlainTextResponse
+
+from profiling import profile_store
+from settings import PROFILING_HEADER
+from settings import PROFILING_MAX_FILES
+from settings import PROFILING_TOKEN
+
+
+def check_profiling_token(token: Optional[str] = Header(None, alias=PROFILING_HEADER)):
+    # Anyone allowed to trigger profiles may read them
+    expected = PROFILING_TOKEN.encode('latin-1')
+    if not expected or not hmac.compare_digest((token or '').encode('latin-1'), expected):
+        raise HTTPException(status_code=403, detail='A valid %s header is required.' % PROFILING_HEADER)
+
+
+router = APIRouter(prefix='/profiles', dependencies=[Depends(check_profiling_token)], include_in_schema=False)
+
+
+@router.get('/')
+def list_profiles(limit: int = Query(20, ge=1, le=PROFILING_MAX_FILES)) -> list[dict]:
+    """List the last `limit` request profiles, newest first."""
+    profiles = []
+    for name in profile_store.names()[:limit]:
+        path = profile_store.path(name)
+        if path is None:
+            continue
+        timestamp, pid, label = name[:-len('.prof')].split('-', 2)
+        profiles.append({
+            'name': name,
+            'created_at': int(timestamp) / 1e9,
+            'pid': int(pid),
+            'request': label,
+            'size': os.path.getsize(path),
+        })
+    return profiles
+
+
+@router.get('/{name}')
+def read_profile(name: str, format: str = Query('prof', pattern='^(prof|text)$'), lines: int = 40):
+    """Download a profile in the pstats format, or as text sorted by cumulative time."""
+    path = profile_store.path(name)
+    if path is None:
+        raise HTTPException(status_code=404, detail='The profile: %s does not exist!' % name)
+    if format == 'prof':
+        return FileResponse(path, media_type='application/octet-stream', filename=name)
+    output = io.StringIO()
+    pstats.Stats(path, stream=output).sort_stats('cumulative').print_stats(lines)
+    return PlainTextResponse(output.getvalue())
@@ -1,20 +1,102 @@
+import hmac
+import logging
+from typing import Annotated
+from typing import Literal
+from typing import Optional
+
 from fastapi import APIRouter
+from fastapi import Body
+from fastapi import Header
+from fastapi import HTTPException
+from fastapi import Query
+from fastapi import Request
+from fastapi.exception_handlers import request_validation_exception_handler
+from fastapi.exceptions import RequestValidationError
 from fastapi.params import Depends
-from fastapi.responses import JSONResponse
+from fastapi.responses import Response
+from fastapi.responses import StreamingResponse
+import orjson
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
 from app import user as user_app
+from app.audit import audit_log
+from app.audit import AUDIT_CREATE
+from app.tokens import token_signer
+from db.base import async_session_local
+from db.base import session_local
+from db.utils import get_async_db
 from db.utils import get_db
+from models.user import constraint_violation
+from models.user import ErrorCode
 from models.user import UserActionMessage
 from models.user import UserCreate
+from models.user import UserCreateItem
+from models.user import UserIdentity
+from models.user import UserPage
 from models.user import UserVerify
+from profiling import profiled
+from settings import ADMIN_TOKEN
+from settings import BULK_CREATE_MAX_USERS
+from settings import DATABASE_ASYNC_MODE
+from settings import USER_LIST_MAX_LIMIT
+from settings import USERNAME_MAX_LENGTH
+
 
+logger = logging.getLogger(__name__)
 
 router = APIRouter(prefix='/users', )
 
 
-@router.post('/create_user/', response_model=UserActionMessage)
-def create_user(user: UserCreate, session: Session = Depends(get_db)) -> JSONResponse:
+STATUS_CODES = {
+    ErrorCode.USERNAME_LENGTH: 400,
+    ErrorCode.PASSWORD_LENGTH: 400,
+    ErrorCode.PASSWORD_LOWERCASE_MISSING: 400,
+    ErrorCode.PASSWORD_UPPERCASE_MISSING: 400,
+    ErrorCode.PASSWORD_DIGIT_MISSING: 400,
+    ErrorCode.PASSWORD_BLOCKLISTED: 400,
+    ErrorCode.USERNAME_DUPLICATED: 409,
+    ErrorCode.USER_NOT_FOUND: 404,
+    ErrorCode.PASSWORD_INCORRECT: 401,
+    ErrorCode.USER_LOCKED: 429,
+    ErrorCode.USER_LOCKED_OUT: 429,
+    ErrorCode.TOKEN_INVALID: 401,
+    ErrorCode.SERVER_OVERLOADED: 503,
+}
+INVALID_TOKEN_MESSAGE = UserActionMessage(
+    success=False, reason='The token is invalid or expired!', code=ErrorCode.TOKEN_INVALID,
+)
+
+
+def _message_response(result: UserActionMessage, success_status_code: int) -> Response:
+    status_code = success_status_code if result.code is ErrorCode.OK else STATUS_CODES[result.code]
+    return Response(content=result.as_json(), status_code=status_code, media_type='application/json')
+
+
+def _messages_response(results: list[UserActionMessage]) -> Response:
+    content = b'[' + b','.join(result.as_json() for result in results) + b']'
+    return Response(content=content, status_code=200, media_type='application/json')
+
+
+async def validation_exception_handler(request: Request, exc: RequestValidationError) -> Response:
+    """Give a `UserCreate` breaking a username or password rule the 400 and reason of `validate_user`.
+
+    Other malformed requests keep the stock 422.
+    """
+    errors = exc.errors()
+    violation = constraint_violation(errors[0]) if errors else None
+    if violation is None:
+        return await request_validation_exception_handler(request, exc)
+    code, reason = violation
+    body = exc.body if isinstance(exc.body, dict) else {}
+    username = body.get('username') if isinstance(body.get('username'), str) else ''
+    logger.warning('Rejected the new user %s: %s', username, reason)
+    audit_log.record(AUDIT_CREATE, username, False, code.value)
+    return _message_response(UserActionMessage(success=False, reason=reason, code=code), 400)
+
+
+@profiled
+def create_user(user: UserCreate, session: Session = Depends(get_db)) -> Response:
     """Create a new user.
 
     Endpoint: /users/create_user
@@ -25,22 +107,39 @@ def create_user(user: UserCreate, session: Session = Depends(get_db)) -> JSONRes
 
     Response:
         201: Successfully created
-        400: Bad request
+        400: The username or password breaks a rule, rejected before the handler for all but the blocklist
         409: Duplicated username
     """
     username = user.username
     password = user.password
-    result = user_app.create_user(username=username, password=password, session=session)
-    status_code = 201
-    if result.reason.startswith('The username'):
-        status_code = 409
-    elif result.reason.startswith('The length'):
-        status_code = 400
-    return JSONResponse(status_code=status_code, content=result.as_dict())
+    result = user_app.create_user(username=username, password=password, session=session, validated=True)
+    return _message_response(result, 201)
+
+
+@profiled
+def create_users(
+    users: Annotated[list[UserCreateItem], Body(max_length=BULK_CREATE_MAX_USERS)],
+    session: Session = Depends(get_db),
+) -> Response:
+    """Create a batch of users.
 
+    Endpoint: /users/create_users
+    Example: [
+        {username: Jason, password: Jason1234},
+        {username: Alice, password: Alice1234},
+    ]
 
-@router.post('/verify_user/')
-def verify_user(user: UserVerify, session: Session = Depends(get_db)) -> JSONResponse:
+    Response:
+        200: One result per user in the request order, a duplicated username
+             does not abort the other ones
+        422: Malformed request or more than BULK_CREATE_MAX_USERS users
+    """
+    results = user_app.create_users(users=users, session=session)
+    return _messages_response(results)
+
+
+@profiled
+def verify_user(user: UserVerify, session: Session = Depends(get_db)) -> Response:
     """Verify a user
 
     Endpoint: /users/verify_user
@@ -50,7 +149,7 @@ def verify_user(user: UserVerify, session: Session = Depends(get_db)) -> JSONRes
     }
 
     Response:
-        200: Successfully verified
+        200: Successfully verified, with a token for /users/whoami
         401: The password is not correct
         404: The username does not exist
         429: User is not allowed for the verification within a period
@@ -58,13 +157,145 @@ def verify_user(user: UserVerify, session: Session = Depends(get_db)) -> JSONRes
     username = user.username
     password = user.password
     result = user_app.verify_user(username=username, password=password, session=session)
-    status_code = 200
-    if result.reason.startswith('The username'):
-        status_code = 404
-    elif result.reason.startswith('The password'):
-        status_code = 401
-    elif result.reason.startswith('Please try'):
-        status_code = 429
-    elif result.reason.startswith('You have entered'):
-        status_code = 429
-    return JSONResponse(status_code=status_code, content=result.as_dict())
+    return _message_response(result, 200)
+
+
+@profiled
+async def async_create_user(user: UserCreate, session: AsyncSession = Depends(get_async_db)) -> Response:
+    """Create a new user on the event loop; see `create_user`."""
+    username = user.username
+    password = user.password
+    result = await user_app.async_create_user(username=username, password=password, session=session, validated=True)
+    return _message_response(result, 201)
+
+
+@profiled
+async def async_create_users(
+    users: Annotated[list[UserCreateItem], Body(max_length=BULK_CREATE_MAX_USERS)],
+    session: AsyncSession = Depends(get_async_db),
+) -> Response:
+    """Create a batch of users on the event loop; see `create_users`."""
+    results = await user_app.async_create_users(users=users, session=session)
+    return _messages_response(results)
+
+
+@profiled
+async def async_verify_user(user: UserVerify, session: AsyncSession = Depends(get_async_db)) -> Response:
+    """Verify a user on the event loop; see `verify_user`."""
+    username = user.username
+    password = user.password
+    result = await user_app.async_verify_user(username=username, password=password, session=session)
+    return _message_response(result, 200)
+
+
+@router.get('/whoami', response_model=UserIdentity)
+async def whoami(authorization: str = Header('')) -> Response:
+    """Identify the user of a token returned by verify_user
+
+    Endpoint: /users/whoami
+    Header: Authorization: Bearer <token>
+
+    The token is checked in memory, without the database or the password hash.
+
+    Response:
+        200: The id and username of the user, and when the token expires
+        401: The token is missing, invalid or expired
+    """
+    scheme, _, token = authorization.partition(' ')
+    claims = token_signer.verify(token.strip()) if scheme.lower() == 'bearer' else None
+    if claims is None:
+        response = _message_response(INVALID_TOKEN_MESSAGE, 401)
+        response.headers['WWW-Authenticate'] = 'Bearer'
+        return response
+    identity = {'id': claims.user_id, 'username': claims.username, 'expires_at': claims.expires_at}
+    return Response(content=orjson.dumps(identity), media_type='application/json')
+
+
+def check_admin_token(token: Optional[str] = Header(None, alias='X-Admin-Token')):
+    if not ADMIN_TOKEN or not hmac.compare_digest((token or '').encode('latin-1'), ADMIN_TOKEN.encode('latin-1')):
+        raise HTTPException(status_code=403, detail='A valid X-Admin-Token header is required.')
+
+
+def _cursor_key(cursor: Optional[str], order_by: str):
+    try:
+        return user_app.decode_cursor(cursor, order_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+def _stream_users(**kwargs):
+    # The request session is closed before the body is sent, the stream needs its own.
+    with session_local() as session:
+        yield from user_app.stream_users(session, **kwargs)
+
+
+async def _async_stream_users(**kwargs):
+    async with async_session_local() as session:
+        async for chunk in user_app.async_stream_users(session, **kwargs):
+            yield chunk
+
+
+@profiled
+def list_users(
+    limit: int = Query(100, ge=1, le=USER_LIST_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    prefix: Optional[str] = Query(None, max_length=USERNAME_MAX_LENGTH),
+    order_by: Literal['name', 'id'] = 'name',
+    format: Literal['json', 'ndjson'] = 'json',
+    session: Session = Depends(get_db),
+) -> Response:
+    """List the users, without their password hashes
+
+    Endpoint: /users/?limit=100&prefix=ja&cursor=<next_cursor>
+    Header: X-Admin-Token: <ADMIN_TOKEN>
+
+    Pages follow each other by name, or by id with `order_by=id`, from the `next_cursor` of
+    the previous page. Every page costs the same however deep it is. With `format=ndjson` the
+    page is streamed as one user per line, then a `{"next_cursor": ...}` line.
+
+    Response:
+        200: The users and the cursor of the next page, null on the last one
+        400: The cursor is invalid
+        403: The admin token is missing or wrong
+    """
+    after = _cursor_key(cursor, order_by)
+    if format == 'ndjson':
+        stream = _stream_users(limit=limit, after=after, prefix=prefix, order_by=order_by)
+        return StreamingResponse(stream, media_type='application/x-ndjson')
+    page = user_app.list_users(session, limit, after=after, prefix=prefix, order_by=order_by)
+    return Response(content=orjson.dumps(page), media_type='application/json')
+
+
+@profiled
+async def async_list_users(
+    limit: int = Query(100, ge=1, le=USER_LIST_MAX_LIMIT),
+    cursor: Optional[str] = None,
+    prefix: Optional[str] = Query(None, max_length=USERNAME_MAX_LENGTH),
+    order_by: Literal['name', 'id'] = 'name',
+    format: Literal['json', 'ndjson'] = 'json',
+    session: AsyncSession = Depends(get_async_db),
+) -> Response:
+    """List the users on the event loop; see `list_users`."""
+    after = _cursor_key(cursor, order_by)
+    if format == 'ndjson':
+        stream = _async_stream_users(limit=limit, after=after, prefix=prefix, order_by=order_by)
+        return StreamingResponse(stream, media_type='application/x-ndjson')
+    page = await user_app.async_list_users(session, limit, after=after, prefix=prefix, order_by=order_by)
+    return Response(content=orjson.dumps(page), media_type='application/json')
+
+
+# The async handlers are served by default, the sync ones run in the threadpool as a fallback.
+if DATABASE_ASYNC_MODE:
+    router.post('/create_user/', response_model=UserActionMessage, description=create_user.__doc__)(async_create_user)
+    router.post(
+        '/create_users/', response_model=list[UserActionMessage], description=create_users.__doc__,
+    )(async_create_users)
+    router.post('/verify_user/', description=verify_user.__doc__)(async_verify_user)
+    router.get(
+        '/', response_model=UserPage, description=list_users.__doc__, dependencies=[Depends(check_admin_token)],
+    )(async_list_users)
+else:
+    router.post('/create_user/', response_model=UserActionMessage)(create_user)
+    router.post('/create_users/', response_model=list[UserActionMessage])(create_users)
+    router.post('/verify_user/')(verify_user)
+    router.get('/', response_model=UserPage, dependencies=[Depends(check_admin_token)])(list_users)
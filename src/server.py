@@ -0,0 +1,286 @@
+"""Production entry point: the app served by several preforked uvicorn workers.
+
+The parent imports the app, migrates the database and builds the username filter once, then forks
+the workers. They inherit all of it and share the listening socket. SIGTERM and SIGINT stop the
+workers after their in-flight requests.
+
+SIGHUP deploys new code. The parent first checks in a separate process that the app still loads,
+then execs the same command again in place, keeping its pid and the listening socket. The new
+parent loads the code anew, warms up, and replaces the workers of the old one a new one at a
+time: a new worker serves before an old one stops. The environment, and so the settings, are
+those the parent was started with.
+
+Usage (from the src directory):
+    python -m server
+    SERVER_WORKERS=4 SERVER_PORT=8000 python -m server
+"""
+import logging
+import math
+import os
+import select
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Callable
+from typing import Optional
+
+import uvicorn
+
+from db.base import async_shard_engines
+from db.base import shard_engines
+from main import app
+from main import warm_up
+from settings import LOCKOUT_BACKEND
+from settings import SERVER_GRACEFUL_TIMEOUT
+from settings import SERVER_HOST
+from settings import SERVER_HTTP
+from settings import SERVER_LOOP
+from settings import SERVER_PORT
+from settings import SERVER_WORKERS
+
+
+logger = logging.getLogger('uvicorn.error')
+
+# How long a new worker may take to serve before it is given up on
+WORKER_START_TIMEOUT = 60
+# Handed over by a parent to the one it execs on SIGHUP
+LISTEN_FD_ENV = 'SERVER_LISTEN_FD'
+WORKER_PIDS_ENV = 'SERVER_WORKER_PIDS'
+# Set in the process checking that new code loads, which exits once it did
+PREFLIGHT_ENV = 'SERVER_PREFLIGHT'
+PARENT_SIGNALS = (signal.SIGHUP, signal.SIGINT, signal.SIGTERM, signal.SIGCHLD)
+
+
+def available_cpus() -> int:
+    """CPUs this process may run on, bounded by the cgroup v2 CPU quota of a container."""
+    count = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count() or 1
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as cpu_max:
+            quota, period = cpu_max.read().split()
+        if quota != 'max':
+            count = min(count, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return max(1, count)
+
+
+class WorkerServer(uvicorn.Server):
+    """Tells the parent through a pipe once it serves."""
+
+    def __init__(self, config: uvicorn.Config, ready_fd: int):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets: Optional[list[socket.socket]] = None):
+        await super().startup(sockets=sockets)
+        if self.started:
+            os.write(self.ready_fd, b'1')
+        os.close(self.ready_fd)
+
+
+class PreforkServer:
+    """`preload` runs once in the parent after the app is loaded, before any worker is forked."""
+
+    def __init__(self, config: uvicorn.Config, workers: int, preload: Optional[Callable[[], None]] = None):
+        self.config = config
+        self.workers = workers
+        self.preload = preload
+        self.pids: set[int] = set()
+        self._signals: list[int] = []
+        self._sock: Optional[socket.socket] = None
+
+    def _on_signal(self, signum, frame):
+        self._signals.append(signum)
+
+    def _dispose_engines(self, close: bool = True):
+        # Pooled connections must not be shared with the workers. Without `close`, a worker only
+        # forgets the ones it inherited and leaves them to the parent.
+        for db_engine in shard_engines:
+            db_engine.dispose(close=close)
+        for db_engine in async_shard_engines:
+            db_engine.sync_engine.dispose(close=close)
+
+    def _run_worker(self, ready_fd: int):
+        for signum in (signal.SIGHUP, signal.SIGCHLD):
+            signal.signal(signum, signal.SIG_DFL)
+        # uvicorn takes over SIGINT and SIGTERM, and raises them again once it stopped
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, signal.SIG_IGN)
+        self._dispose_engines(close=False)
+        WorkerServer(self.config, ready_fd).run(sockets=[self._sock])
+
+    def spawn(self) -> Optional[int]:
+        """Fork a worker and wait until it serves, return its pid or None if it failed to start."""
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            status = 1
+            try:
+                self._run_worker(write_fd)
+                status = 0
+            except BaseException:
+                logger.exception('Worker [%d] crashed.', os.getpid())
+            finally:
+                os._exit(status)
+        os.close(write_fd)
+        try:
+            readable, _, _ = select.select([read_fd], [], [], WORKER_START_TIMEOUT)
+            ready = bool(readable) and os.read(read_fd, 1) == b'1'
+        finally:
+            os.close(read_fd)
+        if not ready:
+            logger.error('Worker [%d] failed to start.', pid)
+            self._stop_worker(pid)
+            return None
+        self.pids.add(pid)
+        return pid
+
+    def _stop_worker(self, pid: int):
+        """SIGTERM a worker, SIGKILL it if it is still running after SERVER_GRACEFUL_TIMEOUT seconds."""
+        self.pids.discard(pid)
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return
+        deadline = time.monotonic() + SERVER_GRACEFUL_TIMEOUT + 5
+        while time.monotonic() < deadline:
+            try:
+                if os.waitpid(pid, os.WNOHANG) != (0, 0):
+                    return
+            except ChildProcessError:
+                return
+            time.sleep(0.05)
+        logger.warning('Worker [%d] did not stop in time, killing it.', pid)
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+    def rolling_restart(self):
+        logger.info('Replacing %d workers one at a time.', len(self.pids))
+        for pid in list(self.pids):
+            if self.spawn() is None:
+                # Keep the old worker serving rather than leave fewer workers
+                logger.error('Rolling restart aborted, worker [%d] is kept.', pid)
+                return
+            self._stop_worker(pid)
+
+    def _command(self) -> list[str]:
+        return [sys.executable, *sys.orig_argv[1:]]
+
+    def reexec(self):
+        """Exec the command of this process again, which takes over the socket and the workers.
+
+        Nothing changes when the new code fails to load.
+        """
+        command = self._command()
+        try:
+            subprocess.run(
+                command, env=dict(os.environ, **{PREFLIGHT_ENV: '1'}), stdin=subprocess.DEVNULL,
+                timeout=WORKER_START_TIMEOUT, check=True,
+            )
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.error('The new code failed to load, the workers are kept: %s', e)
+            return
+        logger.info('Re-executing the parent [%d] with %d workers.', os.getpid(), len(self.pids))
+        os.set_inheritable(self._sock.fileno(), True)
+        os.environ[LISTEN_FD_ENV] = str(self._sock.fileno())
+        os.environ[WORKER_PIDS_ENV] = ','.join(str(pid) for pid in self.pids)
+        # Held until the new parent handles them, a SIGTERM meanwhile would leave the workers behind
+        signal.pthread_sigmask(signal.SIG_BLOCK, PARENT_SIGNALS)
+        try:
+            os.execv(sys.executable, command)
+        except OSError as e:
+            signal.pthread_sigmask(signal.SIG_UNBLOCK, PARENT_SIGNALS)
+            del os.environ[LISTEN_FD_ENV], os.environ[WORKER_PIDS_ENV]
+            logger.error('Failed to re-execute the parent: %s', e)
+
+    def _take_over(self) -> socket.socket:
+        """Return the socket of the parent this process replaced, and adopt its workers."""
+        fd = os.environ.pop(LISTEN_FD_ENV, None)
+        pids = os.environ.pop(WORKER_PIDS_ENV, '')
+        if fd is None:
+            return self.config.bind_socket()
+        # The workers are still children of this pid, exec did not change it
+        self.pids = {int(pid) for pid in pids.split(',') if pid}
+        sock = socket.socket(fileno=int(fd))
+        os.set_inheritable(sock.fileno(), False)
+        return sock
+
+    def _reap(self):
+        """Replace the workers which exited on their own."""
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            if pid in self.pids:
+                self.pids.discard(pid)
+                logger.warning('Worker [%d] exited with status %d, starting another one.', pid, status)
+                self.spawn()
+
+    def run(self):
+        self.config.load()
+        if os.environ.get(PREFLIGHT_ENV):
+            return
+        if self.preload is not None:
+            self.preload()
+        self._dispose_engines()
+        self._sock = self._take_over()
+        for signum in PARENT_SIGNALS:
+            signal.signal(signum, self._on_signal)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, PARENT_SIGNALS)
+        if self.pids:
+            # Replace the workers of the parent this process was exec'd from
+            self.rolling_restart()
+        if len(self.pids) < self.workers:
+            logger.info('Starting %d workers from parent [%d].', self.workers - len(self.pids), os.getpid())
+        while len(self.pids) < self.workers:
+            if self.spawn() is None:
+                break
+        # SERVER_WORKERS may have been lowered
+        for pid in list(self.pids)[self.workers:]:
+            self._stop_worker(pid)
+        try:
+            while self.pids:
+                if not self._signals:
+                    time.sleep(0.2)
+                    continue
+                signum = self._signals.pop(0)
+                if signum == signal.SIGHUP:
+                    self.reexec()
+                elif signum == signal.SIGCHLD:
+                    self._reap()
+                else:
+                    break
+        finally:
+            for pid in list(self.pids):
+                self._stop_worker(pid)
+            self._sock.close()
+        logger.info('Stopped.')
+
+
+def preload():
+    warm_up()
+    app.state.preloaded = True
+
+
+def main():
+    config = uvicorn.Config(
+        app, host=SERVER_HOST, port=SERVER_PORT, loop=SERVER_LOOP, http=SERVER_HTTP, lifespan='on',
+        timeout_graceful_shutdown=SERVER_GRACEFUL_TIMEOUT,
+    )
+    workers = SERVER_WORKERS or available_cpus()
+    if workers > 1 and LOCKOUT_BACKEND == 'memory':
+        logger.warning(
+            'LOCKOUT_BACKEND=memory counts wrong passwords per worker, a user gets %d times the threshold. '
+            'Set LOCKOUT_BACKEND=sqlite to share the counters.', workers,
+        )
+    PreforkServer(config, workers=workers, preload=preload).run()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,147 @@
+import os
+from typing import Optional
+
+
 USERNAME_MIN_LENGTH: int = 3
 USERNAME_MAX_LENGTH: int = 32
 PASSWORD_MIN_LENGTH: int = 8
 PASSWORD_MAX_LENGTH: int = 32
 USER_PENALTY_NUMBER: int = 5
 USER_PENALTY_PERIOD: int = 60
+
+# In-memory Bloom filter of the user names, lookups of names it has never seen skip the database.
+# Names created by other workers are picked up every USERNAME_FILTER_REFRESH_INTERVAL seconds.
+USERNAME_FILTER_ENABLED: bool = os.environ.get('USERNAME_FILTER_ENABLED', '1') == '1'
+USERNAME_FILTER_FP_RATE: float = float(os.environ.get('USERNAME_FILTER_FP_RATE', 0.01))
+USERNAME_FILTER_MIN_CAPACITY: int = int(os.environ.get('USERNAME_FILTER_MIN_CAPACITY', 100000))
+USERNAME_FILTER_REFRESH_INTERVAL: float = float(os.environ.get('USERNAME_FILTER_REFRESH_INTERVAL', 5))
+USERNAME_FILTER_REBUILD_INTERVAL: float = float(os.environ.get('USERNAME_FILTER_REBUILD_INTERVAL', 3600))
+# File every process writing users changes once it committed them. Until a worker refreshed its filter
+# after such a change, names missing from it are looked up in the database. Every writer of the database
+# must share this file, i.e. run on one host; with an empty path a miss never skips the database.
+USERS_MARKER_PATH: str = os.environ.get('USERS_MARKER_PATH', 'users.marker')
+
+# LRU cache of `name -> (id, password_hash)` in front of the verification queries, 0 disables it.
+# A password changed through another worker is only seen here after USER_CACHE_TTL seconds.
+USER_CACHE_MAX_SIZE: int = int(os.environ.get('USER_CACHE_MAX_SIZE', 10000))
+USER_CACHE_TTL: float = float(os.environ.get('USER_CACHE_TTL', 30))
+
+# Bulk user creation
+BULK_CREATE_MAX_USERS: int = int(os.environ.get('BULK_CREATE_MAX_USERS', 10000))
+BULK_CREATE_CHUNK_SIZE: int = int(os.environ.get('BULK_CREATE_CHUNK_SIZE', 500))
+
+# Lockout store of wrong passwords, `memory` is per process and `sqlite` is shared by the workers of a host.
+# Defaults to `sqlite` unless SERVER_WORKERS=1: workers counting apart would allow each the whole threshold.
+LOCKOUT_BACKEND: str = os.environ.get(
+    'LOCKOUT_BACKEND', 'memory' if os.environ.get('SERVER_WORKERS') == '1' else 'sqlite'
+)
+LOCKOUT_SQLITE_PATH: str = os.environ.get('LOCKOUT_SQLITE_PATH', 'lockout.db')
+# Failure counters are forgotten this many seconds after the last wrong password.
+LOCKOUT_TTL: int = int(os.environ.get('LOCKOUT_TTL', 3600))
+LOCKOUT_MAX_ENTRIES: int = int(os.environ.get('LOCKOUT_MAX_ENTRIES', 100000))
+
+# Password hashing, `scrypt` or `pbkdf2_sha256`. Stored hashes with other params are upgraded on login.
+PASSWORD_HASH_ALGORITHM: str = os.environ.get('PASSWORD_HASH_ALGORITHM', 'scrypt')
+PASSWORD_SCRYPT_N: int = int(os.environ.get('PASSWORD_SCRYPT_N', 2 ** 14))
+PASSWORD_SCRYPT_R: int = int(os.environ.get('PASSWORD_SCRYPT_R', 8))
+PASSWORD_SCRYPT_P: int = int(os.environ.get('PASSWORD_SCRYPT_P', 1))
+PASSWORD_PBKDF2_ITERATIONS: int = int(os.environ.get('PASSWORD_PBKDF2_ITERATIONS', 600000))
+# Hashing runs in a pool of `thread`s (hashlib releases the GIL) or `process`es.
+PASSWORD_HASH_EXECUTOR: str = os.environ.get('PASSWORD_HASH_EXECUTOR', 'thread')
+PASSWORD_HASH_WORKERS: int = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+
+# Database
+DATABASE_URL: str = os.environ.get('DATABASE_URL', 'sqlite:///seano.db')
+DATABASE_ASYNC_URL: str = os.environ.get(
+    'DATABASE_ASYNC_URL', DATABASE_URL.replace('sqlite://', 'sqlite+aiosqlite://', 1)
+)
+# Pool of the engines, also applies to server databases
+DATABASE_POOL_SIZE: int = int(os.environ.get('DATABASE_POOL_SIZE', 5))
+DATABASE_MAX_OVERFLOW: int = int(os.environ.get('DATABASE_MAX_OVERFLOW', 10))
+DATABASE_POOL_TIMEOUT: float = float(os.environ.get('DATABASE_POOL_TIMEOUT', 30))
+DATABASE_POOL_RECYCLE: int = int(os.environ.get('DATABASE_POOL_RECYCLE', -1))
+# Pragmas run on every new SQLite connection. WAL lets readers run while a writer commits.
+DATABASE_SQLITE_JOURNAL_MODE: str = os.environ.get('DATABASE_SQLITE_JOURNAL_MODE', 'WAL')
+DATABASE_SQLITE_SYNCHRONOUS: str = os.environ.get('DATABASE_SQLITE_SYNCHRONOUS', 'NORMAL')
+DATABASE_SQLITE_BUSY_TIMEOUT: int = int(os.environ.get('DATABASE_SQLITE_BUSY_TIMEOUT', 5000))
+DATABASE_SQLITE_MMAP_SIZE: int = int(os.environ.get('DATABASE_SQLITE_MMAP_SIZE', 256 * 1024 * 1024))
+# Negative values are in KiB
+DATABASE_SQLITE_CACHE_SIZE: int = int(os.environ.get('DATABASE_SQLITE_CACHE_SIZE', -64 * 1024))
+# Upgrade the schema when the app starts. Workers take turns on the lock file, only the first one migrates.
+MIGRATE_ON_STARTUP: bool = os.environ.get('MIGRATE_ON_STARTUP', '1') == '1'
+MIGRATION_LOCK_PATH: Optional[str] = os.environ.get('MIGRATION_LOCK_PATH', 'migration.lock') or None
+# Serve the user routes with async handlers and an async engine; set to 0 to fall back to the sync path.
+DATABASE_ASYNC_MODE: bool = os.environ.get('DATABASE_ASYNC_MODE', '1') == '1'
+# Collect Prometheus metrics, served at /metrics
+METRICS_ENABLED: bool = os.environ.get('METRICS_ENABLED', '1') == '1'
+# Workers of one host share their values through this directory, empty to report this process only
+METRICS_DIR: str = os.environ.get('METRICS_DIR', '')
+METRICS_FLUSH_INTERVAL: float = float(os.environ.get('METRICS_FLUSH_INTERVAL', 5))
+# Profile requests with cProfile, triggered by PROFILING_HEADER or a sampled share of the requests
+PROFILING_ENABLED: bool = os.environ.get('PROFILING_ENABLED', '0') == '1'
+PROFILING_HEADER: str = os.environ.get('PROFILING_HEADER', 'X-Profile')
+# The header only triggers a profile, and reads them, when its value matches this token. Required when enabled.
+PROFILING_TOKEN: str = os.environ.get('PROFILING_TOKEN', '')
+PROFILING_SAMPLE_RATE: float = float(os.environ.get('PROFILING_SAMPLE_RATE', 0))
+PROFILING_DIR: str = os.environ.get('PROFILING_DIR', 'profiles')
+PROFILING_MAX_FILES: int = int(os.environ.get('PROFILING_MAX_FILES', 50))
+# Memory-mapped file of common and breached passwords new passwords are checked against, built with
+# `python -m tools.build_password_blocklist`. Empty to disable the check.
+PASSWORD_BLOCKLIST_PATH: str = os.environ.get('PASSWORD_BLOCKLIST_PATH', '')
+# Keys signing the tokens returned by verify_user, as comma separated `key_id:secret` pairs. The first
+# one signs new tokens, the others are still accepted while their tokens expire. A random key is made
+# up at start when empty, tokens then only hold within one process.
+TOKEN_KEYS: str = os.environ.get('TOKEN_KEYS', '')
+TOKEN_TTL: int = int(os.environ.get('TOKEN_TTL', 3600))
+# Spread the users over this many SQLite files by a hash of their name. Shard i of `sqlite:///seano.db`
+# lives in `seano.i.db`. Change it with `python -m tools.rebalance_shards` while the service is stopped.
+DATABASE_SHARDS: int = int(os.environ.get('DATABASE_SHARDS', 1))
+# Audit log of the create and verify attempts, written in batches off the request path, appended to
+# AUDIT_FILE_PATH (`file`) or to the `audit_events` table (`database`, of the first shard when sharded,
+# whose writes then compete with the user creations for SQLite's write lock). Empty to disable.
+# Events are dropped, and counted, while AUDIT_BUFFER_SIZE of them wait to be written.
+AUDIT_BACKEND: str = os.environ.get('AUDIT_BACKEND', 'file')
+AUDIT_FILE_PATH: str = os.environ.get('AUDIT_FILE_PATH', 'audit.ndjson')
+AUDIT_BUFFER_SIZE: int = int(os.environ.get('AUDIT_BUFFER_SIZE', 100000))
+AUDIT_BATCH_SIZE: int = int(os.environ.get('AUDIT_BATCH_SIZE', 1000))
+AUDIT_FLUSH_INTERVAL: float = float(os.environ.get('AUDIT_FLUSH_INTERVAL', 1))
+# GET /users/ lists the users for admin tooling, to clients sending this token in the X-Admin-Token
+# header. The listing is disabled while it is empty.
+ADMIN_TOKEN: str = os.environ.get('ADMIN_TOKEN', '')
+USER_LIST_MAX_LIMIT: int = int(os.environ.get('USER_LIST_MAX_LIMIT', 100000))
+# Users read per query while a page is streamed as NDJSON
+USER_LIST_CHUNK_SIZE: int = int(os.environ.get('USER_LIST_CHUNK_SIZE', 1000))
+# Prefork server of server.py, SERVER_WORKERS=0 starts one worker per available CPU
+SERVER_HOST: str = os.environ.get('SERVER_HOST', '0.0.0.0')
+SERVER_PORT: int = int(os.environ.get('SERVER_PORT', 8080))
+SERVER_WORKERS: int = int(os.environ.get('SERVER_WORKERS', 0))
+SERVER_LOOP: str = os.environ.get('SERVER_LOOP', 'uvloop')
+SERVER_HTTP: str = os.environ.get('SERVER_HTTP', 'httptools')
+# Seconds a stopping worker may spend on its in-flight requests
+SERVER_GRACEFUL_TIMEOUT: int = int(os.environ.get('SERVER_GRACEFUL_TIMEOUT', 30))
+# Concurrent verifications of one username share one database fetch, and of one username and password
+# one password hash
+SINGLE_FLIGHT_ENABLED: bool = os.environ.get('SINGLE_FLIGHT_ENABLED', '1') == '1'
+# Admission control of the user routes. Verifications and creations each get a concurrency limit, which
+# grows while their requests stay under the latency target and shrinks when they don't (AIMD), and a
+# bounded queue. Requests finding the queue full, or waiting longer than ADMISSION_QUEUE_TIMEOUT seconds,
+# get a 503 with a Retry-After of ADMISSION_RETRY_AFTER seconds.
+ADMISSION_ENABLED: bool = os.environ.get('ADMISSION_ENABLED', '1') == '1'
+ADMISSION_INITIAL_LIMIT: int = int(os.environ.get('ADMISSION_INITIAL_LIMIT', 16))
+ADMISSION_MIN_LIMIT: int = int(os.environ.get('ADMISSION_MIN_LIMIT', 1))
+ADMISSION_MAX_LIMIT: int = int(os.environ.get('ADMISSION_MAX_LIMIT', 256))
+ADMISSION_QUEUE_SIZE: int = int(os.environ.get('ADMISSION_QUEUE_SIZE', 64))
+ADMISSION_QUEUE_TIMEOUT: float = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT', 0.5))
+ADMISSION_VERIFY_LATENCY_TARGET: float = float(os.environ.get('ADMISSION_VERIFY_LATENCY_TARGET', 0.5))
+ADMISSION_CREATE_LATENCY_TARGET: float = float(os.environ.get('ADMISSION_CREATE_LATENCY_TARGET', 2))
+ADMISSION_RETRY_AFTER: int = int(os.environ.get('ADMISSION_RETRY_AFTER', 1))
+# Logs of the app are handed to a queue and written by a background thread to stderr as JSON lines,
+# LOG_QUEUE_SIZE records at most wait there. Set LOGGING_ENABLED=0 to leave the logging setup alone.
+LOGGING_ENABLED: bool = os.environ.get('LOGGING_ENABLED', '1') == '1'
+LOG_LEVEL: str = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_QUEUE_SIZE: int = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+# Warnings with the same message template pass LOG_RATE_LIMIT_BURST times per LOG_RATE_LIMIT_INTERVAL
+# seconds, then a LOG_SAMPLE_RATE share of them. The next one written tells how many were suppressed.
+LOG_RATE_LIMIT_BURST: int = int(os.environ.get('LOG_RATE_LIMIT_BURST', 10))
+LOG_RATE_LIMIT_INTERVAL: float = float(os.environ.get('LOG_RATE_LIMIT_INTERVAL', 60))
+LOG_SAMPLE_RATE: float = float(os.environ.get('LOG_SAMPLE_RATE', 0.01))
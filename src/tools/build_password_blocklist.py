@@ -0,0 +1,114 @@
+"""Build the memory-mapped password blocklist read by `PasswordValidator`.
+
+Inputs are either plain password lists, one password per line, or SHA-1 hash lists such as the
+Pwned Passwords downloads, one `HASH[:count]` per line. Keys are sorted in runs of `--run-size`
+and merged from temporary files, so lists of hundreds of millions of entries build in bounded memory.
+
+Usage (from the src directory):
+    python -m tools.build_password_blocklist rockyou.txt common.txt -o blocklist.bin
+    python -m tools.build_password_blocklist pwned-passwords-sha1.txt --format sha1 --min-count 10 -o blocklist.bin
+"""
+import argparse
+import hashlib
+import heapq
+import logging
+import os
+import tempfile
+import time
+from typing import Iterable
+from typing import Iterator
+
+from app.blocklist import DEFAULT_PREFIX_SIZE
+from app.blocklist import write_blocklist
+
+
+logger = logging.getLogger(__name__)
+
+
+def read_keys(paths: list[str], file_format: str, prefix_size: int, min_count: int = 0) -> Iterator[bytes]:
+    for path in paths:
+        with open(path, 'rb') as file:
+            for line in file:
+                line = line.rstrip(b'\r\n')
+                if not line:
+                    continue
+                if file_format == 'plain':
+                    yield hashlib.sha1(line).digest()[:prefix_size]
+                    continue
+                digest, _, count = line.partition(b':')
+                if min_count and count and int(count) < min_count:
+                    continue
+                yield bytes.fromhex(digest[:2 * prefix_size].decode('ascii'))
+
+
+def _write_run(keys: list[bytes], directory: str) -> str:
+    keys.sort()
+    with tempfile.NamedTemporaryFile('wb', dir=directory, suffix='.run', delete=False) as file:
+        file.write(b''.join(keys))
+    return file.name
+
+
+def _read_run(path: str, prefix_size: int) -> Iterator[bytes]:
+    with open(path, 'rb') as file:
+        while True:
+            block = file.read(prefix_size * 65536)
+            if not block:
+                return
+            for start in range(0, len(block), prefix_size):
+                yield block[start:start + prefix_size]
+
+
+def sorted_keys(keys: Iterable[bytes], prefix_size: int, run_size: int, directory: str) -> Iterator[bytes]:
+    """Sort `keys` with an external merge sort through files in `directory`."""
+    runs = []
+    batch = []
+    try:
+        for key in keys:
+            batch.append(key)
+            if len(batch) >= run_size:
+                runs.append(_write_run(batch, directory))
+                logger.info('Sorted %d keys.', len(runs) * run_size)
+                batch = []
+        if not runs:
+            batch.sort()
+            yield from batch
+            return
+        if batch:
+            runs.append(_write_run(batch, directory))
+        # Only the runs are needed from here on
+        batch = []
+        yield from heapq.merge(*(_read_run(path, prefix_size) for path in runs))
+    finally:
+        for path in runs:
+            os.remove(path)
+
+
+def build(paths: list[str], output: str, file_format: str = 'plain', prefix_size: int = DEFAULT_PREFIX_SIZE,
+          min_count: int = 0, run_size: int = 5000000, tmp_dir: str = None) -> int:
+    keys = read_keys(paths, file_format, prefix_size, min_count)
+    directory = tmp_dir or os.path.dirname(os.path.abspath(output))
+    return write_blocklist(output, sorted_keys(keys, prefix_size, run_size, directory), prefix_size)
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Build the password blocklist file.')
+    parser.add_argument('paths', nargs='+', help='Password or SHA-1 hash lists.')
+    parser.add_argument('-o', '--output', required=True, help='Blocklist file to write.')
+    parser.add_argument('--format', choices=['plain', 'sha1'], default='plain')
+    parser.add_argument('--min-count', type=int, default=0, help='Skip hashes seen fewer times, sha1 format only.')
+    parser.add_argument('--prefix-size', type=int, default=DEFAULT_PREFIX_SIZE,
+                        help='Bytes of the digests stored, 8 bytes keep false positives below 1 in 10^10.')
+    parser.add_argument('--run-size', type=int, default=5000000, help='Keys sorted in memory at once.')
+    parser.add_argument('--tmp-dir', help='Directory of the sorted runs, defaults to the output directory.')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    started = time.perf_counter()
+    count = build(args.paths, args.output, args.format, args.prefix_size, args.min_count, args.run_size, args.tmp_dir)
+    logger.info('Wrote %d passwords to %s (%.1f MB) in %.1f s.', count, args.output,
+                os.path.getsize(args.output) / 1e6, time.perf_counter() - started)
+    return count
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,171 @@
+"""Import users from a CSV or NDJSON file straight into the database, without the API.
+
+The file is read as a stream and handled one batch at a time, so memory stays flat
+whatever its size. Passwords are hashed in a process pool while the previous batch
+is being inserted. Rejected rows are written to a CSV file with their reason.
+
+Usage (from the src directory):
+    python -m tools.import_users users.csv --batch-size 5000 --workers 4
+    python -m tools.import_users users.ndjson --rejects rejects.csv
+
+CSV files need a header with `username` and `password` columns, NDJSON files hold
+one `{"username": ..., "password": ...}` object per line.
+"""
+from concurrent.futures import Executor
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import csv
+import itertools
+import logging
+import os
+import time
+from typing import Iterable
+from typing import Iterator
+from typing import Optional
+
+import orjson
+from sqlalchemy.orm import Session
+
+from app.user import hash_password
+from app.user import validate_user
+from db.base import session_local
+from db.user import create_db_users
+
+
+logger = logging.getLogger(__name__)
+
+MALFORMED_ROW = 'The row is malformed, expected a username and a password.'
+DUPLICATED_USER = 'The username: [%s] has been created already, please change another one.'
+
+
+class ImportStats:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.rejected = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def report(self) -> str:
+        elapsed = self.elapsed
+        return 'Read %d rows: %d users created, %d rejected in %.1f s (%.0f rows/s).' % (
+            self.rows, self.created, self.rejected, elapsed, self.rows / elapsed if elapsed else 0,
+        )
+
+
+def read_users(path: str, file_format: str) -> Iterator[tuple[int, Optional[str], Optional[str]]]:
+    """Yield `(line, username, password)`, username and password are None for a malformed row."""
+    with open(path, newline='', encoding='utf-8') as file:
+        if file_format == 'csv':
+            reader = csv.DictReader(file)
+            for row in reader:
+                username, password = row.get('username'), row.get('password')
+                if not isinstance(username, str) or not isinstance(password, str):
+                    username = password = None
+                yield reader.line_num, username, password
+            return
+        for line_number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            try:
+                row = orjson.loads(line)
+                username, password = row['username'], row['password']
+            except (orjson.JSONDecodeError, KeyError, TypeError):
+                username = password = None
+            if not isinstance(username, str) or not isinstance(password, str):
+                username = password = None
+            yield line_number, username, password
+
+
+def _batched(iterable: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(iterable)
+    while batch := list(itertools.islice(iterator, size)):
+        yield batch
+
+
+class UserImporter:
+    def __init__(self, session: Session, rejects: csv.writer, executor: Executor, batch_size: int, workers: int):
+        self.session = session
+        self.rejects = rejects
+        self.executor = executor
+        self.batch_size = batch_size
+        self.workers = workers
+        self.stats = ImportStats()
+
+    def _reject(self, line: int, username: Optional[str], reason: str):
+        self.stats.rejected += 1
+        self.rejects.writerow([line, username or '', reason])
+
+    def _prepare(self, batch: list) -> tuple[dict[str, int], Iterator[str]]:
+        """Validate a batch and start hashing its passwords, return `name -> line` and the pending hashes."""
+        lines = {}
+        passwords = []
+        for line, username, password in batch:
+            self.stats.rows += 1
+            if username is None:
+                self._reject(line, username, MALFORMED_ROW)
+                continue
+            result = validate_user(username=username, password=password)
+            if not result.success:
+                self._reject(line, username, result.reason)
+            elif username in lines:
+                self._reject(line, username, DUPLICATED_USER % username)
+            else:
+                lines[username] = line
+                passwords.append(password)
+        chunksize = max(1, len(passwords) // (self.workers * 4))
+        return lines, self.executor.map(hash_password, passwords, chunksize=chunksize)
+
+    def _insert(self, lines: dict[str, int], hashes: Iterator[str]):
+        created = create_db_users(list(zip(lines, hashes)), session=self.session, chunk_size=self.batch_size)
+        self.stats.created += len(created)
+        for username, line in lines.items():
+            if username not in created:
+                self._reject(line, username, DUPLICATED_USER % username)
+
+    def run(self, rows: Iterable) -> ImportStats:
+        pending = None
+        for batch in _batched(rows, self.batch_size):
+            prepared = self._prepare(batch)
+            if pending is not None:
+                self._insert(*pending)
+                logger.info('%d rows read, %d users created.', self.stats.rows, self.stats.created)
+            pending = prepared
+        if pending is not None:
+            self._insert(*pending)
+        return self.stats
+
+
+def main(argv: list[str] = None) -> ImportStats:
+    parser = argparse.ArgumentParser(description='Import users from a CSV or NDJSON file.')
+    parser.add_argument('path', help='CSV or NDJSON file with username and password fields.')
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help='Defaults to the file extension.')
+    parser.add_argument('--rejects', help='CSV file of rejected rows, defaults to <path>.rejects.csv.')
+    parser.add_argument('--batch-size', type=int, default=5000, help='Rows committed per transaction.')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Password hashing processes.')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    # Every rejected row ends up in the rejects file, the validator warnings would only add noise.
+    logging.getLogger('app.user').setLevel(logging.ERROR)
+
+    file_format = args.format or ('csv' if args.path.endswith('.csv') else 'ndjson')
+    rejects_path = args.rejects or '%s.rejects.csv' % args.path
+    with open(rejects_path, 'w', newline='', encoding='utf-8') as rejects_file, \
+            ProcessPoolExecutor(max_workers=args.workers) as executor, \
+            session_local() as session:
+        rejects = csv.writer(rejects_file)
+        rejects.writerow(['line', 'username', 'reason'])
+        importer = UserImporter(session, rejects, executor, batch_size=args.batch_size, workers=args.workers)
+        stats = importer.run(read_users(args.path, file_format))
+    logger.info(stats.report())
+    if stats.rejected:
+        logger.info('Rejected rows are written to %s.', rejects_path)
+    return stats
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,105 @@
+"""Move the users to the shards of a new DATABASE_SHARDS value.
+
+Run it while the service is stopped, then restart the service with the new value. The shards of
+the new layout are migrated first. Users whose shard changes are copied to their new shard and
+deleted from the old one a batch at a time, so an interrupted run can simply be started again.
+Moved users get a new id from the range of their new shard.
+
+Usage (from the src directory):
+    python -m tools.rebalance_shards --from 1 --to 4
+    python -m tools.rebalance_shards --from 4 --to 8 --batch-size 5000
+"""
+import argparse
+import logging
+from typing import Optional
+
+from sqlalchemy import delete
+from sqlalchemy import Engine
+from sqlalchemy import insert
+from sqlalchemy import select
+
+from db.base import build_engine
+from db.migration import migrate_db_schema
+from db.shards import shard_for
+from db.shards import shard_urls
+from db.user import DBUser
+from db.user import shard_id_values
+from db.username_filter import username_filter
+from settings import DATABASE_URL
+
+
+logger = logging.getLogger(__name__)
+
+
+def _move_batch(rows: list, source: Engine, targets: list[Engine], target_urls: list[str], source_url: str) -> int:
+    """Copy the rows which belong elsewhere to their new shard, then delete them from `source`."""
+    moving = {}
+    for user_id, name, password_hash in rows:
+        shard = shard_for(name, len(targets))
+        if target_urls[shard] != source_url:
+            moving.setdefault(shard, []).append((user_id, name, password_hash))
+    for shard, shard_rows in moving.items():
+        # Names copied by an interrupted run are there already, they are only deleted from the source.
+        statement = insert(DBUser).prefix_with('OR IGNORE').values(**shard_id_values(shard))
+        values = [{'name': name, 'password_hash': password_hash} for _, name, password_hash in shard_rows]
+        with targets[shard].begin() as connection:
+            connection.execute(statement, values)
+    if moving:
+        # The filters of running workers no longer trust their misses
+        username_filter.marker.bump()
+    moved_ids = [user_id for shard_rows in moving.values() for user_id, _, _ in shard_rows]
+    if moved_ids:
+        with source.begin() as connection:
+            connection.execute(delete(DBUser).where(DBUser.id.in_(moved_ids)))
+    return len(moved_ids)
+
+
+def rebalance(
+    from_shards: int, to_shards: int, url: str = DATABASE_URL, batch_size: int = 1000, lock_path: Optional[str] = None,
+) -> int:
+    """Move the users of the `from_shards` layout of `url` to the `to_shards` one, return how many moved."""
+    source_urls = shard_urls(url, from_shards)
+    target_urls = shard_urls(url, to_shards)
+    targets = [build_engine(target_url) for target_url in target_urls]
+    engines = {target_url: target for target_url, target in zip(target_urls, targets)}
+    moved = 0
+    try:
+        for target in targets:
+            migrate_db_schema(target, lock_path)
+        for source_url in source_urls:
+            source = engines.get(source_url) or build_engine(source_url)
+            engines[source_url] = source
+            last_id = -1
+            while True:
+                with source.connect() as connection:
+                    rows = connection.execute(
+                        select(DBUser.id, DBUser.name, DBUser.password_hash)
+                        .where(DBUser.id > last_id).order_by(DBUser.id).limit(batch_size)
+                    ).all()
+                if not rows:
+                    break
+                last_id = rows[-1][0]
+                moved += _move_batch(rows, source, targets, target_urls, source_url)
+            logger.info('%s done, %d users moved so far.', source_url, moved)
+    finally:
+        for db_engine in engines.values():
+            db_engine.dispose()
+    return moved
+
+
+def main(argv: list[str] = None) -> int:
+    parser = argparse.ArgumentParser(description='Move the users to the shards of a new DATABASE_SHARDS value.')
+    parser.add_argument('--from', dest='from_shards', type=int, required=True, help='Current DATABASE_SHARDS.')
+    parser.add_argument('--to', dest='to_shards', type=int, required=True, help='New DATABASE_SHARDS.')
+    parser.add_argument('--url', default=DATABASE_URL, help='Unsharded database URL, defaults to DATABASE_URL.')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Users read per transaction.')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    moved = rebalance(args.from_shards, args.to_shards, url=args.url, batch_size=args.batch_size)
+    logger.info('%d users moved from %d to %d shards.', moved, args.from_shards, args.to_shards)
+    return moved
+
+
+if __name__ == '__main__':
+    main()
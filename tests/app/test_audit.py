@@ -0,0 +1,116 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../", "src")))
+
+from unittest.mock import Mock
+from unittest.mock import patch
+
+import orjson
+from sqlalchemy import create_engine
+from sqlalchemy import select
+
+from app.audit import AuditEvent
+from app.audit import AuditLog
+from app.audit import AuditSink
+from app.audit import create_audit_log
+from app.audit import DatabaseAuditSink
+from app.audit import FileAuditSink
+from app.user import create_user
+from db.audit import DBAuditEvent
+from db.base import Base
+
+
+class ListSink(AuditSink):
+    def __init__(self):
+        self.batches = []
+
+    def write(self, events: list[AuditEvent]):
+        self.batches.append(events)
+
+
+def test_AuditLog():
+    sink = ListSink()
+    audit_log = AuditLog(sink, capacity=5, batch_size=2, flush_interval=60, clock=lambda: 1000.0)
+
+    # Test case 1: Events are buffered until flushed, in batches
+    for i in range(3):
+        audit_log.record('verify', 'user_%d' % i, True, 'ok')
+    assert sink.batches == []
+    assert audit_log.flush() == 3
+    assert [len(batch) for batch in sink.batches] == [2, 1]
+    assert sink.batches[0][0] == AuditEvent(1000.0, 'verify', 'user_0', True, 'ok')
+
+    # Test case 2: A full buffer drops the new events and counts them
+    for i in range(7):
+        audit_log.record('create', 'user_%d' % i, False, 'username_duplicated')
+    assert audit_log.stats() == {'pending': 5, 'written': 3, 'dropped': 2, 'failed': 0}
+
+    # Test case 3: A failing sink loses its batch but not the following ones
+    sink.write = Mock(side_effect=[OSError('disk full'), None, None])
+    assert audit_log.flush() == 3
+    assert audit_log.stats() == {'pending': 0, 'written': 6, 'dropped': 2, 'failed': 2}
+
+    # Test case 4: Disabled log
+    disabled = AuditLog(None)
+    disabled.record('verify', 'user', True, 'ok')
+    disabled.start()
+    assert disabled.stats()['pending'] == 0
+
+
+def test_AuditLog_background():
+    sink = ListSink()
+    audit_log = AuditLog(sink, capacity=100, batch_size=10, flush_interval=60)
+    audit_log.start()
+
+    # Test case 1: A full batch wakes up the writer
+    for i in range(10):
+        audit_log.record('verify', 'user_%d' % i, True, 'ok')
+    for _ in range(100):
+        if sink.batches:
+            break
+        audit_log._stop.wait(0.01)
+    assert len(sink.batches) == 1
+
+    # Test case 2: Stopping writes what is left
+    audit_log.record('verify', 'last', True, 'ok')
+    audit_log.stop()
+    assert sink.batches[-1][0].username == 'last'
+
+
+def test_sinks(tmp_path):
+    events = [
+        AuditEvent(1000.0, 'verify', 'user_1', False, 'password_incorrect'),
+        AuditEvent(1001.0, 'create', 'x' * 10, True, 'ok'),
+    ]
+
+    # Test case 1: JSON lines appended to a file
+    path = tmp_path.joinpath('audit.ndjson')
+    sink = FileAuditSink(str(path))
+    sink.write(events[:1])
+    sink.write(events[1:])
+    sink.close()
+    lines = [orjson.loads(line) for line in path.read_bytes().splitlines()]
+    assert lines[0] == {
+        'created_at': 1000.0, 'action': 'verify', 'username': 'user_1', 'success': False, 'code': 'password_incorrect',
+    }
+    assert lines[1]['action'] == 'create'
+
+    # Test case 2: Rows of the audit_events table
+    engine = create_engine('sqlite:///%s' % tmp_path.joinpath('test.db'))
+    Base.metadata.create_all(engine)
+    DatabaseAuditSink(engine).write(events)
+    with engine.connect() as connection:
+        rows = connection.execute(select(DBAuditEvent.username, DBAuditEvent.success, DBAuditEvent.code)).all()
+    assert rows == [('user_1', False, 'password_incorrect'), ('xxxxxxxxxx', True, 'ok')]
+    engine.dispose()
+
+    # Test case 3: The file sink is the default, off the users database
+    assert isinstance(create_audit_log().sink, FileAuditSink)
+
+
+def test_create_user_audit():
+    audit_log = AuditLog(ListSink())
+    with patch('app.user.audit_log', audit_log):
+        # Test case 1: Rejected attempts are recorded with their code
+        create_user(username='ab', password='Abc12345678', session=Mock())
+        assert audit_log._events[-1][1:] == ('create', 'ab', False, 'username_length')
@@ -0,0 +1,38 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../", "src")))
+
+import pytest
+
+from app.blocklist import password_key
+from app.blocklist import PasswordBlocklist
+from app.blocklist import write_blocklist
+
+
+def test_PasswordBlocklist(tmp_path):
+    path = str(tmp_path.joinpath('blocklist.bin'))
+    passwords = ['Password1', 'Abc12345678', 'Qwerty123', 'Password1']
+    assert write_blocklist(path, sorted(password_key(password) for password in passwords)) == 3
+    blocklist = PasswordBlocklist(path)
+
+    # Test case 1: Listed passwords
+    assert len(blocklist) == 3
+    for password in passwords:
+        assert password in blocklist
+
+    # Test case 2: Other passwords
+    assert 'Password2' not in blocklist
+    assert '' not in blocklist
+    blocklist.close()
+
+    # Test case 3: Unsorted keys are refused
+    keys = sorted(password_key(password) for password in ('Qwerty123', 'Abc12345678'))
+    with pytest.raises(ValueError):
+        write_blocklist(path, reversed(keys))
+
+    # Test case 4: Truncated files are refused
+    write_blocklist(path, [password_key('Password1')])
+    with open(path, 'r+b') as file:
+        file.truncate(os.path.getsize(path) - 1)
+    with pytest.raises(ValueError):
+        PasswordBlocklist(path)
@@ -0,0 +1,61 @@
+import asyncio
+import hashlib
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../", "src")))
+
+import pytest
+
+from app.hashing import PasswordHasher
+from app.hashing import PasswordHashingService
+
+
+@pytest.mark.parametrize('algorithm', ['scrypt', 'pbkdf2_sha256'])
+def test_PasswordHasher(algorithm):
+    hasher = PasswordHasher(algorithm=algorithm, scrypt_n=2 ** 10, pbkdf2_iterations=1000)
+
+    # Test case 1: Salted and self-describing
+    password_hash = hasher.hash('Abc12345678')
+    assert password_hash.startswith('$%s$' % algorithm)
+    assert password_hash != hasher.hash('Abc12345678')
+
+    # Test case 2: Verification
+    assert hasher.verify('Abc12345678', password_hash) is True
+    assert hasher.verify('Abc12345679', password_hash) is False
+    assert hasher.verify('Abc12345678', '$scrypt$broken') is False
+
+    # Test case 3: Up to date hashes do not need a rehash, stronger params do
+    assert hasher.needs_rehash(password_hash) is False
+    stronger = PasswordHasher(algorithm=algorithm, scrypt_n=2 ** 11, pbkdf2_iterations=2000)
+    assert stronger.needs_rehash(password_hash) is True
+    assert stronger.verify('Abc12345678', password_hash) is True
+
+
+def test_PasswordHasher_legacy_sha256():
+    hasher = PasswordHasher(scrypt_n=2 ** 10)
+    legacy_hash = hashlib.sha256(b'Abc12345678').hexdigest()
+    assert hasher.verify('Abc12345678', legacy_hash) is True
+    assert hasher.verify('Abc12345679', legacy_hash) is False
+    assert hasher.needs_rehash(legacy_hash) is True
+
+
+@pytest.mark.parametrize('kind', ['thread', 'process'])
+def test_PasswordHashingService(kind):
+    service = PasswordHashingService(PasswordHasher(scrypt_n=2 ** 10), workers=2, kind=kind)
+    try:
+        # Test case 1: Sync
+        password_hash = service.hash('Abc12345678')
+        assert service.verify('Abc12345678', password_hash) is True
+        assert len(service.hash_many(['Abc12345678', 'Xyz12345678'])) == 2
+
+        # Test case 2: Async
+        async def run():
+            password_hash = await service.async_hash('Abc12345678')
+            hashes = await service.async_hash_many(['Abc12345678', 'Xyz12345678'])
+            return await service.async_verify('Abc12345678', password_hash), hashes
+
+        verified, hashes = asyncio.run(run())
+        assert verified is True
+        assert service.verify('Xyz12345678', hashes[1]) is True
+    finally:
+        service.shutdown()
@@ -0,0 +1,75 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../", "src")))
+
+import pytest
+
+from app.lockout import LockoutStore
+from app.lockout import MemoryLockoutStore
+from app.lockout import SQLiteLockoutStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_store(request, tmp_path):
+    def factory(**kwargs):
+        if request.param == 'memory':
+            return MemoryLockoutStore(**kwargs)
+        return SQLiteLockoutStore(path=str(tmp_path.joinpath('lockout.db')), **kwargs)
+    return factory
+
+
+def test_lockout_store_counts_and_bans(make_store):
+    now = [1000.0]
+    store = make_store(penalty_number=3, penalty_period=60, ttl=60, clock=lambda: now[0])
+
+    # Test case 1: Unknown user
+    assert store.get('test_user') == (0, None)
+
+    # Test case 2: Failures below the penalty number
+    assert store.record_failure('test_user') == 1
+    assert store.record_failure('test_user') == 2
+    assert store.get('test_user') == (2, None)
+
+    # Test case 3: Reaching the penalty number bans the user
+    now[0] += 1
+    assert store.record_failure('test_user') == 3
+    assert store.get('test_user') == (3, 1001.0)
+    assert store.size() == 1
+
+    # Test case 4: Reset
+    store.reset('test_user')
+    assert store.get('test_user') == (0, None)
+
+
+def test_lockout_store_expiry_and_size_cap(make_store):
+    now = [1000.0]
+    store = make_store(penalty_number=3, penalty_period=10, ttl=30, max_entries=2, clock=lambda: now[0])
+
+    # Test case 1: Entries expire after the TTL and count from scratch again
+    store.record_failure('test_user')
+    store.record_failure('test_user')
+    now[0] += 30
+    assert store.get('test_user') == (0, None)
+    assert store.record_failure('test_user') == 1
+
+    # Test case 2: The oldest entries are evicted once the store is full
+    for name in ('user_a', 'user_b', 'user_c'):
+        now[0] += 1
+        store.record_failure(name)
+    if isinstance(store, SQLiteLockoutStore):
+        store.prune()
+    assert store.size() == 2
+    assert store.get('test_user') == (0, None)
+    assert store.get('user_c') == (1, None)
+
+
+def test_lockout_store_is_abstract():
+    class PartialStore(LockoutStore):
+        def get(self, name):
+            return 0, None
+
+    # Test case 1: A store must implement the whole interface
+    with pytest.raises(TypeError):
+        LockoutStore()
+    with pytest.raises(TypeError):
+        PartialStore()
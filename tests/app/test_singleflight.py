@@ -0,0 +1,154 @@
+import asyncio
+import os
+import sys
+import threading
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../", "src")))
+
+import pytest
+
+from app.singleflight import AsyncSingleFlight
+from app.singleflight import SingleFlight
+
+
+def test_single_flight_coalesces_threads():
+    flight = SingleFlight('test_threads')
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return 'result'
+
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.do('key', fetch)))
+    leader.start()
+    started.wait(5)
+    followers = [threading.Thread(target=lambda: results.append(flight.do('key', fetch))) for _ in range(4)]
+    for follower in followers:
+        follower.start()
+    # Test case 1: Followers wait for the leader instead of calling again
+    while flight.followers < 4:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in [leader] + followers:
+        thread.join(5)
+    assert results == ['result'] * 5
+    assert len(calls) == 1
+
+    # Test case 2: The key is forgotten once the result is ready
+    assert flight._calls == {}
+    assert flight.do('key', lambda: 'again') == 'again'
+
+    # Test case 3: Other keys are not coalesced
+    assert flight.do('other', lambda: 'other') == 'other'
+
+
+def test_single_flight_shares_errors():
+    flight = SingleFlight('test_errors')
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError('failed')
+
+    errors = []
+
+    def call():
+        try:
+            flight.do('key', fail)
+        except ValueError as e:
+            errors.append(str(e))
+
+    threads = [threading.Thread(target=call)]
+    threads[0].start()
+    started.wait(5)
+    threads.append(threading.Thread(target=call))
+    threads[1].start()
+    while flight.followers < 1:
+        threading.Event().wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+
+    # Test case 1: The follower gets the error of the leader
+    assert errors == ['failed', 'failed']
+    assert flight._calls == {}
+
+
+def test_single_flight_disabled():
+    flight = SingleFlight('test_disabled', enabled=False)
+    calls = []
+
+    # Test case 1: Every call runs
+    assert flight.do('key', lambda: calls.append(1) or len(calls)) == 1
+    assert flight.do('key', lambda: calls.append(1) or len(calls)) == 2
+    assert flight._calls == {}
+
+
+def test_async_single_flight_coalesces():
+    flight = AsyncSingleFlight('test_async')
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'result'
+
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise ValueError('failed')
+
+    async def run():
+        results = await asyncio.gather(*(flight.do('key', fetch) for _ in range(5)))
+        errors = await asyncio.gather(*(flight.do('error', fail) for _ in range(3)), return_exceptions=True)
+        return results, errors
+
+    results, errors = asyncio.run(run())
+
+    # Test case 1: One call serves all the callers
+    assert results == ['result'] * 5
+    assert len(calls) == 1
+
+    # Test case 2: Errors are shared
+    assert [str(error) for error in errors] == ['failed'] * 3
+
+    # Test case 3: The keys are forgotten
+    assert flight.stats() == {'in_flight': 0, 'leaders': 2, 'followers': 6}
+
+
+def test_async_single_flight_cancellation():
+    flight = AsyncSingleFlight('test_async_cancel')
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return len(calls)
+
+    async def run():
+        leader = asyncio.create_task(flight.do('key', fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flight.do('key', fetch))
+        cancelled_follower = asyncio.create_task(flight.do('key', fetch))
+        await asyncio.sleep(0.01)
+        cancelled_follower.cancel()
+        await asyncio.sleep(0)
+        # Test case 1: A cancelled follower leaves the leader running
+        assert not leader.done()
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        # Test case 2: The follower of a cancelled leader runs the call itself
+        result = await follower
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled_follower
+        return result
+
+    assert asyncio.run(run()) == 2
+    assert len(calls) == 2
+    assert flight._calls == {}
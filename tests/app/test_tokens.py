@@ -0,0 +1,56 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../", "src")))
+
+import pytest
+
+from app.tokens import create_token_signer
+from app.tokens import parse_token_keys
+from app.tokens import TokenSigner
+
+
+def test_TokenSigner():
+    now = [1000.0]
+    signer = TokenSigner([('k1', b'secret')], ttl=60, clock=lambda: now[0])
+    token = signer.issue(user_id=7, username='test_user')
+
+    # Test case 1: Valid token
+    assert token.startswith('k1.')
+    assert signer.verify(token) == (7, 'test_user', 1060)
+
+    # Test case 2: Tampered or malformed tokens
+    key_id, payload, signature = token.split('.')
+    other = TokenSigner([('k1', b'secret')], ttl=60, clock=lambda: now[0]).issue(user_id=8, username='test_user')
+    assert signer.verify('%s.%s.%s' % (key_id, other.split('.')[1], signature)) is None
+    assert signer.verify(token[:-1]) is None
+    assert signer.verify('k1.%s.é' % payload) is None
+    assert signer.verify('k1..%s' % signature) is None
+    assert signer.verify('') is None
+    assert signer.verify('garbage') is None
+
+    # Test case 3: Expired token
+    now[0] += 60
+    assert signer.verify(token) is None
+
+    # Test case 4: Rotation, tokens of the previous key stay valid, unknown keys are refused
+    now[0] = 1000.0
+    rotated = TokenSigner([('k2', b'new secret'), ('k1', b'secret')], ttl=60, clock=lambda: now[0])
+    assert rotated.verify(token) == (7, 'test_user', 1060)
+    assert rotated.issue(user_id=7, username='test_user').startswith('k2.')
+    assert TokenSigner([('k2', b'new secret')]).verify(token) is None
+    assert TokenSigner([('k1', b'another secret')]).verify(token) is None
+
+
+def test_parse_token_keys():
+    # Test case 1: Several keys, the first one signs
+    assert parse_token_keys('k2:new, k1:old') == [('k2', b'new'), ('k1', b'old')]
+    assert create_token_signer('k2:new,k1:old').signing_key_id == 'k2'
+
+    # Test case 2: Malformed keys
+    with pytest.raises(ValueError):
+        parse_token_keys('secret')
+    with pytest.raises(ValueError):
+        parse_token_keys('k.1:secret')
+
+    # Test case 3: A random key without configuration
+    assert create_token_signer('').signing_key_id == 'ephemeral'
@@ -1,16 +1,40 @@
-from datetime import datetime
+import asyncio
+import hashlib
 import os
 import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../", "src")))
 
+import orjson
+import pytest
+from sqlalchemy import create_engine
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from unittest.mock import AsyncMock
 from unittest.mock import Mock
 from unittest.mock import patch
+from models.user import ErrorCode
 from models.user import UserActionMessage
+from models.user import UserCreateItem
+from app.lockout import MemoryLockoutStore
+from app.tokens import token_signer
+from db.base import Base
+from db.user import rebuild_username_filter
+from db.user import refresh_username_filter
+from db.username_filter import UsernameFilter
+from db.username_filter import UsersMarker
+from app.user import async_create_user
+from app.user import async_verify_user
 from app.user import create_user
+from app.user import create_users
+from app.user import decode_cursor
+from app.user import encode_cursor
+from app.user import hash_password
+from app.user import list_users
 from app.user import PasswordValidator
+from app.user import stream_users
 from app.user import UserNameValidator
 from app.user import UserVerificationService
+from app.user import verify_user
 from settings import PASSWORD_MAX_LENGTH
 from settings import PASSWORD_MIN_LENGTH
 from settings import USER_PENALTY_NUMBER
@@ -33,6 +57,7 @@ def test_UserNameValidator():
     success, msg = validator.validate()
     assert success is False
     assert msg == f'The length of the user name is too short, should be at least {USERNAME_MIN_LENGTH} characters.'
+    assert validator.error_code is ErrorCode.USERNAME_LENGTH
 
     # Test case 3: Larger than the required length
     name = 'n' * 33
@@ -84,43 +109,140 @@ def test_PasswordValidator():
     success, msg = validator.validate()
     assert success is False
     assert msg == 'The number is missing, should be at least one.'
+    assert validator.error_code is ErrorCode.PASSWORD_DIGIT_MISSING
+
+    # Test case 7: Listed in the password blocklist
+    password = 'Password1'
+    with patch('app.user.password_blocklist', {'Password1'}):
+        validator = PasswordValidator(password=password)
+        success, msg = validator.validate()
+    assert success is False
+    assert msg == 'The password is too common, please choose another one.'
+    assert validator.error_code is ErrorCode.PASSWORD_BLOCKLISTED
 
 
-def test_UserVerificationService():
+def test_UserVerificationService(tmp_path):
     session_mock = Mock()
+    db_user = Mock(password_hash=hash_password('Abc12345678'))
 
     # Test case 1: Valid verification and no retry
-    session_mock.return_value = 'test_user'
-    svc = UserVerificationService('test_user', 'Abc12345678', session_mock)
-    success, msg = svc.verify()
-    assert success is True
-    assert msg == ''
-
-    # Test case 2: User does not exist
-    with patch('app.user.get_db_user', return_value=None):
+    with patch('app.user.get_db_user_credential', return_value=db_user) as get_db_user_mock:
         svc = UserVerificationService('test_user', 'Abc12345678', session_mock)
         success, msg = svc.verify()
-        assert success is False
-        assert msg == f'The username: test_user does not exist!'
+        assert success is True
+        assert msg == ''
+        assert get_db_user_mock.call_count == 1
 
-    # Test case 3: Over tries
-    with patch.dict('app.user.user_verify_cache', {'test_user': [5, datetime.now()]}):
+    # Test case 2: User does not exist, the password is never hashed
+    with patch('app.user.get_db_user_credential', return_value=None), patch('app.user.hashing_service') as hashing_mock:
         svc = UserVerificationService('test_user', 'Abc12345678', session_mock)
         success, msg = svc.verify()
         assert success is False
-        assert msg == 'Please try later.'
+        assert msg == f'The username: test_user does not exist!'
+        assert svc.error_code is ErrorCode.USER_NOT_FOUND
+        assert hashing_mock.mock_calls == []
+
+    # Test case 3: Users missing from the username filter never reach the database
+    marker = UsersMarker(str(tmp_path / 'users.marker'))
+    username_filter = UsernameFilter(enabled=True, min_capacity=100, marker=marker)
+    username_filter.rebuild(count=1, rows=[(1, 'test_user')], marker=marker.read())
+    with patch('app.user.username_filter', username_filter), patch('app.user.get_db_user_credential') as get_db_user_mock:
+        svc = UserVerificationService('unknown_user', 'Abc12345678', session_mock)
+        assert svc.verify() == (False, 'The username: unknown_user does not exist!')
+        get_db_user_mock.assert_not_called()
 
-    # Test case 4: The fifth try
-    with patch.dict('app.user.user_verify_cache', {'test_user': [4, None]}):
-        with patch('app.user.get_db_user', return_value=None):
+    # Test case 4: Over tries, the password is never hashed
+    store = MemoryLockoutStore()
+    for _ in range(USER_PENALTY_NUMBER):
+        store.record_failure('test_user')
+    with patch('app.user.lockout_store', store):
+        with patch('app.user.get_db_user_credential', return_value=db_user), patch('app.user.hashing_service') as hashing_mock:
             svc = UserVerificationService('test_user', 'Abc12345678', session_mock)
-            success, msg = svc._check_user_password()
+            success, msg = svc.verify()
+            assert success is False
+            assert msg == 'Please try later.'
+            assert svc.error_code is ErrorCode.USER_LOCKED
+            assert hashing_mock.mock_calls == []
+
+    # Test case 5: The fifth try
+    store = MemoryLockoutStore()
+    for _ in range(USER_PENALTY_NUMBER - 1):
+        store.record_failure('test_user')
+    with patch('app.user.lockout_store', store):
+        with patch('app.user.get_db_user_credential', return_value=db_user):
+            svc = UserVerificationService('test_user', 'Wrong12345678', session_mock)
+            success, msg = svc.verify()
             assert success is False
             assert msg == (f'You have entered wrong password for over {USER_PENALTY_NUMBER} time. '
                            f'Please retry after {USER_PENALTY_PERIOD} seconds.')
+            assert svc.error_code is ErrorCode.USER_LOCKED_OUT
+            success, msg = svc.verify()
+            assert msg == 'Please try later.'
+
+    # Test case 6: The ban is lifted after the penalty period
+    now = [1000.0]
+    store = MemoryLockoutStore(clock=lambda: now[0])
+    for _ in range(USER_PENALTY_NUMBER):
+        store.record_failure('test_user')
+    now[0] += USER_PENALTY_PERIOD
+    with patch('app.user.lockout_store', store), patch('app.user.get_db_user_credential', return_value=db_user):
+        svc = UserVerificationService('test_user', 'Abc12345678', session_mock)
+        success, msg = svc.verify()
+        assert success is True
+        assert store.get('test_user') == (0, None)
+
+    # Test case 7: A legacy SHA-256 hash is upgraded on a successful login
+    legacy_user = Mock(id=1, password_hash=hashlib.sha256(b'Abc12345678').hexdigest())
+    with patch('app.user.get_db_user_credential', return_value=legacy_user), \
+            patch('app.user.update_db_user_password_hash') as update_mock:
+        svc = UserVerificationService('test_user', 'Abc12345678', session_mock)
+        success, msg = svc.verify()
+        assert success is True
+        password_hash = update_mock.call_args.kwargs['password_hash']
+        assert password_hash.startswith('$scrypt$')
+        assert update_mock.call_args.kwargs['name'] == 'test_user'
+
+    # Test case 8: An up-to-date hash is left alone
+    with patch('app.user.get_db_user_credential', return_value=db_user), \
+            patch('app.user.update_db_user_password_hash') as update_mock:
+        svc = UserVerificationService('test_user', 'Abc12345678', session_mock)
+        assert svc.verify() == (True, '')
+        update_mock.assert_not_called()
+
 
+def test_verify_user_across_workers(tmp_path):
+    engine = create_engine('sqlite:///%s' % tmp_path.joinpath('test.db'))
+    Base.metadata.create_all(engine)
+    # The filters of two workers, sharing the marker file as the workers of a host do
+    first, second = (
+        UsernameFilter(enabled=True, min_capacity=100, marker=UsersMarker(str(tmp_path / 'users.marker')))
+        for _ in range(2)
+    )
+    with sessionmaker(bind=engine)() as session:
+        for username_filter in (first, second):
+            with patch('db.user.username_filter', username_filter):
+                rebuild_username_filter(session)
 
-def test_create_user():
+        # Test case 1: Created through the first worker, verified through the second before it refreshed
+        with patch('db.user.username_filter', first):
+            assert create_user('worker_user', 'Abc12345678', session).success is True
+        with patch('db.user.username_filter', second), patch('app.user.username_filter', second):
+            response = verify_user('worker_user', 'Abc12345678', session)
+            assert response.success is True
+
+            # Test case 2: Once refreshed, names nobody created skip the database again
+            refresh_username_filter(session)
+            with patch('app.user.get_db_user_credential') as get_db_user_mock:
+                response = verify_user('unknown_user', 'Abc12345678', session)
+                assert response.reason == 'The username: unknown_user does not exist!'
+                get_db_user_mock.assert_not_called()
+
+        # Test case 3: The first worker's own creation kept its filter current
+        assert first.current is True
+    engine.dispose()
+
+
+def test_create_user(caplog):
 
     # Mock session
     session_mock = Mock()
@@ -149,12 +271,21 @@ def test_create_user():
     assert isinstance(response, UserActionMessage)
     assert response.success is False
     assert response.reason == 'The username: [duplicated_user] has been created already, please change another one.'
+    assert response.code is ErrorCode.USERNAME_DUPLICATED
+    # The statement parameters of the error, the password hash among them, stay out of the logs
+    session_mock.add.side_effect = IntegrityError('INSERT INTO users', params=('duplicated_user', '$scrypt$hash'), orig=None)
+    with caplog.at_level('WARNING', logger='app.user'):
+        create_user('duplicated_user', 'Abc12345678', session_mock)
+    assert 'Failed to create the user duplicated_user, the username is taken: IntegrityError' in caplog.messages
+    assert '$scrypt$' not in caplog.text
+    session_mock.add.side_effect = None
 
     # Test case 5: Password is less than the required length
     response = create_user('test_user', 'Aa', session_mock)
     assert isinstance(response, UserActionMessage)
     assert response.success is False
     assert response.reason == f'The length of the password is too short, should be at least {PASSWORD_MIN_LENGTH} characters.'
+    assert response.code is ErrorCode.PASSWORD_LENGTH
 
     # Test case 6: Larger than the required length
     password = 'Abc123' + 'n' * 30
@@ -183,3 +314,100 @@ def test_create_user():
     assert isinstance(response, UserActionMessage)
     assert response.success is False
     assert response.reason == 'The number is missing, should be at least one.'
+
+
+def test_create_users():
+    session_mock = Mock()
+    users = [
+        UserCreateItem(username='test_user', password='Abc12345678'),
+        UserCreateItem(username='in', password='Abc12345678'),
+        UserCreateItem(username='test_user', password='Abc12345678'),
+        UserCreateItem(username='existing_user', password='Abc12345678'),
+    ]
+
+    with patch('app.user.create_db_users', return_value={'test_user'}) as create_db_users_mock:
+        responses = create_users(users, session_mock)
+        rows = create_db_users_mock.call_args.args[0]
+        assert [name for name, _ in rows] == ['test_user', 'existing_user']
+
+    # Test case 1: Created
+    assert responses[0] == UserActionMessage(success=True, reason='')
+    # Test case 2: Invalid username
+    assert responses[1].success is False
+    assert responses[1].reason == f'The length of the user name is too short, should be at least {USERNAME_MIN_LENGTH} characters.'
+    # Test case 3: Duplicated inside the batch
+    assert responses[2].reason == 'The username: [test_user] has been created already, please change another one.'
+    # Test case 4: Duplicated in the database
+    assert responses[3].reason == 'The username: [existing_user] has been created already, please change another one.'
+
+
+def test_async_user_path():
+    session_mock = AsyncMock()
+    session_mock.add = Mock()
+
+    # Test case 1: Valid username and successful user creation
+    response = asyncio.run(async_create_user('test_user', 'Abc12345678', session_mock))
+    assert response.success is True
+    assert response.reason == ''
+
+    # Test case 2: Validation failures never reach the database
+    session_mock.reset_mock()
+    response = asyncio.run(async_create_user('in', 'Abc12345678', session_mock))
+    assert response.success is False
+    assert response.reason == f'The length of the user name is too short, should be at least {USERNAME_MIN_LENGTH} characters.'
+    session_mock.commit.assert_not_called()
+
+    # Test case 3: Duplicated username
+    session_mock.commit.side_effect = IntegrityError("Duplicate username", params=None, orig=None)
+    response = asyncio.run(async_create_user('duplicated_user', 'Abc12345678', session_mock))
+    assert response.success is False
+    assert response.reason == 'The username: [duplicated_user] has been created already, please change another one.'
+    assert response.code is ErrorCode.USERNAME_DUPLICATED
+
+    # Test case 4: Valid verification
+    db_user = Mock(id=1, password_hash=hash_password('Abc12345678'))
+    with patch('app.user.async_get_db_user_credential', AsyncMock(return_value=db_user)):
+        response = asyncio.run(async_verify_user('test_user', 'Abc12345678', session_mock))
+        assert response.success is True
+        assert response.reason == ''
+        claims = token_signer.verify(response.token)
+        assert (claims.user_id, claims.username) == (1, 'test_user')
+
+    # Test case 5: User does not exist
+    with patch('app.user.async_get_db_user_credential', AsyncMock(return_value=None)):
+        response = asyncio.run(async_verify_user('test_user', 'Abc12345678', session_mock))
+        assert response.success is False
+        assert response.reason == 'The username: test_user does not exist!'
+
+
+def test_list_users():
+    rows = [(i, 'user_%02d' % i) for i in range(7)]
+
+    def list_db_users(session, limit, after=None, prefix=None, order_by='name'):
+        return [row for row in rows if after is None or row[1] > after][:limit]
+
+    with patch('app.user.list_db_users', list_db_users):
+        # Test case 1: A page and the cursor of the next one
+        page = list_users(Mock(), 3)
+        assert page['users'] == [{'id': i, 'username': 'user_%02d' % i} for i in range(3)]
+        assert decode_cursor(page['next_cursor'], 'name') == 'user_02'
+
+        # Test case 2: No cursor after the last page, even a full one
+        assert list_users(Mock(), 4, after='user_02')['next_cursor'] is None
+
+        # Test case 3: Streamed in chunks, the cursor comes last
+        lines = b''.join(stream_users(Mock(), 5, chunk_size=2)).splitlines()
+        assert [orjson.loads(line) for line in lines[:5]] == [{'id': i, 'username': 'user_%02d' % i} for i in range(5)]
+        assert decode_cursor(orjson.loads(lines[5])['next_cursor'], 'name') == 'user_04'
+        assert orjson.loads(b''.join(stream_users(Mock(), 10, chunk_size=3)).splitlines()[-1]) == {'next_cursor': None}
+
+
+def test_cursor():
+    # Test case 1: Round trip
+    assert decode_cursor(encode_cursor('id', (42, 'name')), 'id') == 42
+    assert decode_cursor(None, 'name') is None
+
+    # Test case 2: Invalid or of another order
+    for cursor, order_by in ((encode_cursor('id', (42, 'name')), 'name'), ('garbage', 'name'), ('e30', 'id')):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor, order_by)
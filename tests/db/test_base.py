@@ -0,0 +1,65 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../", "src")))
+
+from sqlalchemy import text
+
+import metrics
+
+from db.base import _export_pool_metrics
+from db.base import build_engine
+from db.base import TimedQueuePool
+
+
+def test_build_engine(tmp_path):
+    # Test case 1: SQLite pragmas are applied on connect
+    engine = build_engine('sqlite:///%s' % tmp_path.joinpath('test.db'))
+    with engine.connect() as connection:
+        assert connection.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+        assert connection.execute(text('PRAGMA busy_timeout')).scalar() == 5000
+    engine.dispose()
+
+    # Test case 2: Pragmas can be overridden
+    engine = build_engine('sqlite:///%s' % tmp_path.joinpath('other.db'), pragmas={'journal_mode': 'DELETE'})
+    with engine.connect() as connection:
+        assert connection.execute(text('PRAGMA journal_mode')).scalar() == 'delete'
+    engine.dispose()
+
+    # Test case 3: In-memory databases keep the dialect defaults
+    engine = build_engine('sqlite://')
+    assert not isinstance(engine.pool, TimedQueuePool)
+
+
+def test_pool_stats(tmp_path):
+    engine = build_engine('sqlite:///%s' % tmp_path.joinpath('test.db'))
+    with engine.connect():
+        with engine.connect():
+            stats = engine.pool.snapshot()
+            assert stats['checked_out'] == 2
+    stats = engine.pool.snapshot()
+    assert stats['checked_out'] == 0
+    assert stats['checked_in'] == 2
+    assert stats['checkouts'] == 2
+    assert stats['timeouts'] == 0
+    assert stats['wait_seconds_total'] >= stats['wait_seconds_max'] > 0
+    engine.dispose()
+
+
+def test_pool_metrics(tmp_path):
+    engine = build_engine('sqlite:///%s' % tmp_path.joinpath('test.db'))
+    _export_pool_metrics('test', engine)
+
+    # Test case 1: Checkouts and the time waited for them are exported
+    with engine.connect():
+        text = metrics.render()
+        assert 'db_pool_connections{engine="test",state="checked_out"} 1.0' in text
+        assert 'db_pool_checkouts_total{engine="test",outcome="ok"} 1.0' in text
+        assert 'db_pool_checkouts_total{engine="test",outcome="timeout"} 0.0' in text
+        assert 'db_pool_wait_seconds_total{engine="test"}' in text
+        assert 'db_pool_wait_seconds_max{engine="test"}' in text
+
+    # Test case 2: The pool replacing a disposed one is reported
+    engine.dispose()
+    with engine.connect(), engine.connect():
+        assert 'db_pool_checkouts_total{engine="test",outcome="ok"} 2.0' in metrics.render()
+    engine.dispose()
@@ -0,0 +1,64 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../", "src")))
+
+import metrics
+from db.cache import credential_cache
+from db.cache import LRUCache
+
+
+def test_LRUCache():
+    now = [0.0]
+    cache = LRUCache(max_size=2, ttl=10, clock=lambda: now[0])
+
+    # Test case 1: Hits and misses
+    assert cache.get('user_a') is None
+    cache.set('user_a', 1)
+    assert cache.get('user_a') == 1
+
+    # Test case 2: The least recently used entry is evicted
+    cache.set('user_b', 2)
+    cache.get('user_a')
+    cache.set('user_c', 3)
+    assert cache.get('user_b') is None
+    assert cache.get('user_a') == 1
+
+    # Test case 3: Entries expire
+    now[0] += 10
+    assert cache.get('user_c') is None
+
+    # Test case 4: Invalidation
+    cache.set('user_d', 4)
+    cache.invalidate('user_d')
+    assert cache.get('user_d') is None
+
+    assert cache.stats() == {
+        'size': 1,
+        'max_size': 2,
+        'hits': 3,
+        'misses': 4,
+        'hit_rate': 3 / 7,
+        'evictions': 1,
+        'expirations': 1,
+    }
+
+    # Test case 5: Disabled
+    cache = LRUCache(max_size=0, ttl=10)
+    cache.set('user_a', 1)
+    assert cache.get('user_a') is None
+
+
+def test_credential_cache_metrics():
+    credential_cache.clear()
+    before = credential_cache.stats()
+
+    # Test case 1: The lookups are exported as counters
+    credential_cache.set('cached_user', 1)
+    credential_cache.get('cached_user')
+    credential_cache.get('missing_user')
+    text = metrics.render()
+    assert 'credential_cache_events_total{event="hit"} %r' % float(before['hits'] + 1) in text
+    assert 'credential_cache_events_total{event="miss"} %r' % float(before['misses'] + 1) in text
+    assert 'credential_cache_events_total{event="eviction"} %r' % float(before['evictions']) in text
+    assert 'credential_cache_events_total{event="expiration"} %r' % float(before['expirations']) in text
+    credential_cache.clear()
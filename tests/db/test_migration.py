@@ -0,0 +1,26 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../", "src")))
+
+from sqlalchemy import create_engine
+from sqlalchemy import inspect
+
+from db.migration import current_revision
+from db.migration import head_revision
+from db.migration import migrate_db_schema
+
+
+def test_migrate_db_schema(tmp_path):
+    engine = create_engine('sqlite:///%s' % tmp_path.joinpath('test.db'))
+    lock_path = str(tmp_path.joinpath('migration.lock'))
+
+    # Test case 1: Empty database
+    assert current_revision(engine) is None
+    assert migrate_db_schema(engine, lock_path=lock_path) is True
+    assert current_revision(engine) == head_revision()
+    assert {'users', 'audit_events'} <= set(inspect(engine).get_table_names())
+
+    # Test case 2: Up to date, nothing runs
+    assert migrate_db_schema(engine, lock_path=lock_path) is False
+    assert migrate_db_schema(engine, lock_path=None) is False
+    engine.dispose()
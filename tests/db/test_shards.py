@@ -0,0 +1,144 @@
+import asyncio
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../", "src")))
+
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from db.base import Base
+from db.cache import LRUCache
+from db.shards import AsyncShardedSession
+from db.shards import shard_for
+from db.shards import shard_id_range
+from db.shards import shard_urls
+from db.shards import ShardedSession
+from db.user import async_create_db_user
+from db.user import create_db_user
+from db.user import create_db_users
+from db.user import DBUser
+from db.user import get_db_user_credential
+from db.user import list_db_users
+from db.user import rebuild_username_filter
+from db.user import refresh_username_filter
+from db.username_filter import UsernameFilter
+from db.utils import LazySession
+
+
+@pytest.fixture
+def engines(tmp_path):
+    engines = [create_engine(url) for url in shard_urls('sqlite:///%s' % tmp_path.joinpath('test.db'), 3)]
+    for engine in engines:
+        Base.metadata.create_all(engine)
+    yield engines
+    for engine in engines:
+        engine.dispose()
+
+
+def _names(engine) -> set[str]:
+    with engine.connect() as connection:
+        return set(connection.scalars(select(DBUser.name)))
+
+
+def test_shard_for():
+    names = ['user_%d' % i for i in range(2000)]
+
+    # Test case 1: Stable and spread over every shard
+    assert [shard_for(name, 4) for name in names] == [shard_for(name, 4) for name in names]
+    assert {shard_for(name, 4) for name in names} == {0, 1, 2, 3}
+    assert {shard_for(name, 1) for name in names} == {0}
+
+    # Test case 2: Adding a shard only moves names to the new one
+    moved = [shard_for(name, 5) for name in names if shard_for(name, 5) != shard_for(name, 4)]
+    assert moved and set(moved) == {4}
+
+
+def test_shard_urls():
+    # Test case 1: One shard is the database itself
+    assert shard_urls('sqlite:///seano.db', 1) == ['sqlite:///seano.db']
+
+    # Test case 2: The shard number goes before the suffix
+    assert shard_urls('sqlite+aiosqlite:////data/seano.db', 2) == [
+        'sqlite+aiosqlite:////data/seano.0.db', 'sqlite+aiosqlite:////data/seano.1.db',
+    ]
+
+    # Test case 3: Only SQLite files can be sharded
+    with pytest.raises(ValueError):
+        shard_urls('sqlite://', 2)
+    with pytest.raises(ValueError):
+        shard_urls('postgresql://db/users', 2)
+
+
+def test_sharded_create_and_get(engines):
+    with patch('db.user.credential_cache', LRUCache(max_size=0, ttl=0)), \
+            ShardedSession([sessionmaker(bind=engine) for engine in engines]) as session:
+        # Test case 1: Users are written to the shard of their name, with ids from its range
+        db_user = create_db_user('alice', 'hash_alice', session=LazySession(lambda: session))
+        shard = shard_for('alice', 3)
+        assert _names(engines[shard]) == {'alice'}
+        assert shard_id_range(shard)[0] < db_user.id < shard_id_range(shard)[1]
+
+        # Test case 2: Bulk inserts are split by shard
+        users = [('user_%d' % i, 'hash_%d' % i) for i in range(30)]
+        assert create_db_users(users, session=session, chunk_size=4) == {name for name, _ in users}
+        for index, engine in enumerate(engines):
+            expected = {name for name, _ in users if shard_for(name, 3) == index}
+            assert _names(engine) - {'alice'} == expected
+
+        # Test case 3: Lookups go to the shard of the name
+        credential = get_db_user_credential('user_7', session=session)
+        assert credential.password_hash == 'hash_7'
+        assert shard_for('user_7', 3) == credential.id >> 40
+        assert get_db_user_credential('nobody', session=session) is None
+
+        # Test case 4: Listings merge the shards in order
+        names = sorted(['alice'] + [name for name, _ in users])
+        assert [name for _, name in list_db_users(session, 10)] == names[:10]
+        assert [name for _, name in list_db_users(session, 100, after=names[9])] == names[10:]
+        ids = [user_id for user_id, _ in list_db_users(session, 100, order_by='id')]
+        assert ids == sorted(ids) and len(ids) == 31
+
+
+def test_async_sharded_create(tmp_path):
+    async def run():
+        engines = [create_async_engine(url) for url in shard_urls('sqlite+aiosqlite:///%s' % tmp_path.joinpath('a.db'), 2)]
+        for engine in engines:
+            async with engine.begin() as connection:
+                await connection.run_sync(Base.metadata.create_all)
+        factories = [async_sessionmaker(bind=engine, expire_on_commit=False) for engine in engines]
+        async with AsyncShardedSession(factories) as session:
+            first = await async_create_db_user('alice', 'hash', session=session)
+            second = await async_create_db_user('bob', 'hash', session=session)
+        for engine in engines:
+            await engine.dispose()
+        return first.id, second.id
+
+    # Test case 1: Every shard allocates ids from its own range
+    first, second = asyncio.run(run())
+    assert first >> 40 == shard_for('alice', 2)
+    assert second >> 40 == shard_for('bob', 2)
+
+
+def test_sharded_username_filter(engines):
+    username_filter = UsernameFilter(enabled=True, fp_rate=0.01, min_capacity=100)
+    other = ShardedSession([sessionmaker(bind=engine) for engine in engines])
+    with patch('db.user.username_filter', username_filter), patch('db.user._shard_last_ids', {}), \
+            ShardedSession([sessionmaker(bind=engine) for engine in engines]) as session:
+        create_db_users([('user_%d' % i, 'hash') for i in range(10)], session=other)
+
+        # Test case 1: The rebuild reads every shard
+        rebuild_username_filter(session)
+        assert all(username_filter.might_contain('user_%d' % i) for i in range(10))
+
+        # Test case 2: Users created by another worker are picked up from every shard
+        with patch('db.user.username_filter', UsernameFilter(enabled=False)):
+            create_db_users([('late_%d' % i, 'hash') for i in range(10)], session=other)
+        refresh_username_filter(session)
+        assert all(username_filter.might_contain('late_%d' % i) for i in range(10))
+    other.close()
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../", "src")))
+
+from unittest.mock import patch
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+from db.base import Base
+from db.cache import LRUCache
+from db.user import async_create_db_users
+from db.user import create_db_user
+from db.user import create_db_users
+from db.user import DBUser
+from db.user import get_db_user_credential
+from db.user import list_db_users
+from db.user import rebuild_username_filter
+from db.user import refresh_username_filter
+from db.user import update_db_user_password_hash
+from db.username_filter import UsernameFilter
+from db.username_filter import UsersMarker
+
+
+@pytest.fixture
+def session(tmp_path):
+    engine = create_engine('sqlite:///%s' % tmp_path.joinpath('test.db'))
+    Base.metadata.create_all(engine)
+    with sessionmaker(bind=engine)() as session:
+        yield session
+    engine.dispose()
+
+
+def test_create_db_users(session):
+    # Test case 1: All rows are inserted across several chunks
+    users = [('user_%s' % i, 'hash_%s' % i) for i in range(7)]
+    created = create_db_users(users, session=session, chunk_size=3)
+    assert created == {name for name, _ in users}
+
+    # Test case 2: Existing names are skipped without aborting the batch
+    created = create_db_users([('user_0', 'hash'), ('user_7', 'hash_7')], session=session, chunk_size=3)
+    assert created == {'user_7'}
+
+    # Test case 3: A conflict inside the chunk falls back to one row at a time
+    created = create_db_users([('user_8', 'hash_8'), ('user_8', 'other'), ('user_9', 'hash_9')], session=session)
+    assert created == {'user_8', 'user_9'}
+    assert session.scalars(select(DBUser.password_hash).where(DBUser.name == 'user_8')).one() == 'hash_8'
+    assert len(session.scalars(select(DBUser)).all()) == 10
+
+
+def test_async_create_db_users(tmp_path):
+    async def run():
+        engine = create_async_engine('sqlite+aiosqlite:///%s' % tmp_path.joinpath('test.db'))
+        async with engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+        async with async_sessionmaker(bind=engine)() as session:
+            first = await async_create_db_users([('user_0', 'hash'), ('user_1', 'hash')], session=session)
+            second = await async_create_db_users([('user_1', 'hash'), ('user_2', 'hash')], session=session)
+        await engine.dispose()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == {'user_0', 'user_1'}
+    assert second == {'user_2'}
+
+
+def test_username_filter(session, tmp_path):
+    marker = UsersMarker(str(tmp_path / 'users.marker'))
+    username_filter = UsernameFilter(enabled=True, min_capacity=100, marker=marker)
+    with patch('db.user.username_filter', username_filter):
+        create_db_users([('user_0', 'hash'), ('user_1', 'hash')], session=session)
+
+        # Test case 1: Built from the table
+        rebuild_username_filter(session)
+        assert username_filter.might_contain('user_0') is True
+        assert username_filter.might_contain('user_2') is False
+
+        # Test case 2: Users created by this process are added right away
+        create_db_user('user_2', 'hash', session=session)
+        assert username_filter.might_contain('user_2') is True
+
+        # Test case 3: Users created by another worker may exist until a refresh picks them up
+        session.add(DBUser(name='user_3', password_hash='hash'))
+        session.commit()
+        UsersMarker(marker.path).bump()
+        assert username_filter.might_contain('user_3') is True
+        assert username_filter.might_contain('user_4') is True
+        refresh_username_filter(session)
+        assert username_filter.might_contain('user_3') is True
+        assert username_filter.might_contain('user_4') is False
+
+
+def test_get_db_user_credential(session):
+    credential_cache = LRUCache(max_size=10, ttl=60)
+    with patch('db.user.credential_cache', credential_cache):
+        create_db_user('user_0', 'hash', session=session)
+
+        # Test case 1: Unknown users are not cached
+        assert get_db_user_credential('user_1', session=session) is None
+        assert len(credential_cache) == 0
+
+        # Test case 2: Loaded once, then served from the cache
+        credential = get_db_user_credential('user_0', session=session)
+        assert credential.name == 'user_0'
+        assert credential.password_hash == 'hash'
+        with patch.object(session, 'execute') as execute_mock:
+            assert get_db_user_credential('user_0', session=session) == credential
+            execute_mock.assert_not_called()
+
+        # Test case 3: Invalidated by a password change
+        update_db_user_password_hash('user_0', 'new_hash', session=session)
+        assert get_db_user_credential('user_0', session=session).password_hash == 'new_hash'
+        assert credential_cache.stats()['hits'] == 1
+
+
+def test_list_db_users(session):
+    names = ['bob', 'jack', 'jane', 'jaz', 'j\U0010ffff', 'zed']
+    session.execute(DBUser.__table__.insert(), [{'name': name, 'password_hash': 'hash'} for name in reversed(names)])
+    session.commit()
+
+    # Test case 1: Pages follow each other by name
+    assert list_db_users(session, 2) == [(6, 'bob'), (5, 'jack')]
+    assert list_db_users(session, 2, after='jack') == [(4, 'jane'), (3, 'jaz')]
+    assert list_db_users(session, 10, after='zed') == []
+
+    # Test case 2: Or by id
+    assert list_db_users(session, 2, after=4, order_by='id') == [(5, 'jack'), (6, 'bob')]
+
+    # Test case 3: Prefix search, including the last code point
+    assert [name for _, name in list_db_users(session, 10, prefix='ja')] == ['jack', 'jane', 'jaz']
+    assert [name for _, name in list_db_users(session, 10, prefix='j', after='jane')] == ['jaz', 'j\U0010ffff']
+    assert [name for _, name in list_db_users(session, 10, prefix='j\U0010ffff')] == ['j\U0010ffff']
+
+    # Test case 4: The prefix is a range scan of the name index
+    plan = session.execute(text('EXPLAIN QUERY PLAN SELECT id, name FROM users WHERE name >= :a AND name < :b'), {
+        'a': 'ja', 'b': 'jb',
+    }).all()
+    assert 'ix_users_name' in plan[0][-1]
@@ -0,0 +1,110 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../", "src")))
+
+from unittest.mock import patch
+
+import metrics
+from db.username_filter import BloomFilter
+from db.username_filter import UsernameFilter
+from db.username_filter import UsersMarker
+
+
+def test_BloomFilter():
+    bloom = BloomFilter(capacity=10000, fp_rate=0.01)
+    names = ['user_%s' % i for i in range(10000)]
+    for name in names:
+        bloom.add(name)
+
+    # Test case 1: No false negatives
+    assert all(name in bloom for name in names)
+
+    # Test case 2: The false positive rate stays around the configured one
+    false_positives = sum('other_%s' % i in bloom for i in range(10000))
+    assert false_positives < 10000 * 0.02
+    assert 0.005 < bloom.estimated_fp_rate() < 0.02
+    assert bloom.memory_bytes < 10000 * 2
+
+
+def test_UsersMarker(tmp_path):
+    marker = UsersMarker(str(tmp_path / 'users.marker'))
+    other = UsersMarker(str(tmp_path / 'users.marker'))
+
+    # Test case 1: Every process mapping the file sees a bump
+    value = marker.read()
+    previous, new = other.bump()
+    assert previous == value
+    assert marker.read() == new != value
+
+    # Test case 2: Without a path it never holds a value
+    assert UsersMarker('').read() is None
+    assert UsersMarker('').bump() == (None, None)
+
+
+def test_UsernameFilter(tmp_path):
+    marker = UsersMarker(str(tmp_path / 'users.marker'))
+    username_filter = UsernameFilter(enabled=True, fp_rate=0.01, min_capacity=100, marker=marker)
+
+    # Test case 1: Every name may exist until the filter is built
+    assert username_filter.might_contain('test_user') is True
+    username_filter.add('test_user')
+    assert username_filter.stats()['ready'] is False
+
+    # Test case 2: Built from the table rows
+    username_filter.rebuild(count=2, rows=[(1, 'user_a'), (5, 'user_b')], marker=marker.read())
+    assert username_filter.might_contain('user_a') is True
+    assert username_filter.might_contain('test_user') is False
+    assert username_filter.last_id == 5
+
+    # Test case 3: Names added while building are kept
+    def rows():
+        yield 6, 'user_c'
+        username_filter.add('user_d')
+
+    username_filter.rebuild(count=1, rows=rows(), marker=marker.read())
+    assert username_filter.might_contain('user_d') is True
+    # The marker changed after it was read, the next sync makes the filter current again
+    assert username_filter.current is False
+    username_filter.extend([], marker=marker.read())
+
+    # Test case 4: Names added here keep the filter current
+    username_filter.add('user_e')
+    assert username_filter.current is True
+    assert username_filter.might_contain('other_user') is False
+
+    # Test case 5: A miss is no longer trusted once another process wrote users
+    UsersMarker(marker.path).bump()
+    assert username_filter.current is False
+    assert username_filter.might_contain('user_f') is True
+
+    # Test case 6: Until extended with their rows
+    version = marker.read()
+    username_filter.extend([(7, 'user_f')], marker=version)
+    assert username_filter.might_contain('user_f') is True
+    assert username_filter.might_contain('other_user') is False
+    assert username_filter.last_id == 7
+
+    stats = username_filter.stats()
+    assert stats['checks'] == 7
+    assert stats['misses'] == 3
+    assert stats['stale_misses'] == 1
+    assert stats['memory_bytes'] > 0
+
+    # Test case 7: Disabled
+    disabled = UsernameFilter(enabled=False, marker=marker)
+    disabled.rebuild(count=1, rows=[(1, 'user_a')], marker=marker.read())
+    assert disabled.might_contain('test_user') is True
+
+    # Test case 8: Without a marker no miss is trusted
+    unmarked = UsernameFilter(enabled=True, min_capacity=100, marker=UsersMarker(''))
+    unmarked.rebuild(count=1, rows=[(1, 'user_a')], marker=None)
+    assert unmarked.might_contain('test_user') is True
+
+    # Test case 9: The fill and the lookups are exported
+    with patch('db.username_filter.username_filter', username_filter):
+        text = metrics.render()
+    assert 'username_filter_bytes %r' % float(stats['memory_bytes']) in text
+    assert 'username_filter_estimated_fp_rate %r' % stats['estimated_fp_rate'] in text
+    assert 'username_filter_checks_total{result="skipped"} 3.0' in text
+    assert 'username_filter_checks_total{result="stale"} 1.0' in text
+    assert 'username_filter_checks_total{result="found"} 3.0' in text
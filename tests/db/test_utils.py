@@ -0,0 +1,99 @@
+import asyncio
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../", "src")))
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import sessionmaker
+from unittest.mock import AsyncMock
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from db import utils
+from db.base import Base
+from db.base import build_engine
+from db.user import DBUser
+from db.utils import get_async_db
+from db.utils import get_db
+from db.utils import LazySession
+
+
+def test_LazySession():
+    session_mock = Mock()
+    factory = Mock(return_value=session_mock)
+    session = LazySession(factory=factory)
+
+    # Test case 1: Nothing is created until a query
+    session.rollback()
+    session.close()
+    assert not session.started
+    factory.assert_not_called()
+
+    # Test case 2: The session is created once, on first use
+    session.execute('SELECT 1')
+    session.commit()
+    assert session.started
+    assert factory.call_count == 1
+    session_mock.execute.assert_called_once_with('SELECT 1')
+    session.close()
+    session_mock.close.assert_called_once_with()
+
+
+def test_get_db():
+    session_mock = Mock()
+
+    # Test case 1: Errors are rolled back and raised again
+    with patch.object(utils, 'session_local', return_value=session_mock):
+        dependency = get_db()
+        next(dependency).execute('SELECT 1')
+        with pytest.raises(ValueError):
+            dependency.throw(ValueError('boom'))
+    session_mock.rollback.assert_called_once_with()
+    session_mock.close.assert_called_once_with()
+
+    # Test case 2: HTTP errors go through untouched
+    dependency = get_db()
+    next(dependency)
+    with pytest.raises(HTTPException):
+        dependency.throw(HTTPException(status_code=400))
+
+
+def test_get_db_hides_parameters(tmp_path, caplog):
+    engine = build_engine('sqlite:///%s' % tmp_path.joinpath('test.db'))
+    Base.metadata.create_all(engine)
+
+    # Test case 1: The password hash of a failed insert stays out of the logs
+    with patch.object(utils, 'session_local', sessionmaker(bind=engine)), caplog.at_level('ERROR', logger='db.utils'):
+        for password_hash in ('$scrypt$first_hash', '$scrypt$second_hash'):
+            dependency = get_db()
+            session = next(dependency)
+            session.add(DBUser(name='duplicated_user', password_hash=password_hash))
+            try:
+                session.commit()
+            except IntegrityError as e:
+                with pytest.raises(IntegrityError):
+                    dependency.throw(e)
+            else:
+                dependency.close()
+    assert caplog.messages == ['Rolling back the session: IntegrityError']
+    assert '$scrypt$' not in caplog.text
+    engine.dispose()
+
+
+def test_get_async_db():
+    session_mock = AsyncMock()
+
+    async def run():
+        dependency = get_async_db()
+        session = await dependency.__anext__()
+        await session.execute('SELECT 1')
+        with pytest.raises(ValueError):
+            await dependency.athrow(ValueError('boom'))
+
+    # Test case 1: Errors are rolled back and raised again
+    with patch.object(utils, 'async_session_local', Mock(return_value=session_mock)):
+        asyncio.run(run())
+    session_mock.rollback.assert_awaited_once_with()
+    session_mock.close.assert_awaited_once_with()
@@ -0,0 +1,96 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../", "src")))
+
+from fastapi.responses import JSONResponse
+from pydantic import ValidationError
+import pytest
+
+from models.user import constraint_violation
+from models.user import ErrorCode
+from models.user import missing_password_class
+from models.user import UserActionMessage
+from models.user import UserCreate
+from models.user import UserCreateItem
+from settings import PASSWORD_MIN_LENGTH
+from settings import USERNAME_MAX_LENGTH
+
+
+def test_UserActionMessage_as_json():
+    messages = [
+        UserActionMessage(success=True, reason=''),
+        UserActionMessage(success=False, reason='Please try later.', code=ErrorCode.USER_LOCKED),
+        UserActionMessage(
+            success=False, code=ErrorCode.USERNAME_DUPLICATED,
+            reason='The username: [Jäson "\\\n\t\x01 \U0001f600] has been created already, please change another one.',
+        ),
+        UserActionMessage(success=False, reason='The username: </script> does not exist!', code=ErrorCode.USER_NOT_FOUND),
+    ]
+
+    # Test case 1: The bodies are the bytes JSONResponse renders
+    for message in messages:
+        assert message.as_json() == JSONResponse(content=message.as_dict()).body
+
+    # Test case 2: Fixed messages are encoded once
+    assert messages[1].as_json() is UserActionMessage(
+        success=False, reason='Please try later.', code=ErrorCode.USER_LOCKED,
+    ).as_json()
+
+    # Test case 3: The code is not part of the body
+    assert 'code' not in messages[1].model_dump()
+
+    # Test case 4: Tokens are only part of the body when set
+    message = UserActionMessage(success=True, reason='', token='key.payload.signature')
+    assert message.as_json() == b'{"success":true,"reason":"","token":"key.payload.signature"}'
+
+
+def test_missing_password_class():
+    # Test case 1: All the classes
+    assert missing_password_class('Abc12345678') is None
+    assert missing_password_class('\u00e9\u00c9\u0663') is None
+
+    # Test case 2: The first class missing, in the order of the reasons
+    assert missing_password_class('12345678') is ErrorCode.PASSWORD_LOWERCASE_MISSING
+    assert missing_password_class('abcdefgh1') is ErrorCode.PASSWORD_UPPERCASE_MISSING
+    assert missing_password_class('Abcdefgh!') is ErrorCode.PASSWORD_DIGIT_MISSING
+
+
+def test_UserCreate():
+    def violation(username: str, password: str):
+        with pytest.raises(ValidationError) as info:
+            UserCreate(username=username, password=password)
+        return constraint_violation(info.value.errors()[0])
+
+    # Test case 1: Valid user
+    assert UserCreate(username='test_user', password='Abc12345678').username == 'test_user'
+
+    # Test case 2: Lengths, the username first
+    assert violation('in', 'Aa') == (
+        ErrorCode.USERNAME_LENGTH,
+        'The length of the user name is too short, should be at least 3 characters.',
+    )
+    assert violation('n' * 33, 'Abc12345678') == (
+        ErrorCode.USERNAME_LENGTH,
+        'The length of the user name is too long, should be at most %s characters.' % USERNAME_MAX_LENGTH,
+    )
+    assert violation('test_user', 'Aa') == (
+        ErrorCode.PASSWORD_LENGTH,
+        'The length of the password is too short, should be at least %s characters.' % PASSWORD_MIN_LENGTH,
+    )
+
+    # Test case 3: Character classes
+    assert violation('test_user', 'ABCDEFGH123') == (
+        ErrorCode.PASSWORD_LOWERCASE_MISSING, 'The lowercase is missing, should be at least one.',
+    )
+    assert violation('test_user', 'Abcdefgh') == (
+        ErrorCode.PASSWORD_DIGIT_MISSING, 'The number is missing, should be at least one.',
+    )
+
+    # Test case 4: Other errors are not rule violations
+    assert violation('test_user', None) is None
+    with pytest.raises(ValidationError) as info:
+        UserCreate(username='test_user')
+    assert constraint_violation(info.value.errors()[0]) is None
+
+    # Test case 5: Bulk items are not constrained
+    assert UserCreateItem(username='in', password='Aa').username == 'in'
@@ -0,0 +1,68 @@
+import asyncio
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../", "src")))
+
+from fastapi import FastAPI
+from fastapi.exceptions import RequestValidationError
+import httpx
+import orjson
+from unittest.mock import AsyncMock
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from models.user import UserActionMessage
+from routers.user import router
+from routers.user import validation_exception_handler
+
+
+def _post(url: str, payload) -> httpx.Response:
+    app = FastAPI()
+    app.include_router(router)
+    app.add_exception_handler(RequestValidationError, validation_exception_handler)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            return await client.post(url, json=payload)
+
+    return asyncio.run(run())
+
+
+def test_create_user_validation():
+    created = UserActionMessage(success=True, reason='')
+    with patch('routers.user.user_app.create_user', Mock(return_value=created)) as create_mock, \
+            patch('routers.user.user_app.async_create_user', AsyncMock(return_value=created)) as async_create_mock, \
+            patch('routers.user.audit_log') as audit_mock:
+        # Test case 1: A valid user reaches the handler, which only has the blocklist left to check
+        response = _post('/users/create_user/', {'username': 'test_user', 'password': 'Abc12345678'})
+        assert response.status_code == 201
+        mock = create_mock if create_mock.called else async_create_mock
+        assert mock.call_args.kwargs['validated'] is True
+        create_mock.reset_mock()
+        async_create_mock.reset_mock()
+
+        # Test case 2: Rule violations get the 400 and reason of validate_user without reaching the handler
+        response = _post('/users/create_user/', {'username': 'test_user', 'password': 'abcdefgh123'})
+        assert response.status_code == 400
+        assert orjson.loads(response.content) == {
+            'success': False, 'reason': 'The uppercase is missing, should be at least one.',
+        }
+        assert not create_mock.called and not async_create_mock.called
+        audit_mock.record.assert_called_once_with('create', 'test_user', False, 'password_uppercase_missing')
+
+        # Test case 3: Other malformed requests keep the 422
+        response = _post('/users/create_user/', {'username': 'test_user'})
+        assert response.status_code == 422
+
+
+def test_create_users_validation():
+    # Test case 1: An invalid user of a batch gets its own result, the others go on
+    with patch('app.user.create_db_users', return_value={'test_user'}), \
+            patch('app.user.async_create_db_users', AsyncMock(return_value={'test_user'})):
+        response = _post('/users/create_users/', [
+            {'username': 'test_user', 'password': 'Abc12345678'},
+            {'username': 'in', 'password': 'Abc12345678'},
+        ])
+    assert response.status_code == 200
+    assert [result['success'] for result in orjson.loads(response.content)] == [True, False]
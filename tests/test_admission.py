@@ -0,0 +1,169 @@
+import asyncio
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../", "src")))
+
+from fastapi import FastAPI
+from fastapi.responses import Response
+import httpx
+import orjson
+import pytest
+
+from admission import AdmissionMiddleware
+from admission import AdmissionQueue
+from admission import AIMDLimit
+
+
+def test_aimd_limit():
+    limit = AIMDLimit(latency_target=0.5, initial=10, min_limit=2, max_limit=11)
+
+    # Test case 1: Requests within the target grow a used limit by one per `limit` requests
+    for _ in range(10):
+        limit.update(started=0, latency=0.1, in_flight=10, failed=False)
+    assert limit.value == 10
+    limit.update(started=0, latency=0.1, in_flight=10, failed=False)
+    assert limit.value == 11
+
+    # Test case 2: An idle limit does not grow, and never past max_limit
+    for _ in range(100):
+        limit.update(started=0, latency=0.1, in_flight=1, failed=False)
+        limit.update(started=0, latency=0.1, in_flight=11, failed=False)
+    assert limit.limit == 11
+
+    # Test case 3: A slow request cuts the limit once for the requests in flight with it
+    limit.update(started=1, latency=1, in_flight=11, failed=False)
+    assert limit.limit == 11 * 0.9
+    limit.update(started=1.5, latency=1, in_flight=11, failed=False)
+    assert limit.limit == 11 * 0.9
+
+    # Test case 4: Failures cut it as well, down to min_limit
+    for started in range(2, 100):
+        limit.update(started=started, latency=0.1, in_flight=1, failed=True)
+    assert limit.value == 2
+
+
+def test_admission_queue():
+    queue = AdmissionQueue('test', AIMDLimit(latency_target=10, max_limit=1), queue_size=1, queue_timeout=0.05)
+
+    async def run():
+        # Test case 1: Admitted while under the limit
+        assert await queue.acquire()
+
+        # Test case 2: Queued, then turned away once the queue is full
+        waiter = asyncio.create_task(queue.acquire())
+        await asyncio.sleep(0)
+        assert not await queue.acquire()
+        assert queue.stats()['queued'] == 1
+
+        # Test case 3: A release hands the slot over to the waiter
+        queue.release(queue.clock())
+        assert await waiter
+        assert queue.in_flight == 1
+
+        # Test case 4: Waiting past the queue timeout
+        assert not await queue.acquire()
+        queue.release(queue.clock())
+
+        # Test case 5: A cancelled waiter leaves the queue
+        assert await queue.acquire()
+        waiter = asyncio.create_task(queue.acquire())
+        await asyncio.sleep(0)
+        assert queue.stats()['queued'] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert queue.stats()['queued'] == 0
+        queue.release(queue.clock())
+
+    asyncio.run(run())
+    assert queue.stats() == {
+        'limit': 1, 'in_flight': 0, 'queued': 0, 'admitted': 3, 'rejected': 1, 'timed_out': 1,
+    }
+
+
+def test_admission_priority():
+    verify = AdmissionQueue('verify', AIMDLimit(latency_target=10, max_limit=1), queue_timeout=1)
+    create = AdmissionQueue('create', AIMDLimit(latency_target=10, max_limit=1), queue_timeout=1, higher=verify)
+
+    async def run():
+        assert await verify.acquire()
+        verify_waiter = asyncio.create_task(verify.acquire())
+        await asyncio.sleep(0)
+
+        # Test case 1: A lower class waits while a higher one has a backlog
+        create_waiter = asyncio.create_task(create.acquire())
+        await asyncio.sleep(0.01)
+        assert create.stats()['queued'] == 1
+
+        # Test case 2: It is admitted once the higher class has no waiters left
+        verify.release(verify.clock())
+        assert await verify_waiter
+        assert await create_waiter
+        assert create.in_flight == 1
+
+    asyncio.run(run())
+
+
+def test_admission_priority_timeout():
+    verify = AdmissionQueue('verify', AIMDLimit(latency_target=10, max_limit=1), queue_timeout=0.05)
+    create = AdmissionQueue('create', AIMDLimit(latency_target=10, max_limit=1), queue_timeout=1, higher=verify)
+
+    async def run():
+        assert await verify.acquire()
+        verify_waiter = asyncio.create_task(verify.acquire())
+        await asyncio.sleep(0)
+        create_waiter = asyncio.create_task(create.acquire())
+        await asyncio.sleep(0)
+
+        # Test case 1: A timed out verification no longer holds back the creations
+        assert not await verify_waiter
+        await asyncio.wait_for(create_waiter, 0.1)
+        assert create_waiter.result()
+        assert create.in_flight == 1
+        assert verify.in_flight == 1
+
+    asyncio.run(run())
+
+
+def test_admission_middleware():
+    release = asyncio.Event()
+    app = FastAPI()
+
+    @app.post('/users/create_user/')
+    async def create_user():
+        await release.wait()
+        return Response(status_code=201)
+
+    @app.post('/users/verify_user/')
+    async def verify_user():
+        return Response(status_code=200)
+
+    queues = {
+        'create': AdmissionQueue('create', AIMDLimit(latency_target=10, initial=1), queue_size=0),
+        'verify': AdmissionQueue('verify', AIMDLimit(latency_target=10, initial=1), queue_size=0),
+    }
+    app.add_middleware(AdmissionMiddleware, queues=queues, retry_after=3)
+
+    async def run():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+            admitted = asyncio.create_task(client.post('/users/create_user/'))
+            while queues['create'].in_flight == 0:
+                await asyncio.sleep(0)
+
+            # Test case 1: Over the limit of its class, a request is turned away with a 503
+            response = await client.post('/users/create_user/')
+            assert response.status_code == 503
+            assert response.headers['retry-after'] == '3'
+            assert orjson.loads(response.content) == {
+                'success': False, 'reason': 'The server is overloaded, please retry later!',
+            }
+
+            # Test case 2: Verifications have a limit of their own
+            assert (await client.post('/users/verify_user/')).status_code == 200
+
+            release.set()
+            assert (await admitted).status_code == 201
+        assert queues['create'].in_flight == 0
+
+    asyncio.run(run())
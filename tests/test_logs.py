@@ -0,0 +1,105 @@
+import io
+import logging
+import os
+import queue
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../", "src")))
+
+import orjson
+
+from logs import LazyQueueHandler
+from logs import LogPipeline
+from logs import RateLimitFilter
+
+
+def _record(msg: str, *args, level: int = logging.WARNING) -> logging.LogRecord:
+    return logging.LogRecord('app.user', level, __file__, 1, msg, args, None)
+
+
+def test_rate_limit_filter():
+    now = [1000.0]
+    rate_limit = RateLimitFilter(burst=2, interval=60, sample_rate=0, clock=lambda: now[0])
+
+    # Test case 1: A burst of each template passes, whatever the arguments
+    assert rate_limit.filter(_record('Rejected the username %s: %s', 'a', 'too short'))
+    assert rate_limit.filter(_record('Rejected the username %s: %s', 'b', 'too short'))
+    assert not rate_limit.filter(_record('Rejected the username %s: %s', 'c', 'too short'))
+    assert not rate_limit.filter(_record('Rejected the username %s: %s', 'd', 'too short'))
+    assert rate_limit.suppressed == 2
+
+    # Test case 2: Other templates and errors are counted on their own
+    assert rate_limit.filter(_record('Locked out the user %s for %s seconds.', 'a', 60))
+    assert rate_limit.filter(_record('Failed: %s', 'e', level=logging.ERROR))
+
+    # Test case 3: The next record let through tells how many were suppressed
+    now[0] += 60
+    record = _record('Rejected the username %s: %s', 'e', 'too short')
+    assert rate_limit.filter(record)
+    assert record.suppressed == 2
+    record = _record('Rejected the username %s: %s', 'f', 'too short')
+    assert rate_limit.filter(record)
+    assert not hasattr(record, 'suppressed')
+
+    # Test case 4: Sampled past the burst
+    sampled = RateLimitFilter(burst=0, interval=60, sample_rate=1, clock=lambda: now[0])
+    assert sampled.filter(_record('Rejected a password: %s', 'too short'))
+
+
+def test_lazy_queue_handler():
+    formatted = []
+
+    class Name:
+        def __str__(self):
+            formatted.append(1)
+            return 'test_user'
+
+    records = queue.SimpleQueue()
+    handler = LazyQueueHandler(records, max_size=1)
+    logger = logging.getLogger('test_lazy_queue_handler')
+    logger.propagate = False
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+
+    # Test case 1: Records under the level are never formatted
+    logger.debug('Start to validate the username: %s', Name())
+    assert records.empty()
+
+    # Test case 2: Queued records are formatted by the reader only
+    logger.info('Start to validate the username: %s', Name())
+    assert formatted == []
+    assert records.get_nowait().getMessage() == 'Start to validate the username: test_user'
+    assert formatted == [1]
+
+    # Test case 3: Dropped without blocking while the queue is full
+    logger.info('first')
+    logger.info('second')
+    assert records.get_nowait().getMessage() == 'first'
+    assert records.empty()
+    logger.removeHandler(handler)
+
+
+def test_log_pipeline():
+    stream = io.StringIO()
+    pipeline = LogPipeline(level='INFO', stream=stream, rate_limit=RateLimitFilter(burst=1, sample_rate=0))
+    logger = logging.getLogger('test_log_pipeline')
+    pipeline.start()
+    try:
+        logger.warning('Rejected the username %s: %s', 'ab', 'too short')
+        logger.warning('Rejected the username %s: %s', 'cd', 'too short')
+        try:
+            raise ValueError('failed')
+        except ValueError:
+            logger.exception('Rolling back the session: %s', 'failed')
+    finally:
+        pipeline.stop()
+    lines = [orjson.loads(line) for line in stream.getvalue().splitlines()]
+
+    # Test case 1: One JSON object per record, written once stopped
+    assert [(line['level'], line['logger'], line['message']) for line in lines] == [
+        ('WARNING', 'test_log_pipeline', 'Rejected the username ab: too short'),
+        ('ERROR', 'test_log_pipeline', 'Rolling back the session: failed'),
+    ]
+    assert 'ValueError: failed' in lines[1]['exc_info']
+
+    # Test case 2: Stopped, the root logger no longer has the handler
+    assert not any(isinstance(handler, LazyQueueHandler) for handler in logging.getLogger().handlers)
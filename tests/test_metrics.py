@@ -0,0 +1,79 @@
+import os
+import subprocess
+import sys
+import threading
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../", "src")))
+
+import orjson
+
+import metrics
+
+
+def test_metrics():
+    counter = metrics.Counter('test_events_total', 'Events.', ('kind',))
+    histogram = metrics.Histogram('test_latency_seconds', 'Latency.', buckets=(0.1, 1.0))
+
+    # Test case 1: Increments of several threads add up
+    threads = [threading.Thread(target=lambda: [counter.labels('a').inc() for _ in range(1000)]) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counter.labels('a').collect() == [4000.0]
+
+    # Test case 2: Histogram buckets are cumulative when rendered
+    for value in (0.05, 0.5, 5.0):
+        histogram.observe(value)
+    text = metrics.render()
+    assert 'test_events_total{kind="a"} 4000.0' in text
+    assert 'test_latency_seconds_bucket{le="0.1"} 1.0' in text
+    assert 'test_latency_seconds_bucket{le="1.0"} 2.0' in text
+    assert 'test_latency_seconds_bucket{le="+Inf"} 3.0' in text
+    assert 'test_latency_seconds_count 3.0' in text
+
+
+def test_metrics_of_workers(tmp_path, monkeypatch):
+    counter = metrics.Counter('test_worker_events_total', 'Events.')
+    gauge = metrics.Gauge('test_worker_in_flight', 'In flight.')
+    counter.inc(2)
+    gauge.inc()
+    monkeypatch.setattr(metrics, 'METRICS_DIR', str(tmp_path))
+
+    # Test case 1: Counters of other workers are added, gauges of exited workers dropped
+    exited = subprocess.Popen([sys.executable, '-c', 'pass'])
+    exited.wait()
+    for pid in (os.getppid(), exited.pid):
+        (tmp_path / ('metrics-%d.json' % pid)).write_bytes(orjson.dumps({
+            'test_worker_events_total': [[[], [3.0]]],
+            'test_worker_in_flight': [[[], [1.0]]],
+        }))
+    text = metrics.render()
+    assert 'test_worker_events_total 8.0' in text
+    assert 'test_worker_in_flight 2.0' in text
+
+    # Test case 2: A worker reads back its own snapshot
+    metrics.write_snapshot(str(tmp_path))
+    snapshot = metrics._read_snapshot(str(tmp_path / ('metrics-%d.json' % os.getpid())))
+    assert snapshot['test_worker_events_total'][()] == [2.0]
+
+
+def test_metrics_reset_after_fork():
+    counter = metrics.Counter('test_fork_events_total', 'Events.')
+    histogram = metrics.Histogram('test_fork_latency_seconds', 'Latency.', buckets=(0.1,))
+    counter.inc(5)
+    histogram.observe(0.05)
+
+    # Test case 1: A forked child starts from zero, the parent keeps its values
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        counter.inc()
+        os.write(write_fd, orjson.dumps([counter.labels().collect(), histogram.labels().collect()]))
+        os._exit(0)
+    os.close(write_fd)
+    with os.fdopen(read_fd, 'rb') as pipe:
+        child_values = orjson.loads(pipe.read())
+    os.waitpid(pid, 0)
+    assert child_values == [[1.0], [0.0, 0.0, 0.0, 0.0]]
+    assert counter.labels().collect() == [5.0]
+    assert histogram.labels().collect() == [1.0, 0.0, 0.05, 1.0]
@@ -0,0 +1,102 @@
+from concurrent.futures import ThreadPoolExecutor
+import cProfile
+import os
+import pstats
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../", "src")))
+
+from fastapi import HTTPException
+import pytest
+
+import profiling
+from profiling import profile_label
+from profiling import ProfileStore
+from profiling import ProfilingMiddleware
+import routers.profiling
+from routers.profiling import check_profiling_token
+
+
+def test_ProfileStore(tmp_path):
+    store = ProfileStore(directory=str(tmp_path), max_files=2)
+
+    # Test case 1: Only the newest profiles are kept
+    names = [store.save(cProfile.Profile(), 'POST /users/verify_user/') for _ in range(3)]
+    assert store.names() == names[:0:-1]
+    assert names[0].endswith('-POST_users_verify_user.prof')
+
+    # Test case 2: Names outside the store are rejected
+    assert store.path(names[2]) == os.path.join(str(tmp_path), names[2])
+    assert store.path(names[0]) is None
+    assert store.path('../%s' % names[2]) is None
+
+
+def test_profiled(tmp_path, monkeypatch):
+    store = ProfileStore(directory=str(tmp_path), max_files=10)
+    monkeypatch.setattr(profiling, 'profile_store', store)
+    monkeypatch.setattr(profiling, 'PROFILING_ENABLED', True)
+    handler = profiling.profiled(lambda: 'done')
+
+    # Test case 1: Requests which were not selected are not profiled
+    assert handler() == 'done'
+    assert store.names() == []
+
+    # Test case 2: Selected requests are
+    token = profile_label.set('GET /')
+    try:
+        assert handler() == 'done'
+    finally:
+        profile_label.reset(token)
+    assert len(store.names()) == 1
+
+    # Test case 3: Work handed to other threads is part of the profile
+    def offloaded_work():
+        return sum(range(1000))
+
+    def offloading_handler():
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            return executor.submit(profiling.profile_offloaded(offloaded_work)).result()
+
+    assert profiling.profile_offloaded(offloaded_work) is offloaded_work
+    token = profile_label.set('GET /offloaded')
+    try:
+        assert profiling.profiled(offloading_handler)() == 499500
+    finally:
+        profile_label.reset(token)
+    stats = pstats.Stats(store.path(store.names()[0]))
+    assert any(function == 'offloaded_work' for _, _, function in stats.stats)
+
+    # Test case 4: The handler itself is used when profiling is off
+    monkeypatch.setattr(profiling, 'PROFILING_ENABLED', False)
+    function = lambda: 'done'  # noqa: E731
+    assert profiling.profiled(function) is function
+
+
+def test_ProfilingMiddleware():
+    middleware = ProfilingMiddleware(app=None, header='X-Profile', token='secret', sample_rate=0)
+
+    # Test case 1: The header triggers a profile with the right token only
+    assert middleware._selected({'headers': [(b'x-profile', b'secret')]})
+    assert not middleware._selected({'headers': [(b'x-profile', b'wrong')]})
+    assert not middleware._selected({'headers': []})
+
+    # Test case 2: Sampling
+    middleware.sample_rate = 1
+    assert middleware._selected({'headers': []})
+
+    # Test case 3: Never installed without a token
+    with pytest.raises(ValueError):
+        ProfilingMiddleware(app=None, header='X-Profile', token='')
+
+
+def test_check_profiling_token(monkeypatch):
+    monkeypatch.setattr(routers.profiling, 'PROFILING_TOKEN', 'secret')
+
+    # Test case 1: The token reads the profiles
+    check_profiling_token('secret')
+    with pytest.raises(HTTPException):
+        check_profiling_token('wrong')
+
+    # Test case 2: Without a token nobody does
+    monkeypatch.setattr(routers.profiling, 'PROFILING_TOKEN', '')
+    with pytest.raises(HTTPException):
+        check_profiling_token('anything')
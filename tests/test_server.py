@@ -0,0 +1,206 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from typing import Optional
+SRC_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), "../", "src"))
+sys.path.insert(0, SRC_PATH)
+
+from unittest.mock import mock_open
+from unittest.mock import patch
+
+import httpx
+import pytest
+
+import server
+from server import available_cpus
+
+
+def test_available_cpus():
+    with patch('os.sched_getaffinity', return_value={0, 1, 2, 3}):
+        # Test case 1: No CPU quota
+        with patch('builtins.open', mock_open(read_data='max 100000\n')):
+            assert available_cpus() == 4
+
+        # Test case 2: The quota of a container, rounded up
+        with patch('builtins.open', mock_open(read_data='150000 100000\n')):
+            assert available_cpus() == 2
+
+        # Test case 3: No cgroup v2
+        with patch('builtins.open', side_effect=FileNotFoundError):
+            assert available_cpus() == 4
+
+    # Test case 4: Never less than one
+    with patch('os.sched_getaffinity', return_value={0}), patch('builtins.open', mock_open(read_data='10000 100000')):
+        assert available_cpus() == 1
+
+
+def test_lockout_backend_of_workers():
+    # Test case 1: Several workers share the lockout counters by default
+    for workers, backend in ((None, 'sqlite'), ('4', 'sqlite'), ('1', 'memory')):
+        env = {key: value for key, value in os.environ.items() if key not in ('SERVER_WORKERS', 'LOCKOUT_BACKEND')}
+        if workers is not None:
+            env['SERVER_WORKERS'] = workers
+        output = subprocess.run(
+            [sys.executable, '-c', 'import settings; print(settings.LOCKOUT_BACKEND)'],
+            cwd=SRC_PATH, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+        assert output.strip() == backend
+
+    # Test case 2: Per-worker counters are warned about
+    with patch.object(server, 'PreforkServer'), patch.object(server, 'SERVER_WORKERS', 4), \
+            patch.object(server, 'LOCKOUT_BACKEND', 'memory'), patch.object(server.logger, 'warning') as warning_mock:
+        server.main()
+    assert 'LOCKOUT_BACKEND=memory' in warning_mock.call_args.args[0]
+
+
+APP = '''
+import asyncio
+import os
+
+VERSION = %r
+
+
+async def app(scope, receive, send):
+    if scope['path'] == '/slow':
+        await asyncio.sleep(1)
+    body = '%%s %%d' %% (VERSION, os.getpid())
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'text/plain')]})
+    await send({'type': 'http.response.body', 'body': body.encode()})
+'''
+
+RUNNER = '''
+import os
+import sys
+sys.path.insert(0, %r)
+
+import uvicorn
+
+from server import PreforkServer
+
+config = uvicorn.Config(
+    'test_app:app', host='127.0.0.1', port=int(os.environ['TEST_PORT']), lifespan='off', timeout_graceful_shutdown=1,
+)
+PreforkServer(config, workers=2).run()
+'''
+
+
+def _children(pid: int) -> set[int]:
+    """Pids of the live child processes of `pid`."""
+    children = set()
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open('/proc/%s/stat' % entry) as stat:
+                state, ppid = stat.read().rsplit(')', 1)[1].split()[:2]
+        except OSError:
+            continue
+        if int(ppid) == pid and state != 'Z':
+            children.add(int(entry))
+    return children
+
+
+def _wait_for(condition, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.05)
+    raise AssertionError('Timed out')
+
+
+def _get(port: int, path: str = '/') -> Optional[str]:
+    try:
+        return httpx.get('http://127.0.0.1:%d%s' % (port, path), timeout=5).text
+    except httpx.HTTPError:
+        return None
+
+
+@pytest.fixture
+def prefork_server(tmp_path):
+    """Start server.py's parent with two workers of a trivial app, return its process and port."""
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    tmp_path.joinpath('test_app.py').write_text(APP % 'v1')
+    tmp_path.joinpath('runner.py').write_text(RUNNER % SRC_PATH)
+    env = dict(
+        os.environ, TEST_PORT=str(port), SERVER_GRACEFUL_TIMEOUT='1', METRICS_ENABLED='0', AUDIT_BACKEND='',
+    )
+    with open(tmp_path.joinpath('server.log'), 'w') as log:
+        process = subprocess.Popen([sys.executable, 'runner.py'], cwd=tmp_path, env=env, stdout=log, stderr=log)
+    try:
+        _wait_for(lambda: len(_children(process.pid)) == 2 and _get(port))
+        yield process, port
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def test_prefork_server_respawns_workers(prefork_server):
+    process, port = prefork_server
+    workers = _children(process.pid)
+
+    # Test case 1: A worker which crashed is replaced
+    crashed = workers.pop()
+    os.kill(crashed, signal.SIGKILL)
+    _wait_for(lambda: len(_children(process.pid) - {crashed}) == 2)
+    assert workers < _children(process.pid)
+    assert _get(port).startswith('v1 ')
+
+
+def test_prefork_server_reexec(prefork_server, tmp_path):
+    process, port = prefork_server
+    workers = _children(process.pid)
+    failures = []
+    stop = threading.Event()
+
+    def client():
+        while not stop.is_set():
+            if _get(port) is None:
+                failures.append(1)
+
+    thread = threading.Thread(target=client)
+    thread.start()
+    try:
+        # Test case 1: SIGHUP deploys new code, a new worker at a time, in the same parent
+        tmp_path.joinpath('test_app.py').write_text(APP % 'v2')
+        os.kill(process.pid, signal.SIGHUP)
+        _wait_for(lambda: not _children(process.pid) & workers and len(_children(process.pid)) == 2)
+    finally:
+        stop.set()
+        thread.join()
+    assert process.poll() is None
+    assert _get(port).startswith('v2 ')
+    assert failures == []
+
+    # Test case 2: Code which fails to load is not deployed
+    workers = _children(process.pid)
+    tmp_path.joinpath('test_app.py').write_text('VERSION = (')
+    os.kill(process.pid, signal.SIGHUP)
+    _wait_for(lambda: 'The new code failed to load' in tmp_path.joinpath('server.log').read_text())
+    assert _children(process.pid) == workers
+    assert _get(port).startswith('v2 ')
+
+
+def test_prefork_server_graceful_shutdown(prefork_server):
+    process, port = prefork_server
+    workers = _children(process.pid)
+    responses = []
+    thread = threading.Thread(target=lambda: responses.append(_get(port, '/slow')))
+    thread.start()
+    time.sleep(0.3)
+
+    # Test case 1: SIGTERM lets the in-flight requests finish, then stops the workers and the parent
+    os.kill(process.pid, signal.SIGTERM)
+    thread.join()
+    assert responses[0].startswith('v1 ')
+    assert process.wait(timeout=10) == 0
+    assert not any(os.path.exists('/proc/%d' % pid) for pid in workers)
+    assert _get(port) is None
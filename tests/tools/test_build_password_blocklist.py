@@ -0,0 +1,34 @@
+import hashlib
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../", "src")))
+
+from app.blocklist import PasswordBlocklist
+from tools.build_password_blocklist import build
+
+
+def test_build(tmp_path):
+    passwords = ['Password%d' % i for i in range(100)]
+    plain = tmp_path.joinpath('passwords.txt')
+    plain.write_text('\n'.join(passwords[:60]) + '\n\n')
+    hashes = tmp_path.joinpath('hashes.txt')
+    hashes.write_text(''.join(
+        '%s:%d\r\n' % (hashlib.sha1(password.encode()).hexdigest().upper(), i) for i, password in enumerate(passwords)
+    ))
+    output = str(tmp_path.joinpath('blocklist.bin'))
+
+    # Test case 1: Plain lists, sorted in several runs
+    assert build([str(plain), str(plain)], output, run_size=7) == 60
+    blocklist = PasswordBlocklist(output)
+    assert all(password in blocklist for password in passwords[:60])
+    assert not any(password in blocklist for password in passwords[60:])
+    blocklist.close()
+
+    # Test case 2: SHA-1 lists, skipping rare hashes
+    assert build([str(hashes)], output, file_format='sha1', min_count=50, prefix_size=4) == 50
+    blocklist = PasswordBlocklist(output)
+    assert blocklist.prefix_size == 4
+    assert all(password in blocklist for password in passwords[50:])
+    assert 'Password49' not in blocklist
+    blocklist.close()
+    assert sorted(os.listdir(tmp_path)) == ['blocklist.bin', 'hashes.txt', 'passwords.txt']
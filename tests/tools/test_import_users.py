@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import io
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../", "src")))
+
+from sqlalchemy import create_engine
+from sqlalchemy import select
+from sqlalchemy.orm import sessionmaker
+
+from db.base import Base
+from db.user import DBUser
+from tools.import_users import read_users
+from tools.import_users import UserImporter
+
+
+def test_read_users(tmp_path):
+    # Test case 1: CSV
+    path = tmp_path.joinpath('users.csv')
+    path.write_text('username,password\nJason,Jason1234\nAlice\n')
+    assert list(read_users(str(path), 'csv')) == [(2, 'Jason', 'Jason1234'), (3, None, None)]
+
+    # Test case 2: NDJSON with a malformed line
+    path = tmp_path.joinpath('users.ndjson')
+    path.write_text('{"username": "Jason", "password": "Jason1234"}\n\nnot json\n{"username": 1, "password": "x"}\n')
+    assert list(read_users(str(path), 'ndjson')) == [(1, 'Jason', 'Jason1234'), (3, None, None), (4, None, None)]
+
+
+def test_user_importer(tmp_path):
+    engine = create_engine('sqlite:///%s' % tmp_path.joinpath('test.db'))
+    Base.metadata.create_all(engine)
+    rows = [
+        (2, 'Jason', 'Jason1234'),
+        (3, 'in', 'Jason1234'),
+        (4, 'Jason', 'Jason1234'),
+        (5, None, None),
+        (6, 'Alice', 'Alice1234'),
+        (7, 'Bobby', 'Bobby1234'),
+    ]
+    rejects_file = io.StringIO()
+    with sessionmaker(bind=engine)() as session, ThreadPoolExecutor(max_workers=2) as executor:
+        importer = UserImporter(session, csv.writer(rejects_file), executor, batch_size=2, workers=2)
+        stats = importer.run(rows)
+        assert session.scalars(select(DBUser.name).order_by(DBUser.name)).all() == ['Alice', 'Bobby', 'Jason']
+
+    assert (stats.rows, stats.created, stats.rejected) == (6, 3, 3)
+    rejects = list(csv.reader(io.StringIO(rejects_file.getvalue())))
+    assert [line for line, _, _ in rejects] == ['3', '5', '4']
+    assert rejects[2][2] == 'The username: [Jason] has been created already, please change another one.'
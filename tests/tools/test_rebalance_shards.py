@@ -0,0 +1,46 @@
+import os
+import sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../../", "src")))
+
+from sqlalchemy import create_engine
+from sqlalchemy import select
+
+from db.migration import migrate_db_schema
+from db.shards import shard_for
+from db.shards import shard_urls
+from db.user import DBUser
+from tools.rebalance_shards import rebalance
+
+
+def _users(url: str) -> dict[str, int]:
+    engine = create_engine(url)
+    with engine.connect() as connection:
+        users = dict(connection.execute(select(DBUser.name, DBUser.id)).all())
+    engine.dispose()
+    return users
+
+
+def test_rebalance(tmp_path):
+    url = 'sqlite:///%s' % tmp_path.joinpath('test.db')
+    engine = create_engine(url)
+    migrate_db_schema(engine, lock_path=None)
+    names = ['user_%d' % i for i in range(50)]
+    with engine.begin() as connection:
+        connection.execute(DBUser.__table__.insert(), [{'name': name, 'password_hash': 'hash'} for name in names])
+    engine.dispose()
+
+    # Test case 1: From the unsharded database to 3 shards
+    assert rebalance(1, 3, url=url, batch_size=7) == 50
+    assert _users(url) == {}
+    for shard, shard_url in enumerate(shard_urls(url, 3)):
+        users = _users(shard_url)
+        assert set(users) == {name for name in names if shard_for(name, 3) == shard}
+        assert all(user_id >> 40 == shard for user_id in users.values())
+
+    # Test case 2: Growing to 4 shards only moves the users of the new shard
+    moved = rebalance(3, 4, url=url, batch_size=7)
+    assert moved == len([name for name in names if shard_for(name, 4) == 3])
+    assert sum(len(_users(shard_url)) for shard_url in shard_urls(url, 4)) == 50
+
+    # Test case 3: Running it again moves nothing
+    assert rebalance(3, 4, url=url) == 0